@@ -0,0 +1,315 @@
+import argparse
+import sys
+from datetime import datetime, timezone
+from typing import List
+
+import numpy as np
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import grading
+import models
+from database import SessionLocal
+
+ANALYTICS_BATCH_SIZE = 1000
+
+# Row order of the per-question sums, matching the QuestionStatistics columns.
+QUESTION_SUMS = ("responses", "score_sum", "score_sq_sum", "total_sum", "total_sq_sum", "cross_sum")
+CHOICE_SUMS = ("selections", "score_sum")
+
+
+def _locked_statistics(db: Session, exam_id: int) -> models.ExamStatistics | None:
+    # The exam's statistics row serializes refreshes. On the first refresh it
+    # is created with content_version 0, which makes the caller reset it.
+    while db.get(models.Exam, exam_id) is not None:
+        db_statistics = db.get(models.ExamStatistics, exam_id, with_for_update=True, populate_existing=True)
+        if db_statistics is not None:
+            return db_statistics
+        db_statistics = models.ExamStatistics(
+            exam_id=exam_id, content_version=0, attempts=0, score_sum=0.0, score_sq_sum=0.0
+        )
+        db.add(db_statistics)
+        try:
+            db.flush()
+            return db_statistics
+        except IntegrityError:
+            # A concurrent first refresh created it (or the exam is gone).
+            db.rollback()
+    return None
+
+
+def _reset(db: Session, db_exam: models.Exam, key: grading.AnswerKey, db_statistics: models.ExamStatistics):
+    # The answer key changed (or there are no statistics yet): start over and
+    # feed every graded attempt through again.
+    db.execute(delete(models.QuestionStatistics).where(models.QuestionStatistics.exam_id == db_exam.id))
+    db.execute(delete(models.ChoiceStatistics).where(models.ChoiceStatistics.exam_id == db_exam.id))
+    db.execute(
+        update(models.Attempt).where(models.Attempt.exam_id == db_exam.id).values(analyzed_at=None)
+    )
+    if len(key.question_ids):
+        db.execute(insert(models.QuestionStatistics), [
+            {"question_id": int(question_id), "exam_id": db_exam.id, **dict.fromkeys(QUESTION_SUMS, 0)}
+            for question_id in key.question_ids
+        ])
+    if len(key.choice_ids):
+        db.execute(insert(models.ChoiceStatistics), [
+            {"choice_id": int(choice_id), "exam_id": db_exam.id, **dict.fromkeys(CHOICE_SUMS, 0)}
+            for choice_id in key.choice_ids
+        ])
+    db_statistics.content_version = db_exam.content_version
+    db_statistics.attempts = 0
+    db_statistics.score_sum = 0.0
+    db_statistics.score_sq_sum = 0.0
+
+
+def _load_sums(db: Session, exam_id: int, key: grading.AnswerKey):
+    # Sums laid out along the answer key's question and choice axes.
+    question_sums = np.zeros((len(QUESTION_SUMS), key.num_questions))
+    rows = db.execute(
+        select(models.QuestionStatistics.question_id,
+               *[getattr(models.QuestionStatistics, name) for name in QUESTION_SUMS])
+        .where(models.QuestionStatistics.exam_id == exam_id)
+    ).all()
+    if rows:
+        values = np.asarray(rows, dtype=np.float64)
+        columns = np.searchsorted(key.question_ids, values[:, 0].astype(np.int64))
+        known = columns < key.num_questions
+        known[known] = key.question_ids[columns[known]] == values[known, 0]
+        question_sums[:, columns[known]] = values[known, 1:].T
+
+    choice_sums = np.zeros((len(CHOICE_SUMS), len(key.choice_ids)))
+    rows = db.execute(
+        select(models.ChoiceStatistics.choice_id,
+               *[getattr(models.ChoiceStatistics, name) for name in CHOICE_SUMS])
+        .where(models.ChoiceStatistics.exam_id == exam_id)
+    ).all()
+    if rows:
+        values = np.asarray(rows, dtype=np.float64)
+        columns = key.choice_columns(values[:, 0].astype(np.int64))
+        choice_sums[:, columns[columns >= 0]] = values[columns >= 0, 1:].T
+    return question_sums, choice_sums
+
+
+def _pending_attempts(db: Session, exam_id: int, after_id: int, limit: int):
+    return db.execute(
+        select(models.Attempt.id, models.Attempt.user_id)
+        .where(
+            models.Attempt.exam_id == exam_id,
+            models.Attempt.graded_at.isnot(None),
+            models.Attempt.analyzed_at.is_(None),
+            models.Attempt.id > after_id,
+        )
+        .order_by(models.Attempt.id)
+        .limit(limit)
+    ).all()
+
+
+def _accumulate(db: Session, key: grading.AnswerKey, attempts, question_sums, choice_sums) -> np.ndarray:
+    attempt_ids = [attempt_id for attempt_id, _ in attempts]
+    answer_rows = db.execute(
+        select(models.Answer.attempt_id, models.Answer.choice_id)
+        .where(models.Answer.attempt_id.in_(attempt_ids))
+    ).all()
+    selections = grading.selection_matrix(key, attempt_ids, answer_rows)
+    given = grading.drawn_mask(db, key, attempts)
+    item_scores, percent = grading.score_selections(key, selections, given)
+
+    weights = given.astype(np.float64)
+    scores = np.where(given, item_scores, 0.0).astype(np.float64)
+    totals = scores.sum(axis=1)
+    question_sums += np.stack([
+        weights.sum(axis=0),
+        scores.sum(axis=0),
+        (scores * scores).sum(axis=0),
+        totals @ weights,
+        (totals * totals) @ weights,
+        totals @ scores,
+    ])
+
+    chosen = (selections & given[:, key.choice_questions]).astype(np.float64)
+    choice_sums += np.stack([chosen.sum(axis=0), percent.astype(np.float64) @ chosen])
+    return percent.astype(np.float64)
+
+
+def refresh_statistics(db: Session, exam_id: int, rebuild: bool = False,
+                       batch_size: int = ANALYTICS_BATCH_SIZE) -> models.ExamStatistics | None:
+    """Folds the graded attempts not yet analyzed into the exam's statistics.
+
+    Only new attempts are read, in batches of ``batch_size``, and added to
+    the stored sums; the statistics themselves are derived when they are read.
+    """
+    db_statistics = _locked_statistics(db, exam_id)
+    if db_statistics is None:
+        return None
+    db_exam = db.get(models.Exam, exam_id)
+
+    key = None
+    if rebuild or db_statistics.content_version != db_exam.content_version:
+        key = grading.build_answer_key(db, exam_id)
+        _reset(db, db_exam, key, db_statistics)
+
+    question_sums = choice_sums = None
+    after_id = 0
+    analyzed_at = datetime.now(timezone.utc)
+    while True:
+        attempts = _pending_attempts(db, exam_id, after_id, batch_size)
+        if not attempts:
+            break
+        if key is None:
+            key = grading.build_answer_key(db, exam_id)
+        if question_sums is None:
+            question_sums, choice_sums = _load_sums(db, exam_id, key)
+        percent = _accumulate(db, key, attempts, question_sums, choice_sums)
+        db_statistics.attempts += len(attempts)
+        db_statistics.score_sum += float(percent.sum())
+        db_statistics.score_sq_sum += float((percent * percent).sum())
+        attempt_ids = [attempt_id for attempt_id, _ in attempts]
+        db.execute(update(models.Attempt).where(models.Attempt.id.in_(attempt_ids)).values(analyzed_at=analyzed_at))
+        after_id = attempt_ids[-1]
+
+    if question_sums is not None:
+        db.execute(update(models.QuestionStatistics), [
+            {"question_id": int(question_id), "responses": int(column[0]),
+             **dict(zip(QUESTION_SUMS[1:], map(float, column[1:])))}
+            for question_id, column in zip(key.question_ids, question_sums.T)
+        ])
+        db.execute(update(models.ChoiceStatistics), [
+            {"choice_id": int(choice_id), "selections": int(column[0]), "score_sum": float(column[1])}
+            for choice_id, column in zip(key.choice_ids, choice_sums.T)
+        ])
+    if key is not None:
+        db_statistics.refreshed_at = analyzed_at
+        db.commit()
+    else:
+        db.rollback()  # Nothing changed; release the row lock.
+    return db_statistics
+
+
+def _optional(values: np.ndarray) -> List[float | None]:
+    # Adding 0.0 turns the -0.0 left by rounding tiny negative errors into 0.0.
+    return [None if not np.isfinite(value) else round(float(value), 4) + 0.0 for value in values]
+
+
+def item_statistics(sums: np.ndarray) -> dict:
+    """Derives difficulty and discrimination for each question from its sums.
+
+    The p-value is the mean item score. Discrimination is the point-biserial
+    (Pearson) correlation between the item score and the rest of the attempt,
+    i.e. the total without the item itself.
+    """
+    n, sum_x, sum_xx, sum_t, sum_tt, sum_xt = sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_value = sum_x / n
+        sum_r = sum_t - sum_x
+        sum_rr = sum_tt - 2 * sum_xt + sum_xx
+        sum_xr = sum_xt - sum_xx
+        var_x = sum_xx / n - p_value ** 2
+        var_r = sum_rr / n - (sum_r / n) ** 2
+        covariance = sum_xr / n - p_value * sum_r / n
+        discrimination = np.where((var_x > 1e-12) & (var_r > 1e-12), covariance / np.sqrt(var_x * var_r), np.nan)
+    return {"p_value": p_value, "variance": var_x, "discrimination": discrimination}
+
+
+def cronbach_alpha(item_variances: np.ndarray, total_variance: float) -> float | None:
+    k = len(item_variances)
+    if k < 2 or not np.all(np.isfinite(item_variances)) or total_variance <= 1e-12:
+        return None
+    return float(k / (k - 1) * (1 - item_variances.sum() / total_variance))
+
+
+def exam_analytics(db: Session, exam_id: int) -> dict | None:
+    """Refreshes the exam's statistics and derives the report from the sums."""
+    db_statistics = refresh_statistics(db, exam_id)
+    if db_statistics is None:
+        return None
+    question_rows = db.execute(
+        select(models.QuestionStatistics.question_id,
+               *[getattr(models.QuestionStatistics, name) for name in QUESTION_SUMS])
+        .where(models.QuestionStatistics.exam_id == exam_id)
+        .order_by(models.QuestionStatistics.question_id)
+    ).all()
+    choice_rows = db.execute(
+        select(models.ChoiceStatistics.choice_id, models.Choice.question_id, models.Choice.is_correct,
+               *[getattr(models.ChoiceStatistics, name) for name in CHOICE_SUMS])
+        .join(models.Choice, models.Choice.id == models.ChoiceStatistics.choice_id)
+        .where(models.ChoiceStatistics.exam_id == exam_id)
+        .order_by(models.Choice.question_id, models.ChoiceStatistics.choice_id)
+    ).all()
+
+    question_ids = np.asarray([row[0] for row in question_rows], dtype=np.int64)
+    sums = np.asarray([row[1:] for row in question_rows], dtype=np.float64).reshape(-1, len(QUESTION_SUMS)).T
+    items = item_statistics(sums)
+
+    attempts = db_statistics.attempts
+    mean_score = score_std = alpha = None
+    if attempts:
+        mean_score = db_statistics.score_sum / attempts
+        score_std = float(np.sqrt(max(db_statistics.score_sq_sum / attempts - mean_score ** 2, 0.0)))
+        questions_per_attempt = db.get(models.Exam, exam_id).questions_per_attempt
+        # Alpha needs every student to answer the same items, so pooled exams get none.
+        if questions_per_attempt is None or questions_per_attempt >= len(question_ids):
+            # Scores are percentages of the item count; alpha works on total points.
+            alpha = cronbach_alpha(items["variance"], (score_std * len(question_ids) / 100) ** 2)
+            alpha = None if alpha is None else _optional(np.asarray([alpha]))[0]
+
+    choices = {}
+    if choice_rows:
+        responses = sums[0][np.searchsorted(question_ids, [row.question_id for row in choice_rows])]
+        selections = np.asarray([row.selections for row in choice_rows], dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = _optional(selections / responses)
+            selector_scores = _optional(np.asarray([row.score_sum for row in choice_rows]) / selections)
+        for row, rate, selector_score in zip(choice_rows, rates, selector_scores):
+            choices.setdefault(row.question_id, []).append({
+                "choice_id": row.choice_id,
+                "is_correct": row.is_correct,
+                "selections": int(row.selections),
+                "selection_rate": rate,
+                "mean_score": selector_score,
+            })
+
+    return {
+        "exam_id": exam_id,
+        "attempts": attempts,
+        "mean_score": mean_score,
+        "score_std": score_std,
+        "cronbach_alpha": alpha,
+        "refreshed_at": db_statistics.refreshed_at,
+        "questions": [
+            {
+                "question_id": int(question_id),
+                "responses": int(responses),
+                "p_value": p_value,
+                "discrimination": discrimination,
+                "choices": choices.get(int(question_id), []),
+            }
+            for question_id, responses, p_value, discrimination in zip(
+                question_ids, sums[0], _optional(items["p_value"]), _optional(items["discrimination"])
+            )
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the exam statistics.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser("refresh", help="Fold newly graded attempts into the statistics")
+    refresh_parser.add_argument("--exam-id", type=int, action="append",
+                                help="Exam to refresh; repeat for several, all exams when omitted")
+    refresh_parser.add_argument("--rebuild", action="store_true", help="Recompute from all graded attempts")
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        exam_ids = args.exam_id or db.execute(select(models.Exam.id).order_by(models.Exam.id)).scalars().all()
+        for exam_id in exam_ids:
+            db_statistics = refresh_statistics(db, exam_id, rebuild=args.rebuild)
+            if db_statistics is None:
+                print(f"Exam {exam_id} not found", file=sys.stderr)
+                continue
+            print(f"Exam {exam_id}: {db_statistics.attempts} attempts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud
+import http_cache
+import models
+
+
+async def get_exam_version(db: AsyncSession, exam_id: int) -> int | None:
+    version = await http_cache.exam_versions.get_async(exam_id)
+    if version is None:
+        result = await db.execute(select(models.Exam.content_version).where(models.Exam.id == exam_id))
+        version = result.scalar()
+        if version is not None:
+            await http_cache.exam_versions.fill_async(exam_id, version)
+    return version or None
+
+
+async def read_exam(db: AsyncSession, exam_id: int):
+    result = await db.execute(select(models.Exam).where(models.Exam.id == exam_id))
+    return result.scalars().first()
+
+
+async def read_exam_bundle(db: AsyncSession, exam_id: int, include_choices: bool = True):
+    result = await db.execute(crud.exam_bundle_statement(exam_id, include_choices))
+    return result.scalars().first()
+
+
+async def read_exams(
+    db: AsyncSession,
+    owner_id: int | None = None,
+    title: str | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> List[dict]:
+    result = await db.execute(crud.exams_listing_statement(owner_id, title, after_id, limit))
+    return [row._asdict() for row in result.all()]
+
+
+async def get_questions_by_exam(db: AsyncSession, exam_id: int):
+    result = await db.execute(crud.questions_by_exam_statement(exam_id))
+    questions = result.scalars().all()
+    if not questions:
+        return []
+    return questions
@@ -0,0 +1,414 @@
+import abc
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+
+import numpy as np
+
+SCENARIOS = ("login_storm", "exam_taker", "question_redactor", "list_exams")
+PASSWORD = "benchmark"
+TEACHER_PREFIX = "bench-teacher-"
+STUDENT_PREFIX = "bench-student-"
+STUDENT_TOKENS = 20
+EDITS_PER_SAVE = 5
+LIST_PAGE_SIZE = 50
+QUERY_TOLERANCE = 0.5
+_QUERY_METRIC = re.compile(r'^db_queries_per_request_(sum|count)\{method="[^"]*",route="([^"]*)"\} (\S+)$')
+
+
+def _configure_database(url: str | None):
+    # database.py reads DATABASE_URL at import time, so this has to run
+    # before anything from the app is imported.
+    if url:
+        os.environ["DATABASE_URL"] = url
+    os.environ.setdefault("DATABASE_URL", "sqlite:///./benchmark.db")
+
+
+def _alembic(command: str, revision: str):
+    from alembic import command as alembic_command
+    from alembic.config import Config
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(here, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(here, "migrations"))
+    getattr(alembic_command, command)(config, revision)
+
+
+def seed(args):
+    from sqlalchemy import func, insert, select
+
+    import models
+    import question_bank
+    import schemas
+    from database import SessionLocal
+    from passwords import hasher
+
+    if args.reset:
+        _alembic("downgrade", "base")
+    _alembic("upgrade", "head")
+
+    rng = random.Random(args.seed)
+    with SessionLocal() as db:
+        if db.execute(select(func.count(models.User.id))).scalar():
+            sys.exit("The database already has data; pass --reset to recreate it.")
+
+        # Every synthetic user shares one hash; hashing thousands of passwords
+        # would dominate the seeding time without making the data any more real.
+        hashed_password = hasher.hash(PASSWORD)
+        users = [
+            {"username": f"{prefix}{n}", "email": f"{prefix}{n}@example.com", "hashed_password": hashed_password,
+             "name": "Bench", "surname": str(n), "role": role}
+            for prefix, count, role in ((TEACHER_PREFIX, args.teachers, "teacher"),
+                                        (STUDENT_PREFIX, args.students, "student"))
+            for n in range(count)
+        ]
+        db.execute(insert(models.User), users)
+        teacher_ids = db.execute(
+            select(models.User.id).where(models.User.role == "teacher").order_by(models.User.id)
+        ).scalars().all()
+
+        exam_ids = db.execute(
+            insert(models.Exam).returning(models.Exam.id, sort_by_parameter_order=True),
+            [
+                {"title": f"Benchmark exam {teacher_id}-{n}", "description": "Synthetic benchmark data",
+                 "owner_id": teacher_id}
+                for teacher_id in teacher_ids
+                for n in range(args.exams_per_teacher)
+            ],
+        ).scalars().all()
+
+        for exam_id in exam_ids:
+            questions = []
+            for n in range(args.questions_per_exam):
+                is_multiple_choice = rng.random() < 0.5
+                correct = set(rng.sample(range(args.choices_per_question),
+                                         rng.randint(1, 2) if is_multiple_choice else 1))
+                questions.append(schemas.QuestionCreate(
+                    question_text=f"Question {n} of exam {exam_id}: {rng.randrange(10 ** 6)}?",
+                    is_multiple_choice=is_multiple_choice,
+                    choices=[
+                        schemas.ChoiceCreate(choice_text=f"Choice {c} ({rng.randrange(10 ** 6)})", is_correct=c in correct)
+                        for c in range(args.choices_per_question)
+                    ],
+                ))
+            question_bank._insert_batch(db, exam_id, questions)
+        db.commit()
+
+    print(f"Seeded {args.teachers} teachers, {args.students} students, {len(exam_ids)} exams, "
+          f"{len(exam_ids) * args.questions_per_exam} questions")
+
+
+def load_dataset() -> dict:
+    from sqlalchemy import func, select
+
+    import models
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        teachers = db.execute(
+            select(models.User.id, models.User.username)
+            .where(models.User.username.like(f"{TEACHER_PREFIX}%"))
+            .order_by(models.User.id)
+        ).all()
+        exams = db.execute(select(models.Exam.id, models.Exam.owner_id).order_by(models.Exam.id)).all()
+        students = db.execute(
+            select(models.User.username).where(models.User.username.like(f"{STUDENT_PREFIX}%")).order_by(models.User.id)
+        ).scalars().all()
+        questions = db.execute(select(func.count(models.Question.id))).scalar()
+        # Open attempts on the first exam are reused by exam_taker, so repeated
+        # runs do not keep adding attempts.
+        open_attempts = dict(db.execute(
+            select(models.User.username, func.max(models.Attempt.id))
+            .join(models.Attempt, models.Attempt.user_id == models.User.id)
+            .where(models.User.username.like(f"{STUDENT_PREFIX}%"),
+                   models.Attempt.exam_id == select(func.min(models.Exam.id)).scalar_subquery(),
+                   models.Attempt.submitted_at.is_(None))
+            .group_by(models.User.username)
+        ).all())
+    if not teachers or not students or not exams:
+        sys.exit("No benchmark data found; run 'python benchmark.py seed' first.")
+    exams_by_owner = {}
+    for exam in exams:
+        exams_by_owner.setdefault(exam.owner_id, []).append(exam.id)
+    return {
+        "teachers": [(teacher.username, exams_by_owner.get(teacher.id, [])) for teacher in teachers],
+        "students": students,
+        "exam_ids": [exam.id for exam in exams],
+        "questions": questions,
+        "open_attempts": open_attempts,
+    }
+
+
+async def login(client, username: str) -> dict:
+    response = await client.post("/token", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def query_totals(client) -> tuple | None:
+    response = await client.get("/metrics")
+    if response.status_code != 200:
+        return None
+    totals = {"sum": 0.0, "count": 0.0}
+    for line in response.text.splitlines():
+        match = _QUERY_METRIC.match(line)
+        if match and match.group(2) != "/metrics":
+            totals[match.group(1)] += float(match.group(3))
+    return totals["sum"], totals["count"]
+
+
+class Scenario(abc.ABC):
+    def __init__(self, client, dataset: dict):
+        self.client = client
+        self.dataset = dataset
+        self.latencies = []
+        self.errors = 0
+
+    async def setup(self):
+        pass
+
+    async def request(self, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception:
+            self.errors += 1
+            return None
+        self.latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+    @abc.abstractmethod
+    async def operation(self, n: int):
+        """Runs the n-th operation of the scenario through self.request."""
+
+
+class LoginStorm(Scenario):
+    async def operation(self, n: int):
+        students = self.dataset["students"]
+        await self.request("POST", "/token", data={"username": students[n % len(students)], "password": PASSWORD})
+
+
+class ExamTaker(Scenario):
+    # Many students opening the same exam at once, as ExamTaker.jsx does: each
+    # one starts (or resumes) an attempt and loads the questions drawn for it.
+    async def setup(self):
+        exam_id = self.dataset["exam_ids"][0]
+        self.attempts = []
+        for username in self.dataset["students"][:STUDENT_TOKENS]:
+            headers = await login(self.client, username)
+            attempt_id = self.dataset["open_attempts"].get(username)
+            if attempt_id is None:
+                response = await self.client.post(f"/exam/{exam_id}/attempts", headers=headers)
+                response.raise_for_status()
+                attempt_id = response.json()["id"]
+            self.attempts.append((headers, attempt_id))
+
+    async def operation(self, n: int):
+        headers, attempt_id = self.attempts[n % len(self.attempts)]
+        await self.request("GET", f"/attempts/{attempt_id}/exam", headers=headers)
+
+
+class QuestionRedactor(Scenario):
+    # Load the exam and its questions, then save a handful of edits in one
+    # PATCH batch, following QuestionRedactor.jsx.
+    async def setup(self):
+        self.teachers = [
+            (await login(self.client, username), exam_ids)
+            for username, exam_ids in self.dataset["teachers"]
+            if exam_ids
+        ]
+        # Stamped per run so every save really changes the questions, even
+        # against a database an earlier run already edited.
+        self.run_id = int(time.time())
+
+    async def operation(self, n: int):
+        headers, exam_ids = self.teachers[n % len(self.teachers)]
+        exam_id = exam_ids[(n // len(self.teachers)) % len(exam_ids)]
+        await self.request("GET", f"/exam/{exam_id}", headers=headers)
+        response = await self.request("GET", f"/exams/{exam_id}/questions", headers=headers)
+        if response is None or response.status_code != 200:
+            return
+        questions = response.json()
+        edits = []
+        for question in questions[n % max(1, len(questions)):][:EDITS_PER_SAVE]:
+            edits.append({
+                "id": question["id"],
+                "question_text": re.sub(r"( \(edit [\d-]+\))?$", f" (edit {self.run_id}-{n})", question["question_text"], count=1),
+                "is_multiple_choice": question["is_multiple_choice"],
+                "image_path": question["image_path"],
+                "choices": [
+                    {"id": choice["id"], "choice_text": choice["choice_text"], "is_correct": choice["is_correct"]}
+                    for choice in question["choices"]
+                ],
+            })
+        if edits:
+            await self.request("PATCH", f"/exam/{exam_id}/questions", json=edits, headers=headers)
+
+
+class ListExams(Scenario):
+    async def operation(self, n: int):
+        exam_ids = self.dataset["exam_ids"]
+        after_id = exam_ids[(n * LIST_PAGE_SIZE) % len(exam_ids)] - 1
+        await self.request("GET", "/exams/", params={"limit": LIST_PAGE_SIZE, "after_id": after_id})
+
+
+SCENARIO_CLASSES = {
+    "login_storm": LoginStorm,
+    "exam_taker": ExamTaker,
+    "question_redactor": QuestionRedactor,
+    "list_exams": ListExams,
+}
+
+
+async def drive(scenario: Scenario, operations: int, concurrency: int) -> float:
+    counter = iter(range(operations))
+
+    async def worker():
+        for n in counter:
+            await scenario.operation(n)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def run_scenario(client, dataset: dict, name: str, args) -> dict:
+    scenario = SCENARIO_CLASSES[name](client, dataset)
+    await scenario.setup()
+    await drive(scenario, args.warmup, args.concurrency)
+    scenario.latencies, scenario.errors = [], 0
+
+    before = await query_totals(client)
+    elapsed = await drive(scenario, args.requests, args.concurrency)
+    after = await query_totals(client)
+
+    latencies_ms = np.array(scenario.latencies) * 1000
+    queries = None
+    if before and after and after[1] > before[1]:
+        queries = round((after[0] - before[0]) / (after[1] - before[1]), 2)
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies_ms) else (0.0, 0.0, 0.0)
+    return {
+        "operations": args.requests,
+        "requests": len(scenario.latencies),
+        "errors": scenario.errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(scenario.latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "queries_per_request": queries,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    if baseline.get("meta", {}).get("dataset") != results["meta"]["dataset"]:
+        print("warning: the baseline was recorded against a different dataset", file=sys.stderr)
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms vs {previous['p95_ms']} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']} rps vs {previous['throughput_rps']} rps")
+        if (current["queries_per_request"] is not None and previous.get("queries_per_request") is not None
+                and current["queries_per_request"] > previous["queries_per_request"] + QUERY_TOLERANCE):
+            regressions.append(f"{name}: {current['queries_per_request']} queries per request "
+                               f"vs {previous['queries_per_request']}")
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{name}: {current['errors']} errors vs {previous.get('errors', 0)}")
+    return regressions
+
+
+async def run(args) -> int:
+    import httpx
+
+    dataset = load_dataset()
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        import main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark", timeout=60)
+
+    from sqlalchemy.engine import make_url
+    results = {
+        "meta": {
+            "dataset": {
+                "teachers": len(dataset["teachers"]),
+                "students": len(dataset["students"]),
+                "exams": len(dataset["exam_ids"]),
+                "questions": dataset["questions"],
+            },
+            "database": make_url(os.environ["DATABASE_URL"]).get_backend_name(),
+            "target": args.base_url or "in-process",
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "scenarios": {},
+    }
+    async with client:
+        for name in args.scenarios:
+            results["scenarios"][name] = await run_scenario(client, dataset, name, args)
+            stats = results["scenarios"][name]
+            print(f"{name:<18} {stats['throughput_rps']:>8} rps  p50 {stats['p50_ms']:>8} ms  "
+                  f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  "
+                  f"queries/req {stats['queries_per_request']}  errors {stats['errors']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed synthetic data and benchmark the API.")
+    parser.add_argument("--database-url", help="Defaults to DATABASE_URL, or sqlite:///./benchmark.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed")
+    seed_parser.add_argument("--teachers", type=int, default=10)
+    seed_parser.add_argument("--students", type=int, default=500)
+    seed_parser.add_argument("--exams-per-teacher", type=int, default=10)
+    seed_parser.add_argument("--questions-per-exam", type=int, default=30)
+    seed_parser.add_argument("--choices-per-question", type=int, default=4)
+    seed_parser.add_argument("--seed", type=int, default=42)
+    seed_parser.add_argument("--reset", action="store_true", help="Drop and recreate the schema first")
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    run_parser.add_argument("--requests", type=int, default=500, help="Operations per scenario")
+    run_parser.add_argument("--warmup", type=int, default=20, help="Unrecorded operations per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=20)
+    run_parser.add_argument("--base-url", help="Benchmark a running server instead of the app in-process")
+    run_parser.add_argument("--output", help="Write the results as a JSON baseline")
+    run_parser.add_argument("--compare", help="Baseline JSON to compare against; exits 1 on regressions")
+    run_parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed relative change in p95 latency and throughput")
+    args = parser.parse_args(argv)
+
+    _configure_database(args.database_url)
+    if args.command == "seed":
+        seed(args)
+        return 0
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
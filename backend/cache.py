@@ -0,0 +1,300 @@
+import contextlib
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+CACHE_SHARED_BACKEND = os.getenv("CACHE_SHARED_BACKEND", "").lower()  # "", "redis" or "file"
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_TIMEOUT_SECONDS = float(os.getenv("CACHE_REDIS_TIMEOUT_SECONDS", "0.1"))
+CACHE_RETRY_SECONDS = float(os.getenv("CACHE_RETRY_SECONDS", "5"))
+CACHE_FILE_DIR = os.getenv("CACHE_FILE_DIR", "/dev/shm/exam-cache")
+CACHE_FILE_MAX_BYTES = int(os.getenv("CACHE_FILE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_SHARED_TTL_SECONDS = int(os.getenv("CACHE_SHARED_TTL_SECONDS", "86400"))
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "exam-guru:")
+
+logger = logging.getLogger(__name__)
+
+
+class LRUTier:
+    # In-process tier: any Python value, bounded by entry count and, for
+    # bytes values, by their total size. Other values count as zero bytes.
+    def __init__(self, max_entries: int, max_bytes: int | None = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(value) -> int:
+        return len(value) if isinstance(value, (bytes, bytearray)) else 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self._size(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self._size(previous)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # Would evict everything else and still not fit.
+            self._entries[key] = value
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+
+    def discard_where(self, predicate) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self.bytes -= self._size(self._entries.pop(key))
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class SharedTier:
+    # Byte values under string keys, shared by all workers. Failures are
+    # counted and treated as misses: the shared tier must never break a read.
+    # After a failure, calls are skipped for retry_seconds, so an unreachable
+    # tier costs one timeout per interval rather than one per call.
+    name = "shared"
+
+    def __init__(self, retry_seconds: float = CACHE_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.skipped = 0
+        self._failing = False
+        self._retry_at = 0.0
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _skip(self) -> bool:
+        if time.monotonic() >= self._retry_at:
+            return False
+        self._count("skipped")
+        return True
+
+    def _failed(self, operation: str, error: Exception):
+        with self._lock:
+            self.errors += 1
+            self._retry_at = time.monotonic() + self.retry_seconds
+            failing, self._failing = self._failing, True
+        if not failing:
+            logger.warning(f"{self.name} cache {operation} failed, serving without it: {error}")
+
+    def _recovered(self):
+        if self._failing:
+            self._failing = False
+            logger.info(f"{self.name} cache recovered")
+
+    def get(self, key: str) -> bytes | None:
+        if self._skip():
+            self._count("misses")
+            return None
+        try:
+            value = self._get(key)
+        except Exception as e:
+            self._failed("get", e)
+            return None
+        self._recovered()
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value: bytes, ttl: int | None = None, only_if_absent: bool = False) -> bool:
+        if self._skip():
+            return False
+        try:
+            stored = self._set(key, value, ttl or CACHE_SHARED_TTL_SECONDS, only_if_absent)
+        except Exception as e:
+            self._failed("set", e)
+            return False
+        self._recovered()
+        return stored
+
+    def delete(self, key: str):
+        if self._skip():
+            return
+        try:
+            self._delete(key)
+        except Exception as e:
+            self._failed("delete", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "skipped": self.skipped,
+            }
+
+
+class RedisTier(SharedTier):
+    name = "redis"
+
+    def __init__(self, url: str, timeout: float = CACHE_REDIS_TIMEOUT_SECONDS, client=None):
+        super().__init__()
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("CACHE_SHARED_BACKEND=redis requires the redis package")
+            client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.client = client
+
+    def _get(self, key: str):
+        return self.client.get(CACHE_KEY_PREFIX + key)
+
+    def _set(self, key: str, value: bytes, ttl: int, only_if_absent: bool) -> bool:
+        return bool(self.client.set(CACHE_KEY_PREFIX + key, value, ex=ttl, nx=only_if_absent))
+
+    def _delete(self, key: str):
+        self.client.delete(CACHE_KEY_PREFIX + key)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        # Redis evicts on its own (maxmemory policy); report the server's count.
+        try:
+            stats["evictions"] = int(self.client.info("stats").get("evicted_keys", 0))
+        except Exception:
+            pass
+        return stats
+
+
+class FileTier(SharedTier):
+    # One file per key in a directory shared by the workers of one host,
+    # ideally on tmpfs such as /dev/shm. Each file starts with its expiry
+    # time. Files are replaced atomically, and hits refresh the mtime so the
+    # size sweep removes the least recently used files first.
+    name = "file"
+    _HEADER = struct.Struct(">d")
+
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256((CACHE_KEY_PREFIX + key).encode()).hexdigest())
+
+    def _get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        (expires_at,) = self._HEADER.unpack_from(data)
+        if expires_at < time.time():
+            self._delete(key)
+            return None
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return data[self._HEADER.size:]
+
+    def _set(self, key: str, value: bytes, ttl: int, only_if_absent: bool) -> bool:
+        path = self._path(key)
+        temporary = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        with open(temporary, "wb") as file:
+            file.write(self._HEADER.pack(time.time() + ttl))
+            file.write(value)
+        try:
+            if only_if_absent:
+                try:
+                    os.link(temporary, path)
+                except FileExistsError:
+                    if self._get(key) is not None:
+                        return False
+                    os.replace(temporary, path)  # The existing file had expired.
+                    temporary = None
+            else:
+                os.replace(temporary, path)
+                temporary = None
+        finally:
+            if temporary is not None:
+                os.unlink(temporary)
+        self._written += len(value) + self._HEADER.size
+        if self._written >= self.max_bytes // 16:
+            self._sweep()
+        return True
+
+    def _delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _sweep(self):
+        # Runs after every max_bytes / 16 written by this worker, so the
+        # directory can overshoot its budget only briefly.
+        self._written = 0
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("."):
+                continue  # Another worker's file still being written.
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            self._count("evictions")
+            total -= size
+            if total <= self.max_bytes * 0.9:
+                break
+
+
+def shared_tier_from_env() -> SharedTier | None:
+    if CACHE_SHARED_BACKEND == "redis":
+        return RedisTier(CACHE_REDIS_URL)
+    if CACHE_SHARED_BACKEND == "file":
+        return FileTier(CACHE_FILE_DIR, CACHE_FILE_MAX_BYTES)
+    if CACHE_SHARED_BACKEND:
+        raise ValueError(f"Unknown CACHE_SHARED_BACKEND '{CACHE_SHARED_BACKEND}', expected redis or file")
+    return None
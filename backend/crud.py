@@ -1,13 +1,19 @@
+from datetime import datetime, timezone
 from typing import Any, List
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, delete, event, func, insert, select, tuple_, update
+from sqlalchemy.orm import Session, selectinload
 import models
+import duplicates
+import http_cache
 import schemas
-from passlib.context import CryptContext
+import search
+from passwords import hasher
+from principals import Principal, principal_cache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str | None = None):
+    if hashed_password is None:
+        hashed_password = hasher.hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
@@ -34,45 +40,132 @@ def get_user_id(db: Session, username: str) -> Any | None:
     return None
 
 
-def update_user(db: Session, user_id: int, user_update: schemas.UserCreate):
+def get_principal(db: Session, user_id: int) -> Principal | None:
+    row = (
+        db.query(models.User.id, models.User.username, models.User.role)
+        .filter(models.User.id == user_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return Principal(id=row.id, username=row.username, role=row.role)
+
+
+def update_user(db: Session, user_id: int, user_update: schemas.UserCreate, hashed_password: str | None = None):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not db_user:
         return None
 
     db_user.username = user_update.username
     db_user.email = user_update.email
-    db_user.hashed_password = pwd_context.hash(user_update.password)
+    db_user.hashed_password = hashed_password or hasher.hash(user_update.password)
     db_user.name = user_update.name
     db_user.surname = user_update.surname
     db_user.role = user_update.role
 
     db.commit()
     db.refresh(db_user)
+    principal_cache.invalidate(user_id)
     return db_user
 
 
+def set_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update({"hashed_password": hashed_password})
+    db.commit()
+
+
+def reindex_questions(db: Session, question_ids: List[int]):
+    # Keeps the search and near-duplicate indexes in step with question changes.
+    search.reindex_questions(db, question_ids)
+    duplicates.reindex_questions(db, question_ids)
+
+
 def delete_user(db: Session, user_id: int):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not db_user:
         return None
 
+    question_ids = db.execute(
+        select(models.Question.id).join(models.Exam).where(models.Exam.owner_id == user_id)
+    ).scalars().all()
+    exam_ids = db.execute(select(models.Exam.id).where(models.Exam.owner_id == user_id)).scalars().all()
+    _changed_exam_versions(db).update(dict.fromkeys(exam_ids))
     db.delete(db_user)
+    reindex_questions(db, question_ids)
     db.commit()
+    principal_cache.revoke(user_id)
     return True
 
 
-def get_users(db: Session):
-    users = db.query(models.User).all()
-    if not users:
-        return []
-    return users
+def _prefix(column, prefix: str):
+    # LIKE 'prefix%' is served by the *_pattern indexes on PostgreSQL whatever
+    # the collation. SQLite's LIKE ignores ASCII case, so the prefix is
+    # compared once more to keep the match case-sensitive everywhere.
+    return and_(column.startswith(prefix, autoescape=True), func.substr(column, 1, len(prefix)) == prefix)
+
+
+def _filter_users(statement, role: str | None = None, username: str | None = None, email: str | None = None):
+    if role is not None:
+        statement = statement.where(models.User.role == role)
+    if username:
+        statement = statement.where(_prefix(models.User.username, username))
+    if email:
+        statement = statement.where(_prefix(models.User.email, email))
+    return statement
+
+
+def users_listing_statement(
+    role: str | None = None,
+    username: str | None = None,
+    email: str | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+):
+    statement = _filter_users(
+        select(
+            models.User.id,
+            models.User.username,
+            models.User.email,
+            models.User.name,
+            models.User.surname,
+            models.User.role,
+        ),
+        role, username, email,
+    )
+    if after_id is not None:
+        statement = statement.where(models.User.id > after_id)
+    statement = statement.order_by(models.User.id)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def get_users(
+    db: Session,
+    role: str | None = None,
+    username: str | None = None,
+    email: str | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> List[dict]:
+    rows = db.execute(users_listing_statement(role, username, email, after_id, limit)).all()
+    return [row._asdict() for row in rows]
+
+
+def count_users(db: Session, role: str | None = None, username: str | None = None, email: str | None = None) -> int:
+    return db.execute(_filter_users(select(func.count(models.User.id)), role, username, email)).scalar()
 
 
 def create_exam(db: Session, exam: schemas.ExamCreate, user_id: int):
     db_exam = models.Exam(
         title=exam.title,
         description=exam.description,
-        owner_id=user_id
+        owner_id=user_id,
+        questions_per_attempt=exam.questions_per_attempt,
+        shuffle_questions=exam.shuffle_questions,
+        shuffle_choices=exam.shuffle_choices,
+        duration_minutes=exam.duration_minutes,
+        closes_at=exam.closes_at
     )
     db.add(db_exam)
     db.commit()
@@ -80,23 +173,106 @@ def create_exam(db: Session, exam: schemas.ExamCreate, user_id: int):
     return db_exam
 
 
+def _changed_exam_versions(db: Session) -> dict:
+    # Versions written by the current transaction, published once it commits.
+    return db.info.setdefault("changed_exam_versions", {})
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_exam_versions(session: Session):
+    versions = session.info.pop("changed_exam_versions", None)
+    if versions:
+        http_cache.exam_versions.publish(versions)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_exam_versions(session: Session):
+    session.info.pop("changed_exam_versions", None)
+
+
+def _bump_version(db: Session, exam_id):
+    row = db.execute(
+        update(models.Exam)
+        .where(models.Exam.id == exam_id)
+        .values(content_version=models.Exam.content_version + 1)
+        .returning(models.Exam.id, models.Exam.content_version)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is not None:
+        _changed_exam_versions(db)[row.id] = row.content_version
+
+
+def bump_exam_version(db: Session, exam_id: int):
+    # Every change to an exam's content goes through here so the version can
+    # drive ETags and cache keys. Runs inside the caller's transaction; the
+    # new version is published to the shared cache after the commit.
+    _bump_version(db, exam_id)
+
+
+def bump_question_exam_version(db: Session, question_id: int):
+    _bump_version(db, select(models.Question.exam_id).where(models.Question.id == question_id).scalar_subquery())
+
+
+def get_exam_version(db: Session, exam_id: int) -> int | None:
+    version = http_cache.exam_versions.get(exam_id)
+    if version is None:
+        version = db.execute(select(models.Exam.content_version).where(models.Exam.id == exam_id)).scalar()
+        if version is not None:
+            http_cache.exam_versions.fill(exam_id, version)
+    return version or None  # 0 marks a deleted exam.
+
+
 def read_exam(db: Session, exam_id: int):
     db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     return db_exam
 
 
-def read_exams(db: Session) -> List[dict]:
-    exams = db.query(models.Exam).all()
-    response = []
-    for exam in exams:
-        response.append({
-            "id": exam.id,
-            "title": exam.title,
-            "description": exam.description,
-            "owner_id": exam.owner_id,
-            "num_questions": len(exam.questions)
-        })
-    return response
+def exam_bundle_statement(exam_id: int, include_choices: bool = True):
+    # One query per level of the tree instead of one per question.
+    questions_loader = selectinload(models.Exam.questions)
+    if include_choices:
+        questions_loader = questions_loader.selectinload(models.Question.choices)
+    return select(models.Exam).options(questions_loader).where(models.Exam.id == exam_id)
+
+
+def read_exam_bundle(db: Session, exam_id: int, include_choices: bool = True):
+    return db.execute(exam_bundle_statement(exam_id, include_choices)).scalars().first()
+
+
+def exams_listing_statement(
+    owner_id: int | None = None,
+    title: str | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+):
+    statement = select(
+        models.Exam.id,
+        models.Exam.title,
+        models.Exam.description,
+        models.Exam.owner_id,
+        models.Exam.num_questions.label("num_questions"),
+    )
+    if owner_id is not None:
+        statement = statement.where(models.Exam.owner_id == owner_id)
+    if title:
+        statement = statement.where(models.Exam.title.icontains(title, autoescape=True))
+    if after_id is not None:
+        statement = statement.where(models.Exam.id > after_id)
+    statement = statement.order_by(models.Exam.id)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def read_exams(
+    db: Session,
+    owner_id: int | None = None,
+    title: str | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> List[dict]:
+    rows = db.execute(exams_listing_statement(owner_id, title, after_id, limit)).all()
+    return [row._asdict() for row in rows]
 
 
 def update_exam(db: Session, exam_id: int, exam_update: schemas.ExamCreate):
@@ -106,6 +282,12 @@ def update_exam(db: Session, exam_id: int, exam_update: schemas.ExamCreate):
 
     db_exam.title = exam_update.title
     db_exam.description = exam_update.description
+    # Pool and timing settings are only replaced when sent, so clients that
+    # edit just the title and description leave them alone.
+    for field in ("questions_per_attempt", "shuffle_questions", "shuffle_choices", "duration_minutes", "closes_at"):
+        if field in exam_update.model_fields_set:
+            setattr(db_exam, field, getattr(exam_update, field))
+    bump_exam_version(db, exam_id)
 
     db.commit()
     db.refresh(db_exam)
@@ -117,7 +299,10 @@ def delete_exam(db: Session, exam_id: int):
     if not db_exam:
         return None
 
+    question_ids = db.execute(select(models.Question.id).where(models.Question.exam_id == exam_id)).scalars().all()
+    _changed_exam_versions(db)[exam_id] = None
     db.delete(db_exam)
+    reindex_questions(db, question_ids)
     db.commit()
     return True
 
@@ -130,8 +315,7 @@ def create_question(db: Session, question: schemas.QuestionCreate, exam_id: int)
         image_path=question.image_path  # Include the image_path
     )
     db.add(db_question)
-    db.commit()
-    db.refresh(db_question)
+    db.flush()
 
     for choice in question.choices:
         db_choice = models.Choice(
@@ -141,36 +325,100 @@ def create_question(db: Session, question: schemas.QuestionCreate, exam_id: int)
         )
         db.add(db_choice)
 
+    bump_exam_version(db, exam_id)
+    reindex_questions(db, [db_question.id])
     db.commit()
     return db_question
 
 
+def _apply_choice_update(db_choice: models.Choice, choice: schemas.ChoiceCreate) -> bool:
+    changed = False
+    if db_choice.choice_text != choice.choice_text:
+        db_choice.choice_text = choice.choice_text
+        changed = True
+    if db_choice.is_correct != choice.is_correct:
+        db_choice.is_correct = choice.is_correct
+        changed = True
+    return changed
+
+
+def apply_question_update(db_question: models.Question, question_update: schemas.QuestionCreate) -> bool:
+    # Diffs the submitted question against the stored one so unchanged choices
+    # keep their rows and ids. Choices are matched by id only: a choice sent
+    # without a known id is a new row, and stored choices that were not sent
+    # are deleted. Reusing rows would let recorded answers point at a choice
+    # whose text or correctness has changed.
+    changed = False
+    for field in ("question_text", "is_multiple_choice", "image_path"):
+        value = getattr(question_update, field)
+        if getattr(db_question, field) != value:
+            setattr(db_question, field, value)
+            changed = True
+
+    existing = {db_choice.id: db_choice for db_choice in db_question.choices}
+    matched = set()
+    for choice in question_update.choices:
+        choice_id = getattr(choice, "id", None)
+        db_choice = existing.get(choice_id)
+        if db_choice is None or choice_id in matched:
+            db_question.choices.append(models.Choice(choice_text=choice.choice_text, is_correct=choice.is_correct))
+            changed = True
+            continue
+        matched.add(choice_id)
+        changed |= _apply_choice_update(db_choice, choice)
+
+    for db_choice in [db_choice for db_choice in existing.values() if db_choice.id not in matched]:
+        db_question.choices.remove(db_choice)
+        changed = True
+    return changed
+
+
+def get_questions_by_ids(db: Session, exam_id: int, question_ids: List[int]) -> dict:
+    questions = db.execute(
+        select(models.Question)
+        .options(selectinload(models.Question.choices))
+        .where(models.Question.exam_id == exam_id, models.Question.id.in_(question_ids))
+    ).scalars().all()
+    return {question.id: question for question in questions}
+
+
+def update_questions(db: Session, updates: List[tuple]) -> List[bool]:
+    changed = [apply_question_update(db_question, question_update) for db_question, question_update in updates]
+    if any(changed):
+        changed_questions = [db_question for (db_question, _), question_changed in zip(updates, changed)
+                             if question_changed]
+        for exam_id in {db_question.exam_id for db_question in changed_questions}:
+            bump_exam_version(db, exam_id)
+        reindex_questions(db, [db_question.id for db_question in changed_questions])
+        db.commit()
+    return changed
+
+
 def update_question(db: Session, question_id: int, question_update: schemas.QuestionCreate):
-    db_question = db.query(models.Question).filter(models.Question.id == question_id).first()
+    db_question = (
+        db.query(models.Question)
+        .options(selectinload(models.Question.choices))
+        .filter(models.Question.id == question_id)
+        .first()
+    )
     if not db_question:
         return None
 
-    db_question.question_text = question_update.question_text
-    db_question.is_multiple_choice = question_update.is_multiple_choice
-    db_question.image_path = question_update.image_path
+    update_questions(db, [(db_question, question_update)])
+    return db_question
 
-    db.query(models.Choice).filter(models.Choice.question_id == question_id).delete()
 
-    for choice in question_update.choices:
-        db_choice = models.Choice(
-            choice_text=choice.choice_text,
-            is_correct=choice.is_correct,
-            question_id=db_question.id
-        )
-        db.add(db_choice)
-
-    db.commit()
-    db.refresh(db_question)
-    return db_question
+def questions_by_exam_statement(exam_id: int):
+    return (
+        select(models.Question)
+        .options(selectinload(models.Question.choices))
+        .where(models.Question.exam_id == exam_id)
+        .order_by(models.Question.id)
+    )
 
 
 def get_questions_by_exam(db: Session, exam_id: int):
-    questions = db.query(models.Question).filter(models.Question.exam_id == exam_id).all()
+    questions = db.execute(questions_by_exam_statement(exam_id)).scalars().all()
     if not questions:
         return []
     return questions
@@ -181,7 +429,9 @@ def delete_question(db: Session, question_id: int):
     if not db_question:
         return None
 
+    bump_exam_version(db, db_question.exam_id)
     db.delete(db_question)
+    reindex_questions(db, [question_id])
     db.commit()
     return True
 
@@ -193,6 +443,8 @@ def create_choice(db: Session, choice: schemas.ChoiceCreate, question_id: int):
         question_id=question_id
     )
     db.add(db_choice)
+    bump_question_exam_version(db, question_id)
+    reindex_questions(db, [question_id])
     db.commit()
     db.refresh(db_choice)
     return db_choice
@@ -204,6 +456,8 @@ def update_choice(db: Session, choice_id: int, choice: schemas.ChoiceCreate):
         return None
     db_choice.choice_text = choice.choice_text
     db_choice.is_correct = choice.is_correct
+    bump_question_exam_version(db, db_choice.question_id)
+    reindex_questions(db, [db_choice.question_id])
     db.commit()
     db.refresh(db_choice)
     return db_choice
@@ -213,6 +467,110 @@ def delete_choice(db: Session, choice_id: int):
     db_choice = db.query(models.Choice).filter(models.Choice.id == choice_id).first()
     if not db_choice:
         return None
+    bump_question_exam_version(db, db_choice.question_id)
     db.delete(db_choice)
+    reindex_questions(db, [db_choice.question_id])
     db.commit()
     return True
+
+
+def create_attempt(db: Session, exam_id: int, user_id: int, draw) -> models.Attempt:
+    # draw maps the new attempt to the ids of the questions it is given; they
+    # are stored in the same transaction.
+    db_attempt = models.Attempt(exam_id=exam_id, user_id=user_id)
+    db.add(db_attempt)
+    db.flush()
+    question_ids = draw(db_attempt)
+    if question_ids:
+        db.execute(
+            insert(models.AttemptQuestion),
+            [{"attempt_id": db_attempt.id, "question_id": question_id} for question_id in question_ids],
+        )
+    db.commit()
+    db.refresh(db_attempt)
+    return db_attempt
+
+
+def get_attempt_question_ids(db: Session, attempt_ids: List[int]) -> dict:
+    # Attempts started before draws were stored have no rows and are missing
+    # from the result.
+    question_ids = {}
+    for attempt_id, question_id in db.execute(
+        select(models.AttemptQuestion.attempt_id, models.AttemptQuestion.question_id)
+        .where(models.AttemptQuestion.attempt_id.in_(attempt_ids))
+        .order_by(models.AttemptQuestion.attempt_id, models.AttemptQuestion.question_id)
+    ):
+        question_ids.setdefault(attempt_id, []).append(question_id)
+    return question_ids
+
+
+def get_attempt(db: Session, attempt_id: int, for_update: bool = False):
+    query = db.query(models.Attempt).filter(models.Attempt.id == attempt_id)
+    if for_update:
+        query = query.with_for_update()
+    return query.first()
+
+
+def get_attempt_answers(db: Session, attempt_id: int) -> dict:
+    rows = db.execute(
+        select(models.Answer.question_id, models.Answer.choice_id)
+        .where(models.Answer.attempt_id == attempt_id)
+        .order_by(models.Answer.question_id, models.Answer.choice_id)
+    ).all()
+    answers = {}
+    for question_id, choice_id in rows:
+        answers.setdefault(question_id, []).append(choice_id)
+    return answers
+
+
+def save_draft_answers(db: Session, selections: dict) -> set:
+    """Replaces the saved selection of each (attempt id, question id) key.
+
+    Keys of attempts that have been submitted in the meantime are skipped.
+    Everything is written in one transaction, and the ids of the attempts that
+    were saved are returned.
+    """
+    attempt_ids = {attempt_id for attempt_id, _ in selections}
+    open_ids = set(db.execute(
+        select(models.Attempt.id)
+        .where(models.Attempt.id.in_(attempt_ids), models.Attempt.submitted_at.is_(None))
+        .with_for_update()
+    ).scalars())
+    keys = [key for key in selections if key[0] in open_ids]
+    if keys:
+        db.execute(delete(models.Answer).where(tuple_(models.Answer.attempt_id, models.Answer.question_id).in_(keys)))
+        rows = [
+            {"attempt_id": attempt_id, "question_id": question_id, "choice_id": choice_id}
+            for attempt_id, question_id in keys
+            for choice_id in sorted(selections[(attempt_id, question_id)])
+        ]
+        if rows:
+            db.execute(insert(models.Answer), rows)
+    db.commit()
+    return open_ids
+
+
+def submit_attempt(db: Session, db_attempt: models.Attempt, answers: List[tuple] | None):
+    # answers=None keeps the autosaved selection as the final one.
+    if answers is not None:
+        db.execute(delete(models.Answer).where(models.Answer.attempt_id == db_attempt.id))
+    if answers:
+        db.execute(
+            insert(models.Answer),
+            [
+                {"attempt_id": db_attempt.id, "question_id": question_id, "choice_id": choice_id}
+                for question_id, choice_id in answers
+            ],
+        )
+    db_attempt.submitted_at = datetime.now(timezone.utc)
+    db.commit()
+    return db_attempt
+
+
+def list_attempts(db: Session, exam_id: int):
+    return (
+        db.query(models.Attempt)
+        .filter(models.Attempt.exam_id == exam_id)
+        .order_by(models.Attempt.id)
+        .all()
+    )
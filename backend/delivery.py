@@ -0,0 +1,92 @@
+import hashlib
+import random
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from sqlalchemy.orm import Session
+
+import crud
+import http_cache
+import schemas
+
+
+@dataclass(frozen=True)
+class ExamPool:
+    # Everything needed to lay out an exam for one student, built once per
+    # exam content version. Questions are kept in id order, which is also the
+    # order grading.build_answer_key uses, so attempts started before draws
+    # were stored are reproduced the same way by both.
+    exam: dict
+    question_ids: tuple
+    questions: dict
+    questions_per_attempt: int | None
+    shuffle_questions: bool
+    shuffle_choices: bool
+
+
+pool_cache = http_cache.ResponseCache(http_cache.EXAM_CACHE_MAX_ENTRIES, enabled=http_cache.EXAM_CACHE_ENABLED)
+
+
+def attempt_seed(exam_id: int, user_id: int, attempt_id: int) -> int:
+    # Derived rather than stored: the same attempt always gets the same layout.
+    digest = hashlib.sha256(f"{exam_id}:{user_id}:{attempt_id}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def draw_questions(question_ids: Sequence[int], questions_per_attempt: int | None, rng: random.Random) -> List[int]:
+    # Must stay the first use of the generator so grading can reproduce the
+    # draw without knowing anything about choices.
+    if questions_per_attempt is None or questions_per_attempt >= len(question_ids):
+        return list(question_ids)
+    return sorted(rng.sample(list(question_ids), questions_per_attempt))
+
+
+def drawn_question_ids(question_ids: Sequence[int], questions_per_attempt: int | None, seed: int) -> List[int]:
+    return draw_questions(question_ids, questions_per_attempt, random.Random(seed))
+
+
+def draw_attempt(pool: ExamPool, exam_id: int, user_id: int, attempt_id: int) -> List[int]:
+    # The draw stored when an attempt starts.
+    return drawn_question_ids(pool.question_ids, pool.questions_per_attempt, attempt_seed(exam_id, user_id, attempt_id))
+
+
+def build_pool(db: Session, exam_id: int) -> ExamPool | None:
+    db_exam = crud.read_exam_bundle(db, exam_id)
+    if db_exam is None:
+        return None
+    bundle = schemas.StudentExamBundle.model_validate(db_exam).model_dump(mode="json")
+    questions = {question["id"]: question for question in bundle.pop("questions")}
+    return ExamPool(
+        exam=bundle,
+        question_ids=tuple(sorted(questions)),
+        questions=questions,
+        questions_per_attempt=db_exam.questions_per_attempt,
+        shuffle_questions=db_exam.shuffle_questions,
+        shuffle_choices=db_exam.shuffle_choices,
+    )
+
+
+def get_pool(db: Session, exam_id: int, version: int) -> ExamPool | None:
+    return pool_cache.get_or_load_sync((exam_id, version, "pool"), lambda: build_pool(db, exam_id))
+
+
+def build_layout(pool: ExamPool, seed: int, question_ids: Sequence[int] | None = None) -> dict:
+    # question_ids is the attempt's stored draw; questions deleted since are
+    # left out. Without it the draw is reproduced from the seed.
+    rng = random.Random(seed)
+    if question_ids is None:
+        question_ids = draw_questions(pool.question_ids, pool.questions_per_attempt, rng)
+    else:
+        question_ids = [question_id for question_id in sorted(question_ids) if question_id in pool.questions]
+    if pool.shuffle_questions:
+        rng.shuffle(question_ids)
+
+    questions = []
+    for question_id in question_ids:
+        question = pool.questions[question_id]
+        if pool.shuffle_choices:
+            choices = list(question["choices"])
+            rng.shuffle(choices)
+            question = {**question, "choices": choices}
+        questions.append(question)
+    return {**pool.exam, "questions": questions}
@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Iterable, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+import models
+import search
+from database import SessionLocal
+
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+MAX_DUPLICATE_MATCHES = int(os.getenv("MAX_DUPLICATE_MATCHES", "5"))
+
+# 16 bands of 4 rows: pairs at Jaccard similarity 0.8 share a bucket with
+# probability > 0.999, pairs at 0.3 with about 0.12.
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+LOOKUP_CHUNK_SIZE = 500
+CLUSTER_UPDATE_BATCH_SIZE = 1000
+
+_PRIME = np.uint64((1 << 31) - 1)
+# Fixed seed: signatures are stored, so every process must hash alike.
+_rng = np.random.default_rng(20201017)
+_A = _rng.integers(1, int(_PRIME), NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, int(_PRIME), NUM_PERMUTATIONS, dtype=np.uint64)
+_SHINGLE_POWERS = np.uint64(257) ** np.arange(SHINGLE_SIZE - 1, -1, -1, dtype=np.uint64)
+
+
+def normalized_document(question_text: str, choice_texts: Iterable[str]) -> str:
+    # Case, punctuation, whitespace and choice order do not matter.
+    choices = sorted(" ".join(search.tokenize(text)) for text in choice_texts)
+    return "\n".join([" ".join(search.tokenize(question_text)), *choices]).strip()
+
+
+def shingles(document: str) -> np.ndarray:
+    data = np.frombuffer(document.encode(), dtype=np.uint8).astype(np.uint64)
+    if len(data) < SHINGLE_SIZE:
+        data = np.pad(data, (0, SHINGLE_SIZE - len(data)))
+    return np.unique(sliding_window_view(data, SHINGLE_SIZE) @ _SHINGLE_POWERS % _PRIME)
+
+
+def minhash(document: str) -> np.ndarray:
+    # One row per hash function (a * x + b) mod p, evaluated for all shingles at once.
+    values = (_A[:, None] * shingles(document)[None, :] + _B[:, None]) % _PRIME
+    return values.min(axis=1).astype("<u4")
+
+
+def band_buckets(signature: np.ndarray) -> List[int]:
+    return [
+        int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "big", signed=True)
+        for band in signature.reshape(BANDS, ROWS_PER_BAND)
+    ]
+
+
+def _signature(value: bytes) -> np.ndarray:
+    return np.frombuffer(bytes(value), dtype="<u4")
+
+
+def reindex_questions(db: Session, question_ids: Iterable[int]):
+    """Brings the signatures of the given questions up to date.
+
+    Runs inside the caller's transaction after its changes are flushed, like
+    search.reindex_questions. A reindexed question leaves its cluster until
+    the next `cluster` run.
+    """
+    question_ids = sorted(set(question_ids))
+    if not question_ids:
+        return
+    db.flush()
+    db.execute(delete(models.QuestionBand).where(models.QuestionBand.question_id.in_(question_ids)))
+    db.execute(delete(models.QuestionSignature).where(models.QuestionSignature.question_id.in_(question_ids)))
+
+    questions = {
+        row.id: (row.exam_id, row.question_text, [])
+        for row in db.execute(
+            select(models.Question.id, models.Question.exam_id, models.Question.question_text)
+            .where(models.Question.id.in_(question_ids))
+        )
+    }
+    for question_id, choice_text in db.execute(
+        select(models.Choice.question_id, models.Choice.choice_text).where(models.Choice.question_id.in_(question_ids))
+    ):
+        questions[question_id][2].append(choice_text)
+
+    signatures = []
+    bands = []
+    for question_id, (exam_id, question_text, choice_texts) in questions.items():
+        document = normalized_document(question_text, choice_texts)
+        if not document:
+            continue
+        signature = minhash(document)
+        signatures.append({"question_id": question_id, "exam_id": exam_id, "signature": signature.tobytes()})
+        bands.extend(
+            {"band": band, "bucket": bucket, "question_id": question_id}
+            for band, bucket in enumerate(band_buckets(signature))
+        )
+    if signatures:
+        db.execute(insert(models.QuestionSignature), signatures)
+        db.execute(insert(models.QuestionBand), bands)
+
+
+def _chunks(items: list, size: int = LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_near_duplicates(
+    db: Session,
+    question_ids: Iterable[int],
+    threshold: float = DUPLICATE_THRESHOLD,
+    limit: int = MAX_DUPLICATE_MATCHES,
+) -> dict:
+    """Maps each indexed question to its most similar other questions.
+
+    Only questions sharing an LSH bucket are compared, so the cost depends on
+    the number of candidates rather than the size of the bank. Similarity is
+    the Jaccard estimate from the signatures.
+    """
+    signatures = {}
+    for chunk in _chunks(sorted(set(question_ids))):
+        for question_id, signature in db.execute(
+            select(models.QuestionSignature.question_id, models.QuestionSignature.signature)
+            .where(models.QuestionSignature.question_id.in_(chunk))
+        ):
+            signatures[question_id] = _signature(signature)
+
+    queries = defaultdict(set)
+    for question_id, signature in signatures.items():
+        for band, bucket in enumerate(band_buckets(signature)):
+            queries[(band, bucket)].add(question_id)
+    candidates = defaultdict(set)
+    for chunk in _chunks(list(queries)):
+        for band, bucket, question_id in db.execute(
+            select(models.QuestionBand.band, models.QuestionBand.bucket, models.QuestionBand.question_id)
+            .where(tuple_(models.QuestionBand.band, models.QuestionBand.bucket).in_(chunk))
+        ):
+            for query_id in queries[(band, bucket)]:
+                if query_id != question_id:
+                    candidates[query_id].add(question_id)
+
+    candidate_rows = {}
+    for chunk in _chunks(sorted(set().union(*candidates.values()))):
+        for row in db.execute(
+            select(models.QuestionSignature.question_id, models.QuestionSignature.exam_id,
+                   models.QuestionSignature.signature)
+            .where(models.QuestionSignature.question_id.in_(chunk))
+        ):
+            candidate_rows[row.question_id] = (row.exam_id, _signature(row.signature))
+
+    matches = {}
+    for question_id, signature in signatures.items():
+        candidate_ids = sorted(candidates[question_id])
+        if not candidate_ids:
+            matches[question_id] = []
+            continue
+        candidate_signatures = np.stack([candidate_rows[candidate_id][1] for candidate_id in candidate_ids])
+        similarity = (candidate_signatures == signature).mean(axis=1)
+        order = [index for index in np.argsort(-similarity, kind="stable") if similarity[index] >= threshold]
+        matches[question_id] = [
+            {
+                "question_id": candidate_ids[index],
+                "exam_id": candidate_rows[candidate_ids[index]][0],
+                "similarity": round(float(similarity[index]), 3),
+            }
+            for index in order[:limit]
+        ]
+    return matches
+
+
+def _load_signatures(db: Session):
+    question_ids = []
+    blobs = []
+    statement = (
+        select(models.QuestionSignature.question_id, models.QuestionSignature.signature)
+        .order_by(models.QuestionSignature.question_id)
+        .execution_options(yield_per=10000)
+    )
+    for question_id, signature in db.execute(statement):
+        question_ids.append(question_id)
+        blobs.append(bytes(signature))
+    signatures = np.frombuffer(b"".join(blobs), dtype="<u4").reshape(-1, NUM_PERMUTATIONS)
+    return np.asarray(question_ids, dtype=np.int64), signatures
+
+
+def cluster_bank(db: Session, threshold: float = DUPLICATE_THRESHOLD) -> dict:
+    """Groups the whole bank into near-duplicate clusters and stores them.
+
+    Works band by band on the signatures in memory: every question is
+    compared with the first question of its bucket only, and similar pairs
+    are merged with union-find, so the work is linear in the bank size.
+    """
+    question_ids, signatures = _load_signatures(db)
+    parent = np.arange(len(question_ids))
+
+    def find(index):
+        root = index
+        while parent[root] != root:
+            root = parent[root]
+        while parent[index] != root:
+            parent[index], index = root, parent[index]
+        return root
+
+    for band in range(BANDS):
+        if not len(question_ids):
+            break
+        # The band's four values packed into one key; a collision only adds a
+        # candidate pair, which the similarity check then rejects.
+        packed = np.ascontiguousarray(signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]).view(np.uint64)
+        keys = packed[:, 0] * np.uint64(0x9E3779B97F4A7C15) ^ packed[:, 1]
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        leaders = first[inverse.reshape(-1)]
+        members = np.nonzero(leaders != np.arange(len(question_ids)))[0]
+        if not len(members):
+            continue
+        similar = (signatures[members] == signatures[leaders[members]]).mean(axis=1) >= threshold
+        for member, leader in zip(members[similar], leaders[members][similar]):
+            member_root, leader_root = find(member), find(leader)
+            if member_root != leader_root:
+                parent[max(member_root, leader_root)] = min(member_root, leader_root)
+
+    # Question ids are sorted, so each root is the smallest id of its cluster.
+    roots = np.array([find(index) for index in range(len(question_ids))], dtype=np.int64)
+    sizes = np.bincount(roots, minlength=len(question_ids))
+    clustered = np.nonzero(sizes[roots] > 1)[0]
+
+    db.execute(update(models.QuestionSignature).values(cluster_id=None))
+    rows = [
+        {"question_id": int(question_ids[index]), "cluster_id": int(question_ids[roots[index]])}
+        for index in clustered
+    ]
+    for chunk in _chunks(rows, CLUSTER_UPDATE_BATCH_SIZE):
+        db.execute(update(models.QuestionSignature), chunk)
+    db.commit()
+    return {
+        "questions": len(question_ids),
+        "clusters": int(np.count_nonzero(sizes > 1)),
+        "clustered_questions": len(clustered),
+    }
+
+
+def reindex_all(db: Session, exam_id: int | None = None, batch_size: int = search.REINDEX_BATCH_SIZE) -> int:
+    indexed = 0
+    after_id = 0
+    while True:
+        statement = select(models.Question.id).where(models.Question.id > after_id)
+        if exam_id is not None:
+            statement = statement.where(models.Question.exam_id == exam_id)
+        question_ids = db.execute(statement.order_by(models.Question.id).limit(batch_size)).scalars().all()
+        if not question_ids:
+            break
+        reindex_questions(db, question_ids)
+        db.commit()
+        indexed += len(question_ids)
+        after_id = question_ids[-1]
+    return indexed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect near-duplicate questions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reindex_parser = subparsers.add_parser("reindex", help="Rebuild the signatures, e.g. after the initial migration")
+    reindex_parser.add_argument("--exam-id", type=int)
+    cluster_parser = subparsers.add_parser("cluster", help="Cluster the whole question bank")
+    cluster_parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        if args.command == "reindex":
+            print(f"Indexed {reindex_all(db, args.exam_id)} questions")
+        else:
+            json.dump(cluster_bank(db, args.threshold), sys.stdout, indent=2)
+            sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from fastapi import WebSocket
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+import crud
+import delivery
+import grading
+import models
+from database import SessionLocal
+
+AUTOSAVE_FLUSH_SECONDS = float(os.getenv("AUTOSAVE_FLUSH_SECONDS", "2"))
+EXAM_SESSION_TICK_SECONDS = float(os.getenv("EXAM_SESSION_TICK_SECONDS", "5"))
+EXAM_SESSION_SEND_TIMEOUT_SECONDS = float(os.getenv("EXAM_SESSION_SEND_TIMEOUT_SECONDS", "2"))
+SUBMIT_GRACE_SECONDS = float(os.getenv("SUBMIT_GRACE_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    # SQLite hands back naive datetimes; everything is stored in UTC.
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def attempt_deadline(started_at: datetime, duration_minutes: int | None, closes_at: datetime | None):
+    deadlines = [_utc(closes_at)] if closes_at is not None else []
+    if duration_minutes is not None:
+        deadlines.append(_utc(started_at) + timedelta(minutes=duration_minutes))
+    return min(deadlines) if deadlines else None
+
+
+def is_past(deadline: datetime | None, grace_seconds: float = 0) -> bool:
+    if deadline is None:
+        return False
+    return datetime.now(timezone.utc) >= _utc(deadline) + timedelta(seconds=grace_seconds)
+
+
+@dataclass
+class ExamSession:
+    attempt_id: int
+    exam_id: int
+    user_id: int
+    started_at: datetime
+    deadline: datetime | None
+    choices_by_question: dict
+    sockets: set = field(default_factory=set)
+    pending_seq: int | None = None
+    closing: bool = False
+
+    def remaining_seconds(self, now: datetime) -> int | None:
+        if self.deadline is None:
+            return None
+        return max(0, math.ceil((self.deadline - now).total_seconds()))
+
+
+class ExamSessionHub:
+    # All live attempts of this worker. Answer changes are buffered in memory,
+    # keeping only the latest selection per (attempt, question), and written
+    # by one flusher task in a single transaction every AUTOSAVE_FLUSH_SECONDS.
+    # One ticker task pushes the countdown to every socket and closes attempts
+    # whose time is up, so the per-connection cost is a coroutine waiting on
+    # its socket.
+    def __init__(self, flush_seconds: float, tick_seconds: float, send_timeout: float):
+        self.flush_seconds = flush_seconds
+        self.tick_seconds = tick_seconds
+        self.send_timeout = send_timeout
+        self.sessions = {}
+        self._pending = {}
+        self._tasks = []
+        self._flush_lock = asyncio.Lock()
+        self.flushes = 0
+        self.saved_selections = 0
+
+    def _running(self) -> bool:
+        loop = asyncio.get_running_loop()
+        return any(task.get_loop() is loop and not task.done() for task in self._tasks)
+
+    def start(self):
+        if not self._running():
+            # A lock is bound to the loop that first waits on it.
+            self._flush_lock = asyncio.Lock()
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._tick_loop())]
+
+    async def stop(self):
+        if self._running():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "attempts": len(self.sessions),
+            "connections": sum(len(session.sockets) for session in self.sessions.values()),
+            "pending_selections": len(self._pending),
+            "flushes": self.flushes,
+            "saved_selections": self.saved_selections,
+        }
+
+    async def open(self, websocket: WebSocket, db_attempt: models.Attempt, pool: delivery.ExamPool,
+                   db_exam: models.Exam, question_ids: list | None) -> ExamSession:
+        # question_ids is the attempt's stored draw, None for attempts started
+        # before draws were stored.
+        session = self.sessions.get(db_attempt.id)
+        if session is None:
+            if question_ids is None:
+                seed = delivery.attempt_seed(db_attempt.exam_id, db_attempt.user_id, db_attempt.id)
+                question_ids = delivery.drawn_question_ids(pool.question_ids, pool.questions_per_attempt, seed)
+            session = ExamSession(
+                attempt_id=db_attempt.id,
+                exam_id=db_attempt.exam_id,
+                user_id=db_attempt.user_id,
+                started_at=db_attempt.started_at,
+                deadline=attempt_deadline(db_attempt.started_at, db_exam.duration_minutes, db_exam.closes_at),
+                choices_by_question={
+                    question_id: {choice["id"] for choice in pool.questions[question_id]["choices"]}
+                    for question_id in question_ids
+                    if question_id in pool.questions
+                },
+            )
+            self.sessions[db_attempt.id] = session
+        session.sockets.add(websocket)
+        return session
+
+    def leave(self, session: ExamSession, websocket: WebSocket):
+        session.sockets.discard(websocket)
+        if not session.sockets and not session.closing:
+            self.sessions.pop(session.attempt_id, None)
+
+    def record_answer(self, session: ExamSession, question_id: int, choice_ids: list, seq: int | None) -> str | None:
+        if session.closing:
+            return "The attempt is closed"
+        if session.deadline is not None and datetime.now(timezone.utc) >= session.deadline:
+            return "Time is up"
+        allowed = session.choices_by_question.get(question_id)
+        if allowed is None:
+            return f"Question {question_id} is not part of this attempt"
+        if not set(choice_ids) <= allowed:
+            return f"Choices {sorted(set(choice_ids) - allowed)} do not belong to question {question_id}"
+        self._pending[(session.attempt_id, question_id)] = set(choice_ids)
+        if seq is not None:
+            session.pending_seq = seq
+        return None
+
+    def pending_answers(self, attempt_id: int) -> dict:
+        return {
+            question_id: sorted(choice_ids)
+            for (pending_attempt_id, question_id), choice_ids in self._pending.items()
+            if pending_attempt_id == attempt_id
+        }
+
+    async def flush(self, attempt_ids: set | None = None):
+        # Flushes run one at a time, so a caller returns only once every
+        # selection taken before it, including by a flush already in flight,
+        # has been written or put back into _pending.
+        async with self._flush_lock:
+            acks = await self._save(attempt_ids)
+        await asyncio.gather(*(
+            self.broadcast(attempt_id, {"type": "saved", "seq": seq}) for attempt_id, seq in acks.items()
+        ))
+
+    async def _save(self, attempt_ids: set | None) -> dict:
+        if attempt_ids is None:
+            batch, self._pending = self._pending, {}
+        else:
+            batch = {key: value for key, value in self._pending.items() if key[0] in attempt_ids}
+            for key in batch:
+                del self._pending[key]
+        if not batch:
+            return {}
+
+        acks = {}
+        for attempt_id, _ in batch:
+            session = self.sessions.get(attempt_id)
+            if session is not None and session.pending_seq is not None:
+                acks[attempt_id] = session.pending_seq
+                session.pending_seq = None
+
+        def save():
+            with SessionLocal() as db:
+                return crud.save_draft_answers(db, batch)
+
+        try:
+            saved = await run_in_threadpool(save)
+        except Exception:
+            logger.exception("Saving answer drafts failed")
+            # Newer changes that arrived meanwhile take precedence over the failed batch.
+            self._pending = {**batch, **self._pending}
+            for attempt_id, seq in acks.items():
+                session = self.sessions.get(attempt_id)
+                if session is not None and session.pending_seq is None:
+                    session.pending_seq = seq
+            return {}
+        self.flushes += 1
+        self.saved_selections += len(batch)
+        return {attempt_id: seq for attempt_id, seq in acks.items() if attempt_id in saved}
+
+    async def _send(self, session: ExamSession, websocket: WebSocket, message: dict):
+        try:
+            await asyncio.wait_for(websocket.send_json(message), self.send_timeout)
+        except Exception:
+            # Slow or gone; the client gets the current state when it reconnects.
+            session.sockets.discard(websocket)
+
+    async def broadcast(self, attempt_id: int, message: dict):
+        session = self.sessions.get(attempt_id)
+        if session is None:
+            return
+        await asyncio.gather(*(self._send(session, websocket, message) for websocket in list(session.sockets)))
+
+    async def close_attempt(self, session: ExamSession, reason: str):
+        # Flushes the attempt's buffered answers, submits the saved selection
+        # and grades it.
+        if session.closing:
+            return
+        session.closing = True
+        await self.flush({session.attempt_id})
+        if self.pending_answers(session.attempt_id):
+            # The save failed; submitting now would drop those answers.
+            session.closing = False
+            return
+
+        def submit():
+            with SessionLocal() as db:
+                db_attempt = crud.get_attempt(db, session.attempt_id, for_update=True)
+                if db_attempt.submitted_at is None:
+                    crud.submit_attempt(db, db_attempt, None)
+                    grading.grade_attempts(db, db_attempt.exam_id, attempt_ids=[db_attempt.id])
+                    db.refresh(db_attempt)
+                return db_attempt.score
+
+        try:
+            score = await run_in_threadpool(submit)
+        except Exception:
+            logger.exception(f"Closing attempt {session.attempt_id} failed")
+            session.closing = False
+            return
+        await self.broadcast(session.attempt_id, {"type": "closed", "reason": reason, "score": score})
+        await asyncio.gather(
+            *(asyncio.wait_for(websocket.close(), self.send_timeout) for websocket in list(session.sockets)),
+            return_exceptions=True,
+        )
+        self.sessions.pop(session.attempt_id, None)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Answer flush failed")
+
+    def _refresh_deadlines(self):
+        # Picks up duration and closing time changes made by the exam owner.
+        exam_ids = {session.exam_id for session in self.sessions.values()}
+        if not exam_ids:
+            return {}
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(models.Exam.id, models.Exam.duration_minutes, models.Exam.closes_at)
+                .where(models.Exam.id.in_(exam_ids))
+            ).all()
+        return {row.id: (row.duration_minutes, row.closes_at) for row in rows}
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                timings = await run_in_threadpool(self._refresh_deadlines)
+                now = datetime.now(timezone.utc)
+                updates = []
+                for session in list(self.sessions.values()):
+                    if session.exam_id in timings:
+                        session.deadline = attempt_deadline(session.started_at, *timings[session.exam_id])
+                    remaining = session.remaining_seconds(now)
+                    if remaining == 0:
+                        updates.append(self.close_attempt(session, "time_up"))
+                    elif remaining is not None:
+                        updates.append(self.broadcast(session.attempt_id, {"type": "tick", "remaining_seconds": remaining}))
+                await asyncio.gather(*updates)
+            except Exception:
+                logger.exception("Exam session tick failed")
+
+
+hub = ExamSessionHub(AUTOSAVE_FLUSH_SECONDS, EXAM_SESSION_TICK_SECONDS, EXAM_SESSION_SEND_TIMEOUT_SECONDS)
@@ -0,0 +1,224 @@
+from datetime import datetime, timezone
+from typing import Iterable, List
+
+import numpy as np
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+import crud
+import delivery
+import models
+
+GRADING_BATCH_SIZE = 1000
+
+
+class AnswerKey:
+    # Flattened answer key for one exam. Choices are laid out along a single
+    # axis, ordered by question, so a batch of submissions becomes a boolean
+    # (attempts x choices) matrix and every score is a couple of matrix products.
+    def __init__(self, question_ids, is_multiple, choice_ids, choice_questions, correct,
+                 exam_id=None, questions_per_attempt=None):
+        self.exam_id = exam_id
+        self.questions_per_attempt = questions_per_attempt
+        self.question_ids = np.asarray(question_ids, dtype=np.int64)
+        self.is_multiple = np.asarray(is_multiple, dtype=bool)
+        self.choice_ids = np.asarray(choice_ids, dtype=np.int64)
+        self.correct = np.asarray(correct, dtype=bool)
+        self.choice_questions = np.asarray(choice_questions, dtype=np.intp)
+
+        num_questions = len(self.question_ids)
+        self.membership = np.zeros((len(self.choice_ids), num_questions), dtype=np.float32)
+        self.membership[np.arange(len(self.choice_ids)), self.choice_questions] = 1.0
+        self.correct_per_question = self.correct.astype(np.float32) @ self.membership
+
+        self._choice_order = np.argsort(self.choice_ids)
+        self._sorted_choice_ids = self.choice_ids[self._choice_order]
+
+    @property
+    def num_questions(self) -> int:
+        return len(self.question_ids)
+
+    def choice_columns(self, choice_ids) -> np.ndarray:
+        # Column index for each choice id, or -1 when it is not part of this exam.
+        choice_ids = np.asarray(choice_ids, dtype=np.int64)
+        if len(self._sorted_choice_ids) == 0:
+            return np.full(len(choice_ids), -1, dtype=np.intp)
+        positions = np.searchsorted(self._sorted_choice_ids, choice_ids)
+        positions = np.clip(positions, 0, len(self._sorted_choice_ids) - 1)
+        found = self._sorted_choice_ids[positions] == choice_ids
+        return np.where(found, self._choice_order[positions], -1)
+
+    def question_of_choice(self, choice_id: int) -> int | None:
+        column = self.choice_columns([choice_id])[0]
+        if column < 0:
+            return None
+        return int(self.question_ids[self.choice_questions[column]])
+
+    def drawn_question_ids(self, attempt_id: int, user_id: int) -> List[int]:
+        # Reproduces the draw of an attempt started before draws were stored.
+        seed = delivery.attempt_seed(self.exam_id, user_id, attempt_id)
+        return delivery.drawn_question_ids(self.question_ids.tolist(), self.questions_per_attempt, seed)
+
+    def drawn_mask(self, attempts, stored: dict) -> np.ndarray:
+        # (attempts x questions) mask of the questions each attempt was given,
+        # from the stored draws. Stored questions deleted since are not in the
+        # key and drop out.
+        mask = np.zeros((len(attempts), self.num_questions), dtype=bool)
+        for row, (attempt_id, user_id) in enumerate(attempts):
+            question_ids = stored.get(attempt_id)
+            if question_ids is None:
+                question_ids = self.drawn_question_ids(attempt_id, user_id)
+            mask[row] = np.isin(self.question_ids, question_ids)
+        return mask
+
+
+def drawn_mask(db: Session, key: AnswerKey, attempts) -> np.ndarray:
+    stored = crud.get_attempt_question_ids(db, [attempt_id for attempt_id, _ in attempts])
+    return key.drawn_mask(attempts, stored)
+
+
+def attempt_question_ids(db: Session, key: AnswerKey, db_attempt: models.Attempt) -> List[int]:
+    stored = crud.get_attempt_question_ids(db, [db_attempt.id]).get(db_attempt.id)
+    if stored is None:
+        return key.drawn_question_ids(db_attempt.id, db_attempt.user_id)
+    return stored
+
+
+def build_answer_key(db: Session, exam_id: int) -> AnswerKey:
+    questions_per_attempt = db.execute(
+        select(models.Exam.questions_per_attempt).where(models.Exam.id == exam_id)
+    ).scalar()
+    questions = db.execute(
+        select(models.Question.id, models.Question.is_multiple_choice)
+        .where(models.Question.exam_id == exam_id)
+        .order_by(models.Question.id)
+    ).all()
+    question_index = {question_id: index for index, (question_id, _) in enumerate(questions)}
+
+    choices = db.execute(
+        select(models.Choice.id, models.Choice.question_id, models.Choice.is_correct)
+        .join(models.Question, models.Question.id == models.Choice.question_id)
+        .where(models.Question.exam_id == exam_id)
+        .order_by(models.Choice.question_id, models.Choice.id)
+    ).all()
+
+    return AnswerKey(
+        question_ids=[question_id for question_id, _ in questions],
+        is_multiple=[bool(is_multiple) for _, is_multiple in questions],
+        choice_ids=[choice_id for choice_id, _, _ in choices],
+        choice_questions=[question_index[question_id] for _, question_id, _ in choices],
+        correct=[is_correct for _, _, is_correct in choices],
+        exam_id=exam_id,
+        questions_per_attempt=questions_per_attempt,
+    )
+
+
+def selection_matrix(key: AnswerKey, attempt_ids: List[int], answer_rows) -> np.ndarray:
+    selections = np.zeros((len(attempt_ids), len(key.choice_ids)), dtype=bool)
+    if not answer_rows:
+        return selections
+    answers = np.asarray(answer_rows, dtype=np.int64)
+    rows = np.searchsorted(np.asarray(attempt_ids, dtype=np.int64), answers[:, 0])
+    columns = key.choice_columns(answers[:, 1])
+    known = columns >= 0
+    selections[rows[known], columns[known]] = True
+    return selections
+
+
+def score_selections(key: AnswerKey, selections: np.ndarray, drawn: np.ndarray | None = None):
+    """Returns (per-question scores in [0, 1], total scores in percent) for a batch.
+
+    Multiple choice questions earn partial credit for each correct choice
+    selected, minus one for each incorrect one. Single choice questions score
+    only when exactly the correct choice is selected. When ``drawn`` is given,
+    totals only count the questions each attempt was given.
+    """
+    if key.num_questions == 0:
+        return np.zeros((len(selections), 0), dtype=np.float32), np.zeros(len(selections), dtype=np.float32)
+
+    selected = selections.astype(np.float32)
+    correct_hits = (selected * key.correct) @ key.membership
+    wrong_hits = (selected * ~key.correct) @ key.membership
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        multiple = np.where(
+            key.correct_per_question > 0,
+            np.clip(correct_hits - wrong_hits, 0, None) / key.correct_per_question,
+            0.0,
+        )
+    single = ((correct_hits == 1) & (wrong_hits == 0)).astype(np.float32)
+    question_scores = np.where(key.is_multiple, multiple, single)
+    if drawn is None:
+        return question_scores, question_scores.mean(axis=1) * 100
+    given = drawn.sum(axis=1)
+    totals = np.where(given > 0, (question_scores * drawn).sum(axis=1) / np.maximum(given, 1), 0.0)
+    return question_scores, totals * 100
+
+
+def _pending_attempt_ids(db: Session, exam_id: int, after_id: int, limit: int) -> List[int]:
+    return db.execute(
+        select(models.Attempt.id)
+        .where(
+            models.Attempt.exam_id == exam_id,
+            models.Attempt.submitted_at.isnot(None),
+            models.Attempt.graded_at.is_(None),
+            models.Attempt.id > after_id,
+        )
+        .order_by(models.Attempt.id)
+        .limit(limit)
+    ).scalars().all()
+
+
+def _grade_batch(db: Session, key: AnswerKey, attempt_ids: List[int]):
+    answer_rows = db.execute(
+        select(models.Answer.attempt_id, models.Answer.choice_id)
+        .where(models.Answer.attempt_id.in_(attempt_ids))
+    ).all()
+    user_ids = dict(db.execute(
+        select(models.Attempt.id, models.Attempt.user_id).where(models.Attempt.id.in_(attempt_ids))
+    ).all())
+    drawn = drawn_mask(db, key, [(attempt_id, user_ids[attempt_id]) for attempt_id in attempt_ids])
+    _, totals = score_selections(key, selection_matrix(key, attempt_ids, answer_rows), drawn)
+    graded_at = datetime.now(timezone.utc)
+    db.execute(
+        update(models.Attempt),
+        [
+            {"id": attempt_id, "score": float(score), "graded_at": graded_at}
+            for attempt_id, score in zip(attempt_ids, totals)
+        ],
+    )
+
+
+def grade_attempts(
+    db: Session,
+    exam_id: int,
+    attempt_ids: Iterable[int] | None = None,
+    key: AnswerKey | None = None,
+    batch_size: int = GRADING_BATCH_SIZE,
+) -> int:
+    """Grades the given attempts, or every submitted and ungraded attempt of the exam.
+
+    The answer key is built once and attempts are scored in batches of
+    ``batch_size``; everything is committed in a single transaction.
+    """
+    key = key or build_answer_key(db, exam_id)
+    graded = 0
+
+    if attempt_ids is not None:
+        attempt_ids = sorted(attempt_ids)
+        for start in range(0, len(attempt_ids), batch_size):
+            batch = attempt_ids[start:start + batch_size]
+            _grade_batch(db, key, batch)
+            graded += len(batch)
+    else:
+        after_id = 0
+        while True:
+            batch = _pending_attempt_ids(db, exam_id, after_id, batch_size)
+            if not batch:
+                break
+            _grade_batch(db, key, batch)
+            graded += len(batch)
+            after_id = batch[-1]
+
+    db.commit()
+    return graded
@@ -0,0 +1,173 @@
+import asyncio
+import os
+
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+
+import cache
+
+EXAM_CACHE_ENABLED = os.getenv("EXAM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EXAM_CACHE_MAX_ENTRIES = int(os.getenv("EXAM_CACHE_MAX_ENTRIES", "1024"))
+EXAM_CACHE_MAX_BYTES = int(os.getenv("EXAM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EXAM_CACHE_CONTROL = os.getenv("EXAM_CACHE_CONTROL", "private, no-cache")
+CACHE_VERSION_TTL_SECONDS = int(os.getenv("CACHE_VERSION_TTL_SECONDS", "30"))
+
+_caches = []
+
+
+class ResponseCache:
+    # Serialized response bodies keyed by (exam id, content version, variant).
+    # Keys embed the version, so a write never has to purge anything: stale
+    # versions stop being requested and age out of the LRU. Concurrent misses
+    # for the same key share a single load. With a shared tier, local misses
+    # are looked up there before loading, so workers warm each other; async
+    # callers do that I/O in the threadpool, off the event loop.
+    def __init__(self, max_entries: int, max_bytes: int | None = None, enabled: bool = True,
+                 shared: cache.SharedTier | None = None):
+        self.enabled = enabled
+        self.local = cache.LRUTier(max_entries, max_bytes)
+        self.shared = shared
+        self._inflight = {}
+        self.coalesced = 0
+        _caches.append(self)
+
+    @staticmethod
+    def _shared_key(key) -> str:
+        return "body:" + ":".join(map(str, key))
+
+    def _get_shared(self, key):
+        body = self.shared.get(self._shared_key(key))
+        if body is not None:
+            self.local.set(key, body)
+        return body
+
+    def get(self, key):
+        body = self.local.get(key)
+        if body is None and self.shared is not None:
+            body = self._get_shared(key)
+        return body
+
+    def set(self, key, body):
+        self.local.set(key, body)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key), body)
+
+    def discard_exam(self, exam_id: int, keep_version: int | None = None):
+        self.local.discard_where(lambda key: key[0] == exam_id and key[1] != keep_version)
+
+    async def get_or_load(self, key, loader) -> bytes:
+        if not self.enabled:
+            return await loader()
+        body = self.local.get(key)
+        if body is not None:
+            return body
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        async def load():
+            if self.shared is not None:
+                body = await run_in_threadpool(self._get_shared, key)
+                if body is not None:
+                    return body
+            body = await loader()
+            self.local.set(key, body)
+            if self.shared is not None:
+                await run_in_threadpool(self.shared.set, self._shared_key(key), body)
+            return body
+
+        task = asyncio.ensure_future(load())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def get_or_load_sync(self, key, loader) -> bytes:
+        if not self.enabled:
+            return loader()
+        body = self.get(key)
+        if body is None:
+            body = loader()
+            self.set(key, body)
+        return body
+
+    def stats(self) -> dict:
+        stats = {"enabled": self.enabled, **self.local.stats(), "coalesced": self.coalesced}
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+class ExamVersionCache:
+    # Content versions in the shared tier, so workers can validate ETags and
+    # build cache keys without a query. Writers publish after their commit and
+    # deleted exams leave a tombstone (version 0); readers only fill in absent
+    # entries, so a version read before a commit cannot replace the published
+    # one. The TTL bounds the rare races left, e.g. two publishes reordered.
+    def __init__(self, shared: cache.SharedTier | None, ttl: int = CACHE_VERSION_TTL_SECONDS):
+        self.shared = shared
+        self.ttl = ttl
+
+    def get(self, exam_id: int) -> int | None:
+        if self.shared is None:
+            return None
+        value = self.shared.get(f"exam-version:{exam_id}")
+        return int(value) if value is not None else None
+
+    def fill(self, exam_id: int, version: int):
+        if self.shared is not None:
+            self.shared.set(f"exam-version:{exam_id}", str(version).encode(), ttl=self.ttl, only_if_absent=True)
+
+    async def get_async(self, exam_id: int) -> int | None:
+        if self.shared is None:
+            return None
+        return await run_in_threadpool(self.get, exam_id)
+
+    async def fill_async(self, exam_id: int, version: int):
+        if self.shared is not None:
+            await run_in_threadpool(self.fill, exam_id, version)
+
+    def publish(self, versions: dict):
+        # versions maps exam ids to their committed version, None if deleted.
+        for exam_id, version in versions.items():
+            if self.shared is not None:
+                self.shared.set(f"exam-version:{exam_id}", str(version or 0).encode(), ttl=self.ttl)
+            for response_cache in _caches:
+                response_cache.discard_exam(exam_id, keep_version=version)
+
+    def stats(self) -> dict | None:
+        return self.shared.stats() if self.shared is not None else None
+
+
+exam_cache = ResponseCache(
+    EXAM_CACHE_MAX_ENTRIES, EXAM_CACHE_MAX_BYTES, enabled=EXAM_CACHE_ENABLED, shared=cache.shared_tier_from_env() if EXAM_CACHE_ENABLED else None
+)
+exam_versions = ExamVersionCache(exam_cache.shared)
+
+
+def exam_etag(exam_id: int, version: int, variant: str) -> str:
+    return f'"exam-{exam_id}-v{version}-{variant}"'
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [value.strip() for value in header.split(",")]
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(
+            status_code=304,
+            headers={"ETag": etag, "Cache-Control": EXAM_CACHE_CONTROL},
+        )
+    return None
+
+
+def json_response(body: bytes, etag: str) -> Response:
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": EXAM_CACHE_CONTROL},
+    )
@@ -0,0 +1,156 @@
+import logging
+import os
+import signal
+import threading
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image, ImageOps
+from sqlalchemy import select, update
+
+import images
+import models
+from database import SessionLocal
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_WORKERS_IN_APP = os.getenv("IMAGE_WORKERS_IN_APP", "true").lower() in ("1", "true", "yes")
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_JOB_MAX_ATTEMPTS = 3
+IMAGE_JOB_STALE_SECONDS = 600
+IMAGE_JOB_POLL_SECONDS = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def generate_variants(filename: str) -> list:
+    os.makedirs(images.VARIANT_DIR, exist_ok=True)
+    generated = []
+    with Image.open(images.image_path(filename)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+        for width in images.VARIANT_WIDTHS:
+            if original.width <= width:
+                # Never upscale; the original is served for wider requests.
+                break
+            height = max(1, round(original.height * width / original.width))
+            resized = original.resize((width, height), Image.LANCZOS)
+            target = images.variant_path(filename, width)
+            temp = target + ".tmp"
+            resized.save(temp, format="WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+            os.replace(temp, target)
+            generated.append(width)
+    return generated
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def requeue_stale_jobs(db):
+    # Jobs left "running" by a worker that died are retried, up to the attempt limit.
+    cutoff = _now() - timedelta(seconds=IMAGE_JOB_STALE_SECONDS)
+    stale = (models.ImageJob.status == "running") & (models.ImageJob.updated_at < cutoff)
+    db.execute(
+        update(models.ImageJob)
+        .where(stale, models.ImageJob.attempts < IMAGE_JOB_MAX_ATTEMPTS)
+        .values(status="pending", updated_at=_now())
+    )
+    db.execute(
+        update(models.ImageJob)
+        .where(stale, models.ImageJob.attempts >= IMAGE_JOB_MAX_ATTEMPTS)
+        .values(status="failed", error="Worker stopped while processing", updated_at=_now())
+    )
+    db.commit()
+
+
+def claim_job(db) -> models.ImageJob | None:
+    # The conditional UPDATE makes claiming safe across threads and processes
+    # without relying on row locks, which SQLite does not support.
+    while True:
+        job_id = db.execute(
+            select(models.ImageJob.id)
+            .where(models.ImageJob.status == "pending")
+            .order_by(models.ImageJob.id)
+            .limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        claimed = db.execute(
+            update(models.ImageJob)
+            .where(models.ImageJob.id == job_id, models.ImageJob.status == "pending")
+            .values(status="running", attempts=models.ImageJob.attempts + 1, updated_at=_now())
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(models.ImageJob, job_id)
+
+
+def run_job(db, job: models.ImageJob):
+    try:
+        generate_variants(job.filename)
+    except Exception as e:
+        logger.warning(f"Generating variants for {job.filename} failed: {e}")
+        job.status = "pending" if job.attempts < IMAGE_JOB_MAX_ATTEMPTS else "failed"
+        job.error = str(e)[:255]
+    else:
+        job.status = "done"
+        job.error = None
+    job.updated_at = _now()
+    db.commit()
+
+
+class ImageWorkerPool:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        with SessionLocal() as db:
+            requeue_stale_jobs(db)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"image-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with SessionLocal() as db:
+                    job = claim_job(db)
+                    if job is not None:
+                        run_job(db, job)
+                        continue
+            except Exception:
+                logger.exception("Image worker iteration failed")
+            self._wake.wait(IMAGE_JOB_POLL_SECONDS)
+            self._wake.clear()
+
+
+worker_pool = ImageWorkerPool(IMAGE_WORKERS)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    worker_pool.start()
+    logger.info(f"Processing image jobs with {IMAGE_WORKERS} workers")
+    stopped.wait()
+    worker_pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import uuid
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import models
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+VARIANT_DIR = os.path.join(UPLOAD_DIR, "variants")
+VARIANT_WIDTHS = tuple(sorted(int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "200,1024").split(",")))
+
+_EXTENSION = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+def image_path(filename: str) -> str:
+    # Path parameters cannot contain "/", but reject anything that is not a
+    # plain file name so ".." and friends never leave the upload directory.
+    # Dotfiles are uploads still being written.
+    if not filename or filename.startswith(".") or os.path.basename(filename) != filename:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return os.path.join(UPLOAD_DIR, filename)
+
+
+def variant_path(filename: str, width: int) -> str:
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(VARIANT_DIR, f"{stem}.w{width}.webp")
+
+
+def pick_variant(filename: str, width: int) -> str | None:
+    # Smallest generated WebP variant at least as wide as requested. None means
+    # the original should be served, either because it is already narrow
+    # enough or because its variants have not been generated yet.
+    for variant_width in VARIANT_WIDTHS:
+        if variant_width >= width:
+            path = variant_path(filename, variant_width)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def remove_variants(filename: str):
+    for width in VARIANT_WIDTHS:
+        path = variant_path(filename, width)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _extension(filename: str | None) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if _EXTENSION.match(extension) else ""
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def store_upload(file: UploadFile) -> tuple:
+    """Streams an upload to a temporary file and returns (content-addressed filename, size, temporary path).
+
+    The body is hashed while it is written; the name is ``<sha256><ext>``,
+    so identical content maps to the same name. add_reference moves the
+    temporary file into place.
+    """
+    temp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    out = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image exceeds the {UPLOAD_MAX_BYTES} byte limit")
+            await run_in_threadpool(_write_chunk, out, digest, chunk)
+        await run_in_threadpool(out.close)
+    except BaseException:
+        await run_in_threadpool(out.close)
+        await run_in_threadpool(_remove, temp_path)
+        raise
+    return digest.hexdigest() + _extension(file.filename), size, temp_path
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _locked_image(db: Session, filename: str) -> models.StoredImage | None:
+    return (
+        db.query(models.StoredImage)
+        .filter(models.StoredImage.filename == filename)
+        .with_for_update()
+        .first()
+    )
+
+
+def add_reference(db: Session, filename: str, size: int, temp_path: str) -> bool:
+    """Moves an upload into place and counts one more reference to it.
+
+    Returns True when the image is new; new images also get a derivative job
+    queued in the same transaction. The file is renamed while the image row
+    is locked, so a concurrent release_reference cannot unlink it in between.
+    """
+    try:
+        while True:
+            db_image = _locked_image(db, filename)
+            if db_image is not None:
+                break
+            db_image = models.StoredImage(filename=filename, ref_count=0, size_bytes=size)
+            db.add(db_image)
+            try:
+                db.flush()
+                break
+            except IntegrityError:
+                # Another request stored the same content first; lock its row.
+                db.rollback()
+        is_new = db_image.ref_count == 0
+        if is_new:
+            db.add(models.ImageJob(filename=filename))
+        os.replace(temp_path, os.path.join(UPLOAD_DIR, filename))
+        db_image.ref_count += 1
+        db.commit()
+        return is_new
+    finally:
+        _remove(temp_path)
+
+
+def _remove_files(filename: str):
+    _remove(image_path(filename))
+    remove_variants(filename)
+
+
+def release_reference(db: Session, filename: str) -> bool | None:
+    """Drops one reference and returns whether the file itself was removed.
+
+    Returns None when the image is unknown and not on disk either. Files
+    uploaded before reference counting existed have no row and are removed
+    directly. Files are removed before the commit, while the row is locked,
+    so add_reference cannot reference a file that is about to go.
+    """
+    path = image_path(filename)
+    db_image = _locked_image(db, filename)
+    if db_image is None:
+        if not os.path.exists(path):
+            return None
+        # Claim the name with a row, so an upload of the same content waits
+        # until the file is gone instead of referencing it.
+        db.add(models.StoredImage(filename=filename, ref_count=0, size_bytes=os.path.getsize(path)))
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            return False
+        _remove_files(filename)
+        db.query(models.StoredImage).filter(models.StoredImage.filename == filename).delete(synchronize_session=False)
+        db.commit()
+        return True
+
+    if db_image.ref_count > 1:
+        db_image.ref_count -= 1
+        db.commit()
+        return False
+
+    db.delete(db_image)
+    db.query(models.ImageJob).filter(
+        models.ImageJob.filename == filename, models.ImageJob.status == "pending"
+    ).delete(synchronize_session=False)
+    db.flush()
+    _remove_files(filename)
+    db.commit()
+    return True
@@ -1,23 +1,57 @@
+import hashlib
+import io
+import json
 import logging
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Request
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Request, Response, Query, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from typing import Annotated, List
+from pydantic import TypeAdapter
 
-from database import engine, SessionLocal
+from database import async_engine, engine, get_db, get_read_db, pool_stats, read_session, SessionLocal
+import analytics
+import async_crud
 import crud
+import delivery
+import duplicates
+import exam_sessions
+import grading
+import http_cache
+import image_worker
+import images
+import metrics
 import models
+import question_bank
+import results_export
+import roster
 import schemas
+import search
+import static_files
+from passwords import hasher, PasswordHasherBusy
+from principals import AUTH_TRUST_CLAIMS, Principal, is_missing, principal_cache
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if image_worker.IMAGE_WORKERS_IN_APP:
+        await run_in_threadpool(image_worker.worker_pool.start)
+    yield
+    await exam_sessions.hub.stop()
+    if image_worker.IMAGE_WORKERS_IN_APP:
+        await run_in_threadpool(image_worker.worker_pool.stop)
 
-UPLOAD_DIR = "uploads"
+
+app = FastAPI(lifespan=lifespan)
+
+UPLOAD_DIR = images.UPLOAD_DIR
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
@@ -33,42 +67,60 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-After-Id"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.instrument_engine(engine)
+if async_engine is not None:
+    metrics.instrument_engine(async_engine.sync_engine)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get("SECRET_KEY", "your_secret_key")
 ALGORITHM = os.environ.get("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 2
 REFRESH_TOKEN_EXPIRE_DAYS = 10
 
-db_dependency = Annotated[Session, Depends(lambda: SessionLocal())]
+db_dependency = Annotated[Session, Depends(get_db)]
+read_db_dependency = Annotated[Session | AsyncSession, Depends(get_read_db)]
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def db_call(db: Session | AsyncSession, sync_fn, async_fn, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await async_fn(db, **kwargs)
+    return await run_in_threadpool(sync_fn, db, **kwargs)
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many login attempts in progress, please retry"},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.post("/register", response_model=schemas.User, status_code=status.HTTP_201_CREATED, tags=["Users"])
 async def register_user(user: schemas.UserCreate, db: db_dependency) -> schemas.User:
-    db_user = crud.get_user(db=db, username=user.username)
+    db_user = await run_in_threadpool(crud.get_user, db=db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="User already exists")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await hasher.hash_async(user.password)
+    return await run_in_threadpool(crud.create_user, db=db, user=user, hashed_password=hashed_password)
 
 
-def authenticate_user(username: str, password: str, db: db_dependency):
-    user = crud.get_user(db=db, username=username)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+async def authenticate_user(username: str, password: str, db: db_dependency):
+    user = await run_in_threadpool(crud.get_user, db=db, username=username)
+    if not user:
         return False
+    verified, new_hash = await hasher.verify_and_update_async(password, user.hashed_password)
+    if not verified:
+        return False
+    if new_hash:
+        # The stored hash was made with a different cost factor; upgrade it transparently.
+        await run_in_threadpool(crud.set_password_hash, db=db, user_id=user.id, hashed_password=new_hash)
     return user
 
 
@@ -87,8 +139,8 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None):
 
 
 @app.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(form_data.username, form_data.password, db)
+async def login_for_access_token(db: db_dependency, form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -115,7 +167,7 @@ def verify_token(token: str = Depends(oauth2_scheme)):
 
 
 @app.get("/verify-token/{token}")
-async def verify_user_token(token: str, db: Session = Depends(get_db)):
+def verify_user_token(token: str, db: db_dependency):
     payload = verify_token(token=token)
     username = payload.get("username")
     user = crud.get_user(db, username=username)
@@ -127,7 +179,7 @@ async def verify_user_token(token: str, db: Session = Depends(get_db)):
 
 
 @app.post("/refresh-token")
-async def refresh_access_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def refresh_access_token(db: db_dependency, token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = payload.get("id")
@@ -147,13 +199,47 @@ async def refresh_access_token(token: str = Depends(oauth2_scheme), db: Session
     except JWTError:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid refresh token")
 
-@app.get("/users", response_model=List[schemas.User],tags=["Users"])
-async def list_users(db: db_dependency):
-    users = crud.get_users(db=db)
-    return users
+@app.get("/health/db-pool", tags=["Health"])
+async def db_pool_stats():
+    return pool_stats.snapshot(engine.pool)
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@app.get("/health/password-hasher", tags=["Health"])
+async def password_hasher_stats():
+    return hasher.stats()
+
+
+@app.get("/health/auth-cache", tags=["Health"])
+async def auth_cache_stats():
+    return principal_cache.stats()
+
+
+@app.get("/health/exam-cache", tags=["Health"])
+async def exam_cache_stats():
+    return http_cache.exam_cache.stats()
+
+
+@app.get("/health/exam-sessions", tags=["Health"])
+async def exam_session_stats():
+    return exam_sessions.hub.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+async def prometheus_metrics():
+    exam_cache = http_cache.exam_cache.stats()
+    body = metrics.render({
+        "db_pool": pool_stats.snapshot(engine.pool),
+        "exam_cache": exam_cache,
+        "exam_cache_shared": exam_cache.get("shared", {}),
+        "pool_cache": delivery.pool_cache.stats(),
+        "exam_sessions": exam_sessions.hub.stats(),
+        "auth_cache": principal_cache.stats(),
+        "password_hasher": hasher.stats(),
+    })
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+def get_current_user(db: db_dependency, token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -169,34 +255,97 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user is None:
+    cached = principal_cache.get(user_id)
+    if not is_missing(cached):
+        if cached is None:
+            raise credentials_exception
+        return cached
+
+    if AUTH_TRUST_CLAIMS and not principal_cache.is_revoked(user_id):
+        # The token signature vouches for these claims. Users deleted in this
+        # process are always looked up, for as long as their tokens can live.
+        return Principal(id=user_id, username=username, role=role)
+
+    principal = crud.get_principal(db, user_id)
+    principal_cache.set(user_id, principal)
+    if principal is None:
         raise credentials_exception
-    return user
+    return principal
 
 @app.put("/user/{user_id}", response_model=schemas.User,tags=["Users"])
 async def update_user(user_id: int, user: schemas.UserCreate, db: db_dependency):
-    db_user = crud.update_user(db, user_id, user)
+    # Checked before hashing so unknown ids never take a bcrypt slot.
+    if await run_in_threadpool(crud.get_principal, db, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    hashed_password = await hasher.hash_async(user.password)
+    db_user = await run_in_threadpool(crud.update_user, db, user_id, user, hashed_password)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 
 @app.delete("/user/{user_id}", response_model=dict,tags=["Users"])
-async def delete_user(user_id: int, db: db_dependency):
+def delete_user(user_id: int, db: db_dependency):
     result = crud.delete_user(db, user_id)
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
 
 
+@app.get("/users", response_model=List[schemas.User],tags=["Users"])
+def list_users(
+        db: db_dependency,
+        response: Response,
+        role: str | None = None,
+        username: str | None = Query(None, max_length=50),
+        email: str | None = Query(None, max_length=100),
+        after_id: int | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+        include_total: bool = False,
+        current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="You do not have permission to list users")
+    users = crud.get_users(db=db, role=role, username=username, email=email, after_id=after_id, limit=limit)
+    if len(users) == limit:
+        response.headers["X-Next-After-Id"] = str(users[-1]["id"])
+    if include_total:
+        response.headers["X-Total-Count"] = str(crud.count_users(db, role=role, username=username, email=email))
+    return users
+
+
+@app.post("/users/import", response_model=dict, tags=["Users"])
+def import_roster(
+        db: db_dependency,
+        file: UploadFile = File(...),
+        format: str = Query("csv", pattern="^(csv|jsonl|json)$"),
+        dry_run: bool = False,
+        current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role not in ["teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="You do not have permission to import users")
+    # Teachers enroll students; only admins may create teacher and admin accounts.
+    allowed_roles = roster.ROLES if current_user.role == "admin" else ("student",)
+    lines = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        return roster.import_roster(db, lines, format, allowed_roles=allowed_roles, dry_run=dry_run)
+    except roster.RosterTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnicodeDecodeError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="The file is not valid UTF-8")
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Accounts were created concurrently; retry the import")
+
+
 #### Exam Routes ####
 
 @app.post("/exam/", response_model=schemas.Exam, status_code=status.HTTP_201_CREATED, tags=["Exams"])
 def create_exam(
     exam: schemas.ExamCreate,
     db: db_dependency,
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role not in ["teacher", "admin"]:
         raise HTTPException(status_code=403, detail="You do not have permission to create an exam")
@@ -204,20 +353,104 @@ def create_exam(
     return crud.create_exam(db,exam,current_user.id)
 
 
-@app.get("/exam/{exam_id}", response_model=schemas.Exam,tags=["Exams"])
-async def read_exam(exam_id: int, db: db_dependency):
-    db_exam = crud.read_exam(db=db, exam_id=exam_id)
-    if db_exam is None:
+EXAM_INCLUDES = {"questions", "choices"}
+question_list_adapter = TypeAdapter(List[schemas.Question])
+
+
+def parse_include(include: str | None) -> set:
+    if not include:
+        return set()
+    requested = {part.strip() for part in include.split(",") if part.strip()}
+    unknown = requested - EXAM_INCLUDES
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    if "choices" in requested:
+        requested.add("questions")
+    return requested
+
+
+def serialize_exam(db_exam: models.Exam, include: set):
+    if "choices" in include:
+        return schemas.ExamBundle.model_validate(db_exam)
+    if "questions" in include:
+        return schemas.ExamWithQuestions.model_validate(db_exam)
+    return schemas.Exam.model_validate(db_exam)
+
+
+async def check_exam_owner_async(db: Session | AsyncSession, exam_id: int, current_user: Principal, action: str):
+    # Questions with their answer key are for the exam's owner and admins;
+    # students see the questions drawn for them through their attempt.
+    if current_user.role == "admin":
+        return
+    db_exam = await db_call(db, crud.read_exam, async_crud.read_exam, exam_id=exam_id)
+    check_exam_owner(db_exam, current_user, action)
+
+
+async def get_exam_version(db: Session | AsyncSession, exam_id: int) -> int:
+    version = await db_call(db, crud.get_exam_version, async_crud.get_exam_version, exam_id=exam_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Exam not found")
-    return db_exam
+    return version
+
+
+async def cached_exam_response(request: Request, db: Session | AsyncSession, exam_id: int, include: set):
+    # Variants with questions are only served to the exam's owner and admins,
+    # so every cached body has a single audience.
+    version = await get_exam_version(db, exam_id)
+    variant = "-".join(sorted(include)) or "exam"
+    etag = http_cache.exam_etag(exam_id, version, variant)
+    not_modified = http_cache.not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    async def load() -> bytes:
+        # Concurrent requests may wait on this load, and the request that
+        # started it may finish first, so it gets a session of its own.
+        async with read_session() as load_db:
+            if include:
+                db_exam = await db_call(load_db, crud.read_exam_bundle, async_crud.read_exam_bundle,
+                                        exam_id=exam_id, include_choices="choices" in include)
+            else:
+                db_exam = await db_call(load_db, crud.read_exam, async_crud.read_exam, exam_id=exam_id)
+            if db_exam is None:
+                raise HTTPException(status_code=404, detail="Exam not found")
+            return serialize_exam(db_exam, include).model_dump_json().encode()
+
+    body = await http_cache.exam_cache.get_or_load((exam_id, version, variant), load)
+    return http_cache.json_response(body, etag)
+
+
+@app.get("/exam/{exam_id}", tags=["Exams"])
+async def read_exam(
+        exam_id: int,
+        db: read_db_dependency,
+        request: Request,
+        include: str | None = None,
+        current_user: Principal = Depends(get_current_user)
+):
+    include = parse_include(include)
+    if include:
+        await check_exam_owner_async(db, exam_id, current_user, "view the questions")
+    return await cached_exam_response(request, db, exam_id, include)
+
+
+@app.get("/exam/{exam_id}/bundle", tags=["Exams"])
+async def read_exam_bundle(
+        exam_id: int,
+        db: read_db_dependency,
+        request: Request,
+        current_user: Principal = Depends(get_current_user)
+):
+    await check_exam_owner_async(db, exam_id, current_user, "view the questions")
+    return await cached_exam_response(request, db, exam_id, EXAM_INCLUDES)
 
 
 @app.put("/exam/{exam_id}", response_model=schemas.Exam, tags=["Exams"])
-async def update_exam(
+def update_exam(
         exam_id: int,
         exam: schemas.ExamCreate,
         db: db_dependency,
-        current_user: models.User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_user)
 ):
     db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     if db_exam is None:
@@ -232,10 +465,10 @@ async def update_exam(
 @app.delete("/exam/{exam_id}",
             response_model=dict,
             tags=["Exams"])
-async def delete_exam(
+def delete_exam(
         exam_id: int,
         db: db_dependency,
-        current_user: models.User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_user)
 ):
     db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     if db_exam is None:
@@ -249,8 +482,18 @@ async def delete_exam(
 
 @app.get("/exams/",
          tags=["Exams"])
-async def read_exams(db: db_dependency):
-    db_exams = crud.read_exams(db=db)
+async def read_exams(
+        db: read_db_dependency,
+        response: Response,
+        owner_id: int | None = None,
+        title: str | None = None,
+        after_id: int | None = None,
+        limit: int | None = Query(None, ge=1, le=500),
+):
+    db_exams = await db_call(db, crud.read_exams, async_crud.read_exams,
+                             owner_id=owner_id, title=title, after_id=after_id, limit=limit)
+    if limit is not None and len(db_exams) == limit:
+        response.headers["X-Next-After-Id"] = str(db_exams[-1]["id"])
     return db_exams
 
 
@@ -258,14 +501,14 @@ async def read_exams(db: db_dependency):
 
 
 @app.post("/exam/{exam_id}/question/",
-          response_model=schemas.Question,
+          response_model=schemas.QuestionCreated,
           status_code=status.HTTP_201_CREATED,
           tags=["Questions"])
-async def create_question(
+def create_question(
         question: schemas.QuestionCreate,
         exam_id: int,
-        db: Session = Depends(get_db),
-        current_user: models.User = Depends(get_current_user)
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
 ):
     db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     if not db_exam:
@@ -276,29 +519,60 @@ async def create_question(
 
     try:
         db_question = crud.create_question(db=db, question=question, exam_id=exam_id)
-        return db_question
+        matches = duplicates.find_near_duplicates(db, [db_question.id]).get(db_question.id, [])
+        response = schemas.QuestionCreated.model_validate(db_question)
+        response.near_duplicates = [schemas.NearDuplicate(**match) for match in matches]
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create question: {str(e)}")
 
 
-@app.get("/exam/{exam_id}/question/{question_id}",tags=["Questions"])
-async def read_question(exam_id: int,question_id: int, db: Session = Depends(get_db)):
-    db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
-    if not db_exam:
-        raise HTTPException(status_code=404, detail="Exam not found")
-    result = db.query(models.Question).filter(models.Question.id == question_id).first()
-    if not result:
+def question_etag(db_question: models.Question) -> str:
+    content = schemas.Question.model_validate(db_question).model_dump_json()
+    return '"' + hashlib.sha256(content.encode()).hexdigest()[:32] + '"'
+
+
+def get_exam_question(db: Session, exam_id: int, question_id: int) -> models.Question:
+    db_question = crud.get_questions_by_ids(db, exam_id, [question_id]).get(question_id)
+    if db_question is None:
         raise HTTPException(status_code=404, detail="Question not found")
-    return result
+    return db_question
+
+
+@app.get("/exam/{exam_id}/question/{question_id}", response_model=schemas.Question, tags=["Questions"])
+def read_question(
+        exam_id: int,
+        question_id: int,
+        db: db_dependency,
+        request: Request,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "view the questions")
+    version = crud.get_exam_version(db, exam_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+
+    def load() -> bytes:
+        db_question = get_exam_question(db, exam_id, question_id)
+        return schemas.Question.model_validate(db_question).model_dump_json().encode()
+
+    body = http_cache.exam_cache.get_or_load_sync((exam_id, version, f"question-{question_id}"), load)
+    # Same content hash as question_etag, which If-Match is checked against.
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    if http_cache.etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @app.put("/exam/{exam_id}/question/{question_id}", response_model=schemas.Question, tags=["Questions"])
-async def update_question(
+def update_question(
         exam_id: int,
         question_id: int,
-        question: schemas.QuestionCreate,
-        db: Session = Depends(get_db),
-        current_user: models.User = Depends(get_current_user)
+        question: schemas.QuestionUpdate,
+        db: db_dependency,
+        request: Request,
+        response: Response,
+        current_user: Principal = Depends(get_current_user)
 ):
 
     db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
@@ -309,44 +583,89 @@ async def update_question(
     if db_exam.owner_id != current_user.id and current_user.role != "admin":
         raise HTTPException(status_code=403, detail="You do not have permission to update this question")
 
-    db_question = crud.update_question(db, question_id, question)
-    if db_question is None:
-        raise HTTPException(status_code=404, detail="Question not found")
+    db_question = get_exam_question(db, exam_id, question_id)
+    if_match = request.headers.get("If-Match")
+    if if_match and not http_cache.etag_matches(if_match, question_etag(db_question)):
+        raise HTTPException(status_code=412, detail="Question has been modified since it was loaded")
 
+    crud.update_questions(db, [(db_question, question)])
+    response.headers["ETag"] = question_etag(db_question)
     return db_question
 
 
-@app.post("/image/",tags=["Images"])
-async def upload_image(file: UploadFile = File(...)):
-    file_location = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
-    return {"filename": file.filename}
+@app.patch("/exam/{exam_id}/questions", response_model=List[schemas.QuestionSaveResult], tags=["Questions"])
+def update_questions(
+        exam_id: int,
+        questions: List[schemas.QuestionPatch],
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "update questions")
 
+    question_ids = [question.id for question in questions]
+    if len(set(question_ids)) != len(question_ids):
+        raise HTTPException(status_code=400, detail="Each question may only appear once per batch")
+    db_questions = crud.get_questions_by_ids(db, exam_id, question_ids)
+    missing = [question_id for question_id in question_ids if question_id not in db_questions]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Questions not found in this exam: {missing}")
 
-@app.get("/image/{filename}",tags=["Images"])
-async def get_image(filename: str):
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+    for question in questions:
+        if question.etag and not http_cache.etag_matches(question.etag, question_etag(db_questions[question.id])):
+            raise HTTPException(status_code=412, detail=f"Question {question.id} has been modified since it was loaded")
+
+    changed = crud.update_questions(db, [(db_questions[question.id], question) for question in questions])
+    if any(changed):
+        db_questions = crud.get_questions_by_ids(db, exam_id, question_ids)
+    return [
+        schemas.QuestionSaveResult(id=question_id, etag=question_etag(db_questions[question_id]), changed=question_changed)
+        for question_id, question_changed in zip(question_ids, changed)
+    ]
+
+
+@app.post("/image/",tags=["Images"])
+async def upload_image(db: db_dependency, request: Request, file: UploadFile = File(...)):
+    content_length = request.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > images.UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"Image exceeds the {images.UPLOAD_MAX_BYTES} byte limit")
+    filename, size, temp_path = await images.store_upload(file)
+    if await run_in_threadpool(images.add_reference, db, filename, size, temp_path):
+        image_worker.worker_pool.wake()
+    return {"filename": filename}
+
+
+@app.api_route("/image/{filename}", methods=["GET", "HEAD"], tags=["Images"])
+async def get_image(filename: str, request: Request, w: int | None = Query(None, ge=1)):
+    file_path = images.image_path(filename)
+    cache_control = None
+    if w is not None and "image/webp" in request.headers.get("Accept", ""):
+        # Variants are WebP, so only browsers that accept it get them.
+        variant_path = images.pick_variant(filename, w)
+        if variant_path is not None:
+            file_path = variant_path
+        elif any(width >= w for width in images.VARIANT_WIDTHS):
+            # The variant is not generated yet; the original must not be
+            # cached for good under this URL.
+            cache_control = static_files.REVALIDATE_CACHE_CONTROL
+    return await static_files.serve_file(request, file_path, extra_headers={"Vary": "Accept"},
+                                         cache_control=cache_control)
 
 @app.delete("/image/{filename}",tags=["Images"])
-async def delete_image(filename: str):
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        return {"detail": "Image deleted successfully"}
-    else:
+def delete_image(filename: str, db: db_dependency):
+    removed = images.release_reference(db, filename)
+    if removed is None:
         raise HTTPException(status_code=404, detail="Image not found")
+    if removed:
+        return {"detail": "Image deleted successfully"}
+    return {"detail": "Image reference released; the file is still used elsewhere"}
 
 
 @app.delete("/exam/{exam_id}/question/{question_id}", response_model=dict, tags=["Questions"])
-async def delete_question(
+def delete_question(
         exam_id: int,
         question_id: int,
         db: db_dependency,
-        current_user: models.User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_user)
 ):
     db_exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
 
@@ -363,31 +682,118 @@ async def delete_question(
     return {"message": "Question deleted successfully"}
 
 
+@app.get("/exam/{exam_id}/question/{question_id}/duplicates", response_model=schemas.QuestionDuplicates,
+         tags=["Questions"])
+def read_question_duplicates(
+        exam_id: int,
+        question_id: int,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "inspect questions")
+    db_signature = db.get(models.QuestionSignature, question_id)
+    if db_signature is None or db_signature.exam_id != exam_id:
+        raise HTTPException(status_code=404, detail="Question not found or not indexed")
+    return {
+        "question_id": question_id,
+        "cluster_id": db_signature.cluster_id,
+        "near_duplicates": duplicates.find_near_duplicates(db, [question_id]).get(question_id, []),
+    }
+
+
 @app.get("/exams/{exam_id}/questions", response_model=List[schemas.Question],tags=["Questions"])
-async def list_questions_by_exam(exam_id: int, db: db_dependency):
+async def list_questions_by_exam(
+        exam_id: int,
+        db: read_db_dependency,
+        request: Request,
+        current_user: Principal = Depends(get_current_user)
+):
+    await check_exam_owner_async(db, exam_id, current_user, "view the questions")
+    version = await get_exam_version(db, exam_id)
+    etag = http_cache.exam_etag(exam_id, version, "question-list")
+    not_modified = http_cache.not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
 
-    exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
-    if not exam:
-        raise HTTPException(status_code=404, detail="Exam not found")
+    async def load() -> bytes:
+        async with read_session() as load_db:
+            questions = await db_call(load_db, crud.get_questions_by_exam, async_crud.get_questions_by_exam,
+                                      exam_id=exam_id)
+            if not questions:
+                raise HTTPException(status_code=404, detail="No questions found for this exam")
+            return question_list_adapter.dump_json(questions)
 
-    questions = crud.get_questions_by_exam(db=db, exam_id=exam_id)
+    body = await http_cache.exam_cache.get_or_load((exam_id, version, "question-list"), load)
+    return http_cache.json_response(body, etag)
 
-    if not questions:
-        raise HTTPException(status_code=404, detail="No questions found for this exam")
+QUESTION_BANK_MEDIA_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+
+
+@app.get("/questions/search", response_model=List[schemas.QuestionSearchResult], tags=["Questions"])
+def search_questions(
+        db: db_dependency,
+        q: str = Query(..., min_length=1, max_length=200),
+        owner_id: int | None = None,
+        exam_id: int | None = None,
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0, le=10000),
+        current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role not in ["teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="You do not have permission to search questions")
+    return search.search_questions(db, q, owner_id=owner_id, exam_id=exam_id, limit=limit, offset=offset)
+
+
+@app.post("/exam/{exam_id}/questions/import", response_model=dict, tags=["Questions"])
+def import_questions(
+        exam_id: int,
+        db: db_dependency,
+        file: UploadFile = File(...),
+        format: str = Query("jsonl", pattern="^(jsonl|csv)$"),
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "import questions")
+    lines = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        return question_bank.import_questions(db, exam_id, lines, format)
+    except UnicodeDecodeError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="The file is not valid UTF-8")
+
+
+@app.get("/exam/{exam_id}/questions/export", tags=["Questions"])
+def export_questions(
+        exam_id: int,
+        db: db_dependency,
+        format: str = Query("jsonl", pattern="^(jsonl|csv)$"),
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "export questions")
+
+    # The request session is closed before the body is streamed, so the
+    # export runs on its own session.
+    def stream():
+        with SessionLocal() as export_db:
+            yield from question_bank.export_questions(export_db, exam_id, format)
+
+    return StreamingResponse(
+        stream(),
+        media_type=QUESTION_BANK_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="exam-{exam_id}-questions.{format}"'},
+    )
 
-    return questions
 
 ### Choice Routes ###
 
 
 @app.post("/exam/{exam_id}/question/{question_id}/choice/", response_model=schemas.Choice,
           status_code=status.HTTP_201_CREATED, tags=["Choices"])
-async def create_choice(
+def create_choice(
         choice: schemas.ChoiceCreate,
         exam_id: int,
         question_id: int,
         db: db_dependency,
-        current_user: models.User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_user)
 ):
     exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     if not exam:
@@ -405,27 +811,35 @@ async def create_choice(
 
 
 @app.get("/exam/{exam_id}/question/{question_id}/choice/{choice_id}", response_model=schemas.Choice,tags=["Choices"])
-async def read_choice(exam_id: int, question_id: int,choice_id: int, db: Session = Depends(get_db)):
-    exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
-    if not exam:
-        raise HTTPException(status_code=404, detail="Exam not found")
-    question = db.query(models.Question).filter(models.Question.id == question_id).first()
+def read_choice(
+        exam_id: int,
+        question_id: int,
+        choice_id: int,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "view the choices")
+    question = db.query(models.Question).filter(
+        models.Question.id == question_id, models.Question.exam_id == exam_id
+    ).first()
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
-    result = db.query(models.Choice).filter(models.Choice.id == choice_id).first()
+    result = db.query(models.Choice).filter(
+        models.Choice.id == choice_id, models.Choice.question_id == question_id
+    ).first()
     if not result:
         raise HTTPException(status_code=404, detail="Choice not found")
     return result
 
 
 @app.put("/exam/{exam_id}/question/{question_id}/choice/{choice_id}", response_model=schemas.Choice, tags=["Choices"])
-async def update_choice(
+def update_choice(
         exam_id: int,
         question_id: int,
         choice_id: int,
         choice: schemas.ChoiceCreate,
         db: db_dependency,
-        current_user: models.User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_user)
 ):
     exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     if not exam:
@@ -446,12 +860,12 @@ async def update_choice(
 
 
 @app.delete("/exam/{exam_id}/question/{question_id}/choice/{choice_id}", response_model=dict, tags=["Choices"])
-async def delete_choice(
+def delete_choice(
         exam_id: int,
         question_id: int,
         choice_id: int,
         db: db_dependency,
-        current_user: models.User = Depends(get_current_user)
+        current_user: Principal = Depends(get_current_user)
 ):
     exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
     if not exam:
@@ -472,13 +886,31 @@ async def delete_choice(
 
 
 @app.get("/exam/{exam_id}/question/{question_id}/choices",tags=["Choices"])
-async def list_choices_by_question(exam_id: int, question_id: int, db: Session = Depends(get_db)):
-    # Check if the exam exists
-    exam = db.query(models.Exam).filter(models.Exam.id == exam_id).first()
-    if not exam:
+def list_choices_by_question(
+        exam_id: int,
+        question_id: int,
+        db: db_dependency,
+        request: Request,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "view the choices")
+    version = crud.get_exam_version(db, exam_id)
+    if version is None:
         logger.warning(f"Exam with ID {exam_id} not found")
         raise HTTPException(status_code=404, detail="Exam not found")
 
+    variant = f"choices-{question_id}"
+    etag = http_cache.exam_etag(exam_id, version, variant)
+    not_modified = http_cache.not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    body = http_cache.exam_cache.get_or_load_sync(
+        (exam_id, version, variant), lambda: load_question_choices(db, exam_id, question_id)
+    )
+    return http_cache.json_response(body, etag)
+
+
+def load_question_choices(db: Session, exam_id: int, question_id: int) -> bytes:
     # Check if the question belongs to the specified exam
     question = db.query(models.Question).filter(
         models.Question.id == question_id,
@@ -490,17 +922,270 @@ async def list_choices_by_question(exam_id: int, question_id: int, db: Session =
         raise HTTPException(status_code=404, detail="Question not found or does not belong to the specified exam")
 
     # Retrieve the choices for the question
-    choices = db.query(models.Choice).filter(models.Choice.question_id == question_id).all()
+    choices = db.query(models.Choice).filter(models.Choice.question_id == question_id).order_by(models.Choice.id).all()
 
     if not choices:
         logger.warning(f"No choices found for Question ID {question_id}")
         raise HTTPException(status_code=404, detail="Choices not found for the specified question")
 
     # Format the choices to match the expected response model
-    return [{"id": choice.id, "choice_text": choice.choice_text, "is_correct": choice.is_correct} for choice in choices]
+    return json.dumps(
+        [{"id": choice.id, "choice_text": choice.choice_text, "is_correct": choice.is_correct} for choice in choices]
+    ).encode()
 
 
+### Attempt Routes ###
 
 
+def check_exam_owner(db_exam: models.Exam | None, current_user: Principal, action: str):
+    if db_exam is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    if db_exam.owner_id != current_user.id and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail=f"You do not have permission to {action} for this exam")
 
 
+def get_owned_exam(db: Session, exam_id: int, current_user: Principal, action: str):
+    db_exam = crud.read_exam(db=db, exam_id=exam_id)
+    check_exam_owner(db_exam, current_user, action)
+    return db_exam
+
+
+@app.post("/exam/{exam_id}/attempts", response_model=schemas.Attempt,
+          status_code=status.HTTP_201_CREATED, tags=["Attempts"])
+def start_attempt(
+        exam_id: int,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    version = crud.get_exam_version(db, exam_id)
+    pool = delivery.get_pool(db, exam_id, version) if version is not None else None
+    if pool is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    if exam_sessions.is_past(crud.read_exam(db, exam_id).closes_at):
+        raise HTTPException(status_code=403, detail="The exam is closed")
+    return crud.create_attempt(
+        db, exam_id, current_user.id,
+        lambda db_attempt: delivery.draw_attempt(pool, exam_id, current_user.id, db_attempt.id),
+    )
+
+
+def get_own_attempt(db: Session, attempt_id: int, current_user: Principal, action: str,
+                    for_update: bool = False) -> models.Attempt:
+    db_attempt = crud.get_attempt(db, attempt_id, for_update=for_update)
+    if db_attempt is None:
+        raise HTTPException(status_code=404, detail="Attempt not found")
+    if db_attempt.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail=f"You do not have permission to {action} this attempt")
+    return db_attempt
+
+
+@app.get("/attempts/{attempt_id}/exam", response_model=schemas.StudentExamBundle, tags=["Attempts"])
+def read_attempt_exam(
+        attempt_id: int,
+        db: db_dependency,
+        request: Request,
+        current_user: Principal = Depends(get_current_user)
+):
+    db_attempt = get_own_attempt(db, attempt_id, current_user, "view")
+    version = crud.get_exam_version(db, db_attempt.exam_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    etag = http_cache.exam_etag(db_attempt.exam_id, version, f"attempt-{attempt_id}")
+    not_modified = http_cache.not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    # The pool is cached per exam version, so laying out the exam for another
+    # student costs no queries beyond the attempt and version lookups above.
+    pool = delivery.get_pool(db, db_attempt.exam_id, version)
+    if pool is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    seed = delivery.attempt_seed(db_attempt.exam_id, db_attempt.user_id, db_attempt.id)
+    question_ids = crud.get_attempt_question_ids(db, [attempt_id]).get(attempt_id)
+    return JSONResponse(
+        delivery.build_layout(pool, seed, question_ids),
+        headers={"ETag": etag, "Cache-Control": http_cache.EXAM_CACHE_CONTROL},
+    )
+
+
+def load_attempt_session(attempt_id: int, token: str):
+    with SessionLocal() as db:
+        current_user = get_current_user(db, token)
+        db_attempt = get_own_attempt(db, attempt_id, current_user, "open")
+        if db_attempt.submitted_at is not None:
+            raise HTTPException(status_code=409, detail="Attempt has already been submitted")
+        db_exam = crud.read_exam(db, db_attempt.exam_id)
+        pool = delivery.get_pool(db, db_exam.id, db_exam.content_version)
+        question_ids = crud.get_attempt_question_ids(db, [attempt_id]).get(attempt_id)
+        return db_attempt, db_exam, pool, question_ids, crud.get_attempt_answers(db, attempt_id)
+
+
+@app.websocket("/attempts/{attempt_id}/session")
+async def attempt_session(websocket: WebSocket, attempt_id: int, token: str = ""):
+    # Browsers cannot set headers on WebSocket requests, so the access token
+    # comes in the query string.
+    await websocket.accept()
+    try:
+        db_attempt, db_exam, pool, question_ids, saved = await run_in_threadpool(load_attempt_session, attempt_id, token)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close(code=4000 + e.status_code)
+        return
+
+    hub = exam_sessions.hub
+    hub.start()
+    session = await hub.open(websocket, db_attempt, pool, db_exam, question_ids)
+    try:
+        remaining = session.remaining_seconds(datetime.now(timezone.utc))
+        await websocket.send_json({
+            "type": "state",
+            "answers": {**saved, **hub.pending_answers(attempt_id)},
+            "deadline": session.deadline.isoformat() if session.deadline else None,
+            "remaining_seconds": remaining,
+        })
+        if remaining == 0:
+            await hub.close_attempt(session, "time_up")
+            return
+
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                kind = message.get("type")
+                if kind == "answer":
+                    question_id = int(message["question_id"])
+                    choice_ids = [int(choice_id) for choice_id in message.get("choice_ids", [])]
+                    seq = message.get("seq")
+                    error = hub.record_answer(session, question_id, choice_ids, int(seq) if seq is not None else None)
+                elif kind == "submit":
+                    await hub.close_attempt(session, "submitted")
+                    return
+                elif kind == "ping":
+                    await websocket.send_json({"type": "pong"})
+                    continue
+                else:
+                    error = f"Unknown message type '{kind}'"
+            except (ValueError, TypeError, KeyError, AttributeError):
+                error = "Malformed message"
+            if error:
+                await websocket.send_json({"type": "error", "detail": error})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.leave(session, websocket)
+
+
+@app.post("/attempts/{attempt_id}/submit", response_model=schemas.Attempt, tags=["Attempts"])
+def submit_attempt(
+        attempt_id: int,
+        submission: schemas.AttemptSubmit,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    db_attempt = get_own_attempt(db, attempt_id, current_user, "submit", for_update=True)
+    if db_attempt.submitted_at is not None:
+        raise HTTPException(status_code=409, detail="Attempt has already been submitted")
+
+    key = grading.build_answer_key(db, db_attempt.exam_id)
+    db_exam = crud.read_exam(db, db_attempt.exam_id)
+    deadline = exam_sessions.attempt_deadline(db_attempt.started_at, db_exam.duration_minutes, db_exam.closes_at)
+    if exam_sessions.is_past(deadline, exam_sessions.SUBMIT_GRACE_SECONDS):
+        # Too late to change anything: the autosaved selection is what gets graded.
+        crud.submit_attempt(db, db_attempt, None)
+        grading.grade_attempts(db, db_attempt.exam_id, attempt_ids=[db_attempt.id], key=key)
+        db.refresh(db_attempt)
+        return db_attempt
+
+    drawn = set(grading.attempt_question_ids(db, key, db_attempt))
+    answers = set()
+    for answer in submission.answers:
+        if answer.question_id not in drawn:
+            raise HTTPException(status_code=400, detail=f"Question {answer.question_id} is not part of this attempt")
+        for choice_id in answer.choice_ids:
+            if key.question_of_choice(choice_id) != answer.question_id:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Choice {choice_id} does not belong to question {answer.question_id} of this exam"
+                )
+            answers.add((answer.question_id, choice_id))
+
+    crud.submit_attempt(db, db_attempt, sorted(answers))
+    grading.grade_attempts(db, db_attempt.exam_id, attempt_ids=[db_attempt.id], key=key)
+    db.refresh(db_attempt)
+    return db_attempt
+
+
+@app.get("/exam/{exam_id}/attempts", response_model=List[schemas.Attempt], tags=["Attempts"])
+def list_attempts(
+        exam_id: int,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "view attempts")
+    return crud.list_attempts(db, exam_id)
+
+
+@app.post("/exam/{exam_id}/grade", response_model=dict, tags=["Attempts"])
+def grade_exam(
+        exam_id: int,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "grade attempts")
+    graded = grading.grade_attempts(db, exam_id)
+    return {"graded": graded}
+
+
+@app.get("/exam/{exam_id}/analytics", response_model=schemas.ExamAnalytics, tags=["Attempts"])
+def read_exam_analytics(
+        exam_id: int,
+        db: db_dependency,
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "view analytics")
+    return analytics.exam_analytics(db, exam_id)
+
+
+def results_export_response(format: str, gzip: bool, after_id: int, exam_id: int | None = None,
+                            owner_id: int | None = None) -> StreamingResponse:
+    if format == "parquet" and not results_export.parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server")
+
+    # Streamed on its own session, like the question bank export.
+    def stream():
+        with SessionLocal() as export_db:
+            chunks = results_export.export_results(export_db, format, exam_id=exam_id, owner_id=owner_id,
+                                                   after_id=after_id)
+            yield from results_export.gzip_chunks(chunks) if gzip else chunks
+
+    filename = results_export.export_filename(format, gzip, exam_id=exam_id, owner_id=owner_id)
+    return StreamingResponse(
+        stream(),
+        media_type="application/gzip" if gzip else results_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/exam/{exam_id}/results/export", tags=["Attempts"])
+def export_exam_results(
+        exam_id: int,
+        db: db_dependency,
+        format: str = Query("csv", pattern="^(csv|jsonl|parquet)$"),
+        gzip: bool = False,
+        after_id: int = Query(0, ge=0),
+        current_user: Principal = Depends(get_current_user)
+):
+    get_owned_exam(db, exam_id, current_user, "export results")
+    return results_export_response(format, gzip, after_id, exam_id=exam_id)
+
+
+@app.get("/user/{user_id}/results/export", tags=["Attempts"])
+def export_owner_results(
+        user_id: int,
+        format: str = Query("csv", pattern="^(csv|jsonl|parquet)$"),
+        gzip: bool = False,
+        after_id: int = Query(0, ge=0),
+        current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role != "admin" and current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="You do not have permission to export these results")
+    return results_export_response(format, gzip, after_id, owner_id=user_id)
@@ -0,0 +1,228 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv("METRICS_N_PLUS_ONE_THRESHOLD", "20"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables the slow-request log
+SLOW_REQUEST_MAX_STATEMENTS = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("slow_requests")
+
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str, labels: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: tuple, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    bucket_labels = _labels(self.labels + ("le",), label_values + (_number(bound),))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "route"), LATENCY_BUCKETS
+)
+requests_total = CounterMetric("http_requests_total", "Requests by route and status code.", ("method", "route", "status"))
+request_queries = Histogram(
+    "db_queries_per_request", "SQL statements executed per request.", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+db_seconds_total = CounterMetric("db_query_seconds_total", "Time spent executing SQL by route.", ("method", "route"))
+n_plus_one_total = CounterMetric(
+    "db_n_plus_one_requests_total",
+    f"Requests that ran more than {METRICS_N_PLUS_ONE_THRESHOLD} SQL statements.",
+    ("method", "route"),
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements", "record_statements")
+
+    def __init__(self, record_statements: bool):
+        self.queries = Counter()
+        self.db_seconds = 0.0
+        self.statements = []
+        self.record_statements = record_statements
+
+    @property
+    def query_count(self) -> int:
+        return sum(self.queries.values())
+
+
+# Set for the duration of a request. The threadpool and SQLAlchemy's async
+# greenlets both copy the context, so statements run on behalf of the request
+# are attributed to it wherever they execute.
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_request.get() is not None:
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = current_request.get()
+        starts = conn.info.get("query_start")
+        if stats is None or not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats.queries[statement] += 1
+        stats.db_seconds += elapsed
+        if stats.record_statements and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+            stats.statements.append((elapsed, statement))
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(record_statements=SLOW_REQUEST_MS > 0)
+        token = current_request.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            record_request(scope, status_code, time.perf_counter() - start, stats)
+
+
+def record_request(scope, status_code: int, elapsed: float, stats: RequestStats):
+    # The router stores the matched route on the scope; using its template
+    # keeps label cardinality bounded no matter which ids are requested.
+    route = scope.get("route")
+    route_path = getattr(route, "path", None) or "unmatched"
+    method = scope["method"]
+    query_count = stats.query_count
+
+    request_latency.observe((method, route_path), elapsed)
+    requests_total.inc((method, route_path, str(status_code)))
+    request_queries.observe((method, route_path), query_count)
+    db_seconds_total.inc((method, route_path), stats.db_seconds)
+
+    if query_count > METRICS_N_PLUS_ONE_THRESHOLD:
+        n_plus_one_total.inc((method, route_path))
+        statement, repeats = stats.queries.most_common(1)[0]
+        logger.warning(
+            f"Possible N+1 in {method} {route_path}: {query_count} SQL statements, "
+            f"{repeats} of them: {' '.join(statement.split())}"
+        )
+
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        lines = [
+            f"Slow request {method} {scope['path']} ({route_path}) -> {status_code}: "
+            f"{elapsed * 1000:.1f} ms, {query_count} SQL statements, {stats.db_seconds * 1000:.1f} ms in the database"
+        ]
+        for seconds, statement in stats.statements:
+            lines.append(f"  {seconds * 1000:8.2f} ms  {' '.join(statement.split())}")
+        if query_count > len(stats.statements):
+            lines.append(f"  ... {query_count - len(stats.statements)} more")
+        slow_logger.warning("\n".join(lines))
+
+
+# Keys of the /health snapshots that only ever grow; they are exported as
+# counters so rate() works on them.
+SNAPSHOT_COUNTERS = {
+    "hits", "misses", "evictions", "coalesced", "errors", "submitted", "rejected",
+    "flushes", "saved_selections", "connects", "checkouts", "checkins", "timeouts", "skipped",
+}
+
+
+def render(snapshots: dict | None = None) -> str:
+    lines = []
+    for metric in (request_latency, requests_total, request_queries, db_seconds_total, n_plus_one_total):
+        lines.extend(metric.render())
+    # Values from the existing /health snapshots, e.g. db_pool_checked_out
+    # (gauge) or exam_cache_hits_total (counter).
+    for prefix, values in (snapshots or {}).items():
+        for key, value in values.items():
+            if not isinstance(value, (bool, int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            if key in SNAPSHOT_COUNTERS or key.endswith("_total"):
+                name = name if name.endswith("_total") else name + "_total"
+                lines.append(f"# TYPE {name} counter")
+            else:
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(float(value))}")
+    return "\n".join(lines) + "\n"
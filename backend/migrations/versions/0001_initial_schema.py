@@ -0,0 +1,72 @@
+"""Initial schema
+
+The tables as they were created by ``Base.metadata.create_all`` before
+migrations were introduced. Databases created that way should be stamped
+with this revision (``alembic stamp 0001``) before upgrading.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(50), nullable=False),
+        sa.Column("email", sa.String(100), nullable=False),
+        sa.Column("hashed_password", sa.String(255), nullable=False),
+        sa.Column("name", sa.String(50), nullable=False),
+        sa.Column("surname", sa.String(50), nullable=False),
+        sa.Column("role", sa.String(20), nullable=False),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "exams",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(100), nullable=False),
+        sa.Column("description", sa.String(255)),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.CheckConstraint("title != ''", name="check_exam_title_not_empty"),
+    )
+    op.create_index("ix_exams_id", "exams", ["id"])
+
+    op.create_table(
+        "questions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("question_text", sa.String(255), nullable=False),
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id"), nullable=False),
+        sa.Column("is_multiple_choice", sa.Boolean()),
+        sa.Column("image_path", sa.String(255), nullable=True),
+        sa.CheckConstraint("question_text != ''", name="check_question_text_not_empty"),
+    )
+    op.create_index("ix_questions_id", "questions", ["id"])
+
+    op.create_table(
+        "choices",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("choice_text", sa.String(255), nullable=False),
+        sa.Column("is_correct", sa.Boolean(), nullable=False),
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id"), nullable=False),
+        sa.CheckConstraint("choice_text != ''", name="check_choice_text_not_empty"),
+    )
+    op.create_index("ix_choices_id", "choices", ["id"])
+
+
+def downgrade():
+    op.drop_table("choices")
+    op.drop_table("questions")
+    op.drop_table("exams")
+    op.drop_table("users")
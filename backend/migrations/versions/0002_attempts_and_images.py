@@ -0,0 +1,74 @@
+"""Exam content versions, attempts, answers and stored images
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("exams") as batch_op:
+        batch_op.add_column(sa.Column("content_version", sa.Integer(), nullable=False, server_default="1"))
+
+    op.create_table(
+        "attempts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("submitted_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("graded_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("score", sa.Float(), nullable=True),
+    )
+    op.create_index("ix_attempts_id", "attempts", ["id"])
+    op.create_index("ix_attempts_exam_id", "attempts", ["exam_id"])
+    op.create_index("ix_attempts_user_id", "attempts", ["user_id"])
+
+    op.create_table(
+        "answers",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("attempt_id", sa.Integer(), sa.ForeignKey("attempts.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("choice_id", sa.Integer(), sa.ForeignKey("choices.id", ondelete="CASCADE"), nullable=False),
+        sa.UniqueConstraint("attempt_id", "choice_id", name="uq_answer_attempt_choice"),
+    )
+    op.create_index("ix_answers_id", "answers", ["id"])
+    op.create_index("ix_answers_attempt_id", "answers", ["attempt_id"])
+
+    op.create_table(
+        "images",
+        sa.Column("filename", sa.String(100), primary_key=True),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+        sa.Column("size_bytes", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+    op.create_table(
+        "image_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("filename", sa.String(100), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("error", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_image_jobs_id", "image_jobs", ["id"])
+    op.create_index("ix_image_jobs_status", "image_jobs", ["status"])
+
+
+def downgrade():
+    op.drop_table("image_jobs")
+    op.drop_table("images")
+    op.drop_table("answers")
+    op.drop_table("attempts")
+    with op.batch_alter_table("exams") as batch_op:
+        batch_op.drop_column("content_version")
@@ -0,0 +1,27 @@
+"""Index the foreign keys used by exam, question and choice lookups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_exams_owner_id", "exams", ["owner_id"])
+    op.create_index("ix_questions_exam_id_id", "questions", ["exam_id", "id"])
+    op.create_index("ix_choices_question_id_id", "choices", ["question_id", "id"])
+    op.create_index("ix_answers_choice_id", "answers", ["choice_id"])
+
+
+def downgrade():
+    op.drop_index("ix_answers_choice_id", table_name="answers")
+    op.drop_index("ix_choices_question_id_id", table_name="choices")
+    op.drop_index("ix_questions_exam_id_id", table_name="questions")
+    op.drop_index("ix_exams_owner_id", table_name="exams")
@@ -0,0 +1,30 @@
+"""Question pool settings on exams
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("exams") as batch_op:
+        batch_op.add_column(sa.Column("questions_per_attempt", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("shuffle_questions", sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column("shuffle_choices", sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.create_check_constraint("check_exam_questions_per_attempt_positive", "questions_per_attempt > 0")
+
+
+def downgrade():
+    with op.batch_alter_table("exams") as batch_op:
+        batch_op.drop_constraint("check_exam_questions_per_attempt_positive", type_="check")
+        batch_op.drop_column("shuffle_choices")
+        batch_op.drop_column("shuffle_questions")
+        batch_op.drop_column("questions_per_attempt")
@@ -0,0 +1,28 @@
+"""Exam duration and closing time
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("exams") as batch_op:
+        batch_op.add_column(sa.Column("duration_minutes", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("closes_at", sa.DateTime(timezone=True), nullable=True))
+        batch_op.create_check_constraint("check_exam_duration_minutes_positive", "duration_minutes > 0")
+
+
+def downgrade():
+    with op.batch_alter_table("exams") as batch_op:
+        batch_op.drop_constraint("check_exam_duration_minutes_positive", type_="check")
+        batch_op.drop_column("closes_at")
+        batch_op.drop_column("duration_minutes")
@@ -0,0 +1,41 @@
+"""Full-text search indexes for questions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "question_search",
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("search_vector", TSVECTOR().with_variant(sa.Text(), "sqlite"), nullable=False),
+    )
+    op.create_index("ix_question_search_exam_id", "question_search", ["exam_id"])
+    if op.get_bind().dialect.name == "postgresql":
+        op.create_index("ix_question_search_vector", "question_search", ["search_vector"], postgresql_using="gin")
+
+    op.create_table(
+        "question_terms",
+        sa.Column("term", sa.String(64), primary_key=True),
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("weight", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_question_terms_question_id", "question_terms", ["question_id"])
+    # Existing questions are indexed afterwards with `python search.py reindex`.
+
+
+def downgrade():
+    op.drop_table("question_terms")
+    op.drop_table("question_search")
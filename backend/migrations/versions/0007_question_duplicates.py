@@ -0,0 +1,40 @@
+"""Near-duplicate question index
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "question_signatures",
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("signature", sa.LargeBinary(), nullable=False),
+        sa.Column("cluster_id", sa.Integer(), nullable=True),
+    )
+    op.create_index("ix_question_signatures_exam_id", "question_signatures", ["exam_id"])
+    op.create_index("ix_question_signatures_cluster_id", "question_signatures", ["cluster_id"])
+
+    op.create_table(
+        "question_bands",
+        sa.Column("band", sa.SmallInteger(), primary_key=True),
+        sa.Column("bucket", sa.BigInteger(), primary_key=True),
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True),
+    )
+    op.create_index("ix_question_bands_question_id", "question_bands", ["question_id"])
+    # Existing questions are indexed afterwards with `python duplicates.py reindex`.
+
+
+def downgrade():
+    op.drop_table("question_bands")
+    op.drop_table("question_signatures")
@@ -0,0 +1,57 @@
+"""Exam, question and choice statistics
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("attempts") as batch_op:
+        batch_op.add_column(sa.Column("analyzed_at", sa.DateTime(timezone=True), nullable=True))
+
+    op.create_table(
+        "exam_statistics",
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("content_version", sa.Integer(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("score_sum", sa.Float(), nullable=False),
+        sa.Column("score_sq_sum", sa.Float(), nullable=False),
+        sa.Column("refreshed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_table(
+        "question_statistics",
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("responses", sa.Integer(), nullable=False),
+        sa.Column("score_sum", sa.Float(), nullable=False),
+        sa.Column("score_sq_sum", sa.Float(), nullable=False),
+        sa.Column("total_sum", sa.Float(), nullable=False),
+        sa.Column("total_sq_sum", sa.Float(), nullable=False),
+        sa.Column("cross_sum", sa.Float(), nullable=False),
+    )
+    op.create_index("ix_question_statistics_exam_id", "question_statistics", ["exam_id"])
+    op.create_table(
+        "choice_statistics",
+        sa.Column("choice_id", sa.Integer(), sa.ForeignKey("choices.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("exam_id", sa.Integer(), sa.ForeignKey("exams.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("selections", sa.Integer(), nullable=False),
+        sa.Column("score_sum", sa.Float(), nullable=False),
+    )
+    op.create_index("ix_choice_statistics_exam_id", "choice_statistics", ["exam_id"])
+
+
+def downgrade():
+    op.drop_table("choice_statistics")
+    op.drop_table("question_statistics")
+    op.drop_table("exam_statistics")
+    with op.batch_alter_table("attempts") as batch_op:
+        batch_op.drop_column("analyzed_at")
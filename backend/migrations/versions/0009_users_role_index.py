@@ -0,0 +1,21 @@
+"""Index users by role for the paginated user listing
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_users_role_id", "users", ["role", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_users_role_id", table_name="users")
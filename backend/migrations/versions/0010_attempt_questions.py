@@ -0,0 +1,28 @@
+"""Store the questions drawn for each attempt
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "attempt_questions",
+        sa.Column("attempt_id", sa.Integer(), sa.ForeignKey("attempts.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True),
+    )
+    op.create_index("ix_attempt_questions_question_id", "attempt_questions", ["question_id"])
+    # Existing attempts keep having their draw reproduced from their seed.
+
+
+def downgrade():
+    op.drop_table("attempt_questions")
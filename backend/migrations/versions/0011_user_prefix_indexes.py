@@ -0,0 +1,27 @@
+"""Pattern indexes for the username and email prefix filters
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.create_index("ix_users_username_pattern", "users", ["username"],
+                        postgresql_ops={"username": "varchar_pattern_ops"})
+        op.create_index("ix_users_email_pattern", "users", ["email"],
+                        postgresql_ops={"email": "varchar_pattern_ops"})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("ix_users_email_pattern", table_name="users")
+        op.drop_index("ix_users_username_pattern", table_name="users")
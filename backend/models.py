@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, CheckConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, Integer, LargeBinary, SmallInteger, String, ForeignKey, Boolean, CheckConstraint, DateTime, Float, Index, Text, UniqueConstraint, false, func, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import column_property, relationship
 from database import Base
 
 class User(Base):
@@ -14,6 +15,16 @@ class User(Base):
     role = Column(String(20), nullable=False)
 
     exams = relationship("Exam", back_populates="owner", cascade="all, delete-orphan")
+    attempts = relationship("Attempt", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_users_role_id", "role", "id"),  # Role filter in id order for the user listing
+        # Prefix filters (LIKE 'x%') cannot use the plain indexes under non-C collations.
+        Index("ix_users_username_pattern", "username", postgresql_ops={"username": "varchar_pattern_ops"},
+              info={"dialect": "postgresql"}).ddl_if(dialect="postgresql"),
+        Index("ix_users_email_pattern", "email", postgresql_ops={"email": "varchar_pattern_ops"},
+              info={"dialect": "postgresql"}).ddl_if(dialect="postgresql"),
+    )
 
 class Exam(Base):
     __tablename__ = "exams"
@@ -21,19 +32,28 @@ class Exam(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(100), nullable=False)
     description = Column(String(255))
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    content_version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Question pool settings: each attempt draws questions_per_attempt of the
+    # exam's questions (all when unset), optionally shuffling questions and choices.
+    questions_per_attempt = Column(Integer, nullable=True)
+    shuffle_questions = Column(Boolean, nullable=False, default=False, server_default=false())
+    shuffle_choices = Column(Boolean, nullable=False, default=False, server_default=false())
+    # An attempt ends duration_minutes after it starts or at closes_at, whichever comes first.
+    duration_minutes = Column(Integer, nullable=True)
+    closes_at = Column(DateTime(timezone=True), nullable=True)
 
     owner = relationship("User", back_populates="exams")
-    questions = relationship("Question", back_populates="exam", cascade="all, delete-orphan")
+    questions = relationship("Question", back_populates="exam", cascade="all, delete-orphan",
+                             order_by="Question.id")
+    attempts = relationship("Attempt", back_populates="exam", cascade="all, delete-orphan", passive_deletes=True)
 
     __table_args__ = (
         CheckConstraint("title != ''", name="check_exam_title_not_empty"),
+        CheckConstraint("questions_per_attempt > 0", name="check_exam_questions_per_attempt_positive"),
+        CheckConstraint("duration_minutes > 0", name="check_exam_duration_minutes_positive"),
     )
 
-    @property
-    def num_questions(self):
-        return len(self.questions)
-
 class Question(Base):
     __tablename__ = "questions"
 
@@ -44,12 +64,24 @@ class Question(Base):
     image_path = Column(String(255), nullable=True)  # New field for storing image paths
 
     exam = relationship("Exam", back_populates="questions")
-    choices = relationship("Choice", back_populates="question", cascade="all, delete-orphan")
+    choices = relationship("Choice", back_populates="question", cascade="all, delete-orphan",
+                           order_by="Choice.id")
 
     __table_args__ = (
         CheckConstraint("question_text != ''", name="check_question_text_not_empty"),
+        # Also serves plain exam_id lookups, so no separate single-column index.
+        Index("ix_questions_exam_id_id", "exam_id", "id"),
     )
 
+# Counted in SQL so listing exams never loads the question rows themselves.
+Exam.num_questions = column_property(
+    select(func.count(Question.id))
+    .where(Question.exam_id == Exam.id)
+    .correlate_except(Question)
+    .scalar_subquery(),
+    deferred=True,
+)
+
 class Choice(Base):
     __tablename__ = "choices"
 
@@ -62,4 +94,140 @@ class Choice(Base):
 
     __table_args__ = (
         CheckConstraint("choice_text != ''", name="check_choice_text_not_empty"),
+        Index("ix_choices_question_id_id", "question_id", "id"),
+    )
+
+
+class Attempt(Base):
+    __tablename__ = "attempts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    started_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    submitted_at = Column(DateTime(timezone=True), nullable=True)
+    graded_at = Column(DateTime(timezone=True), nullable=True)
+    score = Column(Float, nullable=True)  # Percentage of the exam's questions answered correctly
+    analyzed_at = Column(DateTime(timezone=True), nullable=True)  # Included in the exam statistics
+
+    exam = relationship("Exam", back_populates="attempts")
+    user = relationship("User", back_populates="attempts")
+    answers = relationship("Answer", back_populates="attempt", cascade="all, delete-orphan", passive_deletes=True)
+
+class AttemptQuestion(Base):
+    __tablename__ = "attempt_questions"
+
+    # The questions drawn for an attempt, fixed when it starts, so grading and
+    # the layout do not change when questions are added or deleted later.
+    attempt_id = Column(Integer, ForeignKey("attempts.id", ondelete="CASCADE"), primary_key=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+class Answer(Base):
+    __tablename__ = "answers"
+
+    # One row per selected choice. Rows of an unsubmitted attempt are the
+    # autosaved draft; submitting replaces them with the final selection.
+    id = Column(Integer, primary_key=True, index=True)
+    attempt_id = Column(Integer, ForeignKey("attempts.id", ondelete="CASCADE"), nullable=False, index=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), nullable=False)
+    choice_id = Column(Integer, ForeignKey("choices.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    attempt = relationship("Attempt", back_populates="answers")
+
+    __table_args__ = (
+        UniqueConstraint("attempt_id", "choice_id", name="uq_answer_attempt_choice"),
     )
+
+class QuestionSearch(Base):
+    __tablename__ = "question_search"
+
+    # PostgreSQL full-text index: question text weighted A, choice texts B.
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True)
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), nullable=False, index=True)
+    search_vector = Column(TSVECTOR().with_variant(Text(), "sqlite"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_question_search_vector", "search_vector", postgresql_using="gin",
+              info={"dialect": "postgresql"}).ddl_if(dialect="postgresql"),
+    )
+
+class QuestionTerm(Base):
+    __tablename__ = "question_terms"
+
+    # Inverted index used instead of question_search on databases without tsvector.
+    term = Column(String(64), primary_key=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True, index=True)
+    weight = Column(Integer, nullable=False)
+
+class QuestionSignature(Base):
+    __tablename__ = "question_signatures"
+
+    # MinHash signature of the question and its choices, see duplicates.py.
+    # cluster_id is the smallest question id of the near-duplicate cluster as
+    # of the last `duplicates.py cluster` run.
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True)
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), nullable=False, index=True)
+    signature = Column(LargeBinary, nullable=False)
+    cluster_id = Column(Integer, nullable=True, index=True)
+
+class QuestionBand(Base):
+    __tablename__ = "question_bands"
+
+    # LSH buckets: questions sharing a bucket in any band are candidates.
+    band = Column(SmallInteger, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+class ExamStatistics(Base):
+    __tablename__ = "exam_statistics"
+
+    # Running sums over the graded attempts of an exam, see analytics.py. They
+    # are rebuilt from scratch whenever content_version moves on.
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), primary_key=True)
+    content_version = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_sq_sum = Column(Float, nullable=False, default=0.0)
+    refreshed_at = Column(DateTime(timezone=True), nullable=True)
+
+class QuestionStatistics(Base):
+    __tablename__ = "question_statistics"
+
+    # Sums of the item score x, the attempt's total points t and their products,
+    # over the attempts that were given the question.
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), primary_key=True)
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), nullable=False, index=True)
+    responses = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_sq_sum = Column(Float, nullable=False, default=0.0)
+    total_sum = Column(Float, nullable=False, default=0.0)
+    total_sq_sum = Column(Float, nullable=False, default=0.0)
+    cross_sum = Column(Float, nullable=False, default=0.0)
+
+class ChoiceStatistics(Base):
+    __tablename__ = "choice_statistics"
+
+    choice_id = Column(Integer, ForeignKey("choices.id", ondelete="CASCADE"), primary_key=True)
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), nullable=False, index=True)
+    selections = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)  # Attempt scores of the students who selected it
+
+class StoredImage(Base):
+    __tablename__ = "images"
+
+    # Content-addressed: the filename is the SHA-256 of the bytes plus the extension.
+    filename = Column(String(100), primary_key=True)
+    ref_count = Column(Integer, nullable=False, default=1)
+    size_bytes = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class ImageJob(Base):
+    __tablename__ = "image_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String(100), nullable=False)
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String(255), nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
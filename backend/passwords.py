@@ -0,0 +1,84 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "256"))
+
+# Pinning min/max rounds to the configured cost makes verify_and_update() return
+# a fresh hash for any stored hash made with a different cost factor.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # bcrypt releases the GIL, so a small dedicated thread pool keeps hashing
+    # off the event loop and the request threadpool. The semaphore bounds the
+    # number of queued jobs; once it is exhausted callers are rejected instead
+    # of piling up behind a login burst.
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+
+    def _submit(self, fn, *args, blocking: bool = False):
+        if not self._slots.acquire(blocking=blocking):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+        with self._lock:
+            self.submitted += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash(self, password: str) -> str:
+        return self._submit(pwd_context.hash, password).result()
+
+    def hash_many(self, passwords: List[str]) -> List[str]:
+        # Bulk hashing keeps at most one job per worker in flight and waits for
+        # a free slot instead of being rejected, so logins queue behind a few
+        # roster hashes rather than behind the whole roster.
+        window = threading.BoundedSemaphore(self.workers)
+        futures = []
+        for password in passwords:
+            window.acquire()
+            future = self._submit(pwd_context.hash, password, blocking=True)
+            future.add_done_callback(lambda _: window.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def verify_and_update(self, password: str, hashed_password: str):
+        return self._submit(pwd_context.verify_and_update, password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(pwd_context.hash, password))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str):
+        return await asyncio.wrap_future(
+            self._submit(pwd_context.verify_and_update, password, hashed_password)
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "submitted": self.submitted, "rejected": self.rejected}
+
+
+hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE)
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+AUTH_TRUST_CLAIMS = os.getenv("AUTH_TRUST_CLAIMS", "false").lower() in ("1", "true", "yes")
+# The longest an access token can live: /refresh-token issues them for
+# REFRESH_TOKEN_EXPIRE_DAYS (10 days).
+AUTH_REVOCATION_TTL_SECONDS = float(os.getenv("AUTH_REVOCATION_TTL_SECONDS", str(10 * 24 * 3600)))
+
+_MISSING = object()
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    role: str
+
+
+class PrincipalCache:
+    # LRU keyed by user id. A cached None is a tombstone for a deleted user, so
+    # deletions are honoured immediately in this process and within the TTL
+    # everywhere else. Revoked ids are also remembered, outside the LRU, for
+    # as long as a token issued before the deletion can be valid, so their
+    # token claims are never trusted without a lookup.
+    def __init__(self, ttl: float, max_size: int, revocation_ttl: float = AUTH_REVOCATION_TTL_SECONDS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.revocation_ttl = revocation_ttl
+        self._entries = OrderedDict()
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id: int, principal: Principal | None):
+        with self._lock:
+            self._entries[user_id] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def revoke(self, user_id: int):
+        self.set(user_id, None)
+        now = time.monotonic()
+        with self._lock:
+            self._revoked = {key: expires for key, expires in self._revoked.items() if expires >= now}
+            self._revoked[user_id] = now + self.revocation_ttl
+
+    def is_revoked(self, user_id: int) -> bool:
+        with self._lock:
+            expires = self._revoked.get(user_id)
+        return expires is not None and expires >= time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revoked": len(self._revoked),
+                "trust_claims": AUTH_TRUST_CLAIMS,
+            }
+
+
+principal_cache = PrincipalCache(AUTH_CACHE_TTL_SECONDS, AUTH_CACHE_MAX_SIZE)
+
+
+def is_missing(value) -> bool:
+    return value is _MISSING
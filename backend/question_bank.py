@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import sys
+from itertools import groupby
+from typing import Iterable, Iterator, List
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import crud
+import duplicates
+import models
+from database import SessionLocal
+import schemas
+
+FORMATS = ("jsonl", "csv")
+CSV_FIELDS = ["question", "question_text", "is_multiple_choice", "image_path", "choice_text", "is_correct"]
+IMPORT_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 500
+MAX_TEXT_LENGTH = 255
+
+
+class RowError(Exception):
+    pass
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[tuple]:
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, RowError(f"Invalid JSON: {e}")
+
+
+def _parse_bool(value: str) -> bool:
+    value = (value or "").strip().lower()
+    if value in ("true", "1", "yes"):
+        return True
+    if value in ("false", "0", "no", ""):
+        return False
+    raise RowError(f"Invalid boolean value '{value}'")
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[tuple]:
+    # One CSV row per choice; consecutive rows sharing the same "question"
+    # value make up one question.
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is not None and "question" not in reader.fieldnames:
+        # Without it every row would be grouped into a single question.
+        yield 1, RowError("Missing 'question' column")
+        return
+    rows = enumerate(reader, start=2)
+    for _, group in groupby(rows, key=lambda item: item[1].get("question")):
+        group = list(group)
+        row_number, first = group[0]
+        try:
+            record = {
+                "question_text": first.get("question_text") or "",
+                "is_multiple_choice": _parse_bool(first.get("is_multiple_choice")),
+                "image_path": first.get("image_path") or None,
+                "choices": [
+                    {"choice_text": row["choice_text"], "is_correct": _parse_bool(row.get("is_correct"))}
+                    for _, row in group
+                    if row.get("choice_text")
+                ],
+            }
+        except RowError as e:
+            record = e
+        yield row_number, record
+
+
+def parse_records(lines: Iterable[str], fmt: str) -> Iterator[tuple]:
+    if fmt == "jsonl":
+        return parse_jsonl(lines)
+    if fmt == "csv":
+        return parse_csv(lines)
+    raise ValueError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+
+
+def validate_record(record) -> schemas.QuestionCreate:
+    if isinstance(record, RowError):
+        raise record
+    try:
+        question = schemas.QuestionCreate.model_validate(record)
+    except ValidationError as e:
+        raise RowError("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+    if not question.question_text or len(question.question_text) > MAX_TEXT_LENGTH:
+        raise RowError(f"question_text must be between 1 and {MAX_TEXT_LENGTH} characters")
+    if question.image_path and len(question.image_path) > MAX_TEXT_LENGTH:
+        raise RowError(f"image_path must be at most {MAX_TEXT_LENGTH} characters")
+    for choice in question.choices:
+        if not choice.choice_text or len(choice.choice_text) > MAX_TEXT_LENGTH:
+            raise RowError(f"choice_text must be between 1 and {MAX_TEXT_LENGTH} characters")
+    return question
+
+
+def _insert_batch(db: Session, exam_id: int, questions: List[schemas.QuestionCreate]):
+    question_ids = db.execute(
+        insert(models.Question).returning(models.Question.id, sort_by_parameter_order=True),
+        [
+            {
+                "question_text": question.question_text,
+                "exam_id": exam_id,
+                "is_multiple_choice": question.is_multiple_choice,
+                "image_path": question.image_path,
+            }
+            for question in questions
+        ],
+    ).scalars().all()
+    choices = [
+        {"choice_text": choice.choice_text, "is_correct": choice.is_correct, "question_id": question_id}
+        for question_id, question in zip(question_ids, questions)
+        for choice in question.choices
+    ]
+    if choices:
+        db.execute(insert(models.Choice), choices)
+    crud.reindex_questions(db, question_ids)
+    return question_ids
+
+
+def import_questions(
+    db: Session,
+    exam_id: int,
+    lines: Iterable[str],
+    fmt: str,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> dict:
+    """Imports a question bank into an exam in a single transaction.
+
+    Rows that fail validation are reported and skipped; valid rows are
+    inserted with multi-row INSERTs of ``batch_size`` questions. Imported
+    questions resembling existing or other imported ones are reported too.
+    """
+    imported = 0
+    errors = []
+    near_duplicates = []
+    batch = []
+    rows = []
+
+    def flush_batch():
+        question_ids = _insert_batch(db, exam_id, batch)
+        matches = duplicates.find_near_duplicates(db, question_ids)
+        near_duplicates.extend(
+            {"row": row_number, "question_id": question_id, "near_duplicates": matches[question_id]}
+            for row_number, question_id in zip(rows, question_ids)
+            if matches.get(question_id)
+        )
+        return len(question_ids)
+
+    for row_number, record in parse_records(lines, fmt):
+        try:
+            batch.append(validate_record(record))
+        except RowError as e:
+            errors.append({"row": row_number, "error": str(e)})
+            continue
+        rows.append(row_number)
+        if len(batch) >= batch_size:
+            imported += flush_batch()
+            batch = []
+            rows = []
+    if batch:
+        imported += flush_batch()
+    if imported:
+        crud.bump_exam_version(db, exam_id)
+    db.commit()
+    return {"imported": imported, "errors": errors, "near_duplicates": near_duplicates}
+
+
+def _export_record(question: models.Question) -> dict:
+    return {
+        "question_text": question.question_text,
+        "is_multiple_choice": question.is_multiple_choice,
+        "image_path": question.image_path,
+        "choices": [
+            {"choice_text": choice.choice_text, "is_correct": choice.is_correct}
+            for choice in question.choices
+        ],
+    }
+
+
+def export_questions(db: Session, exam_id: int, fmt: str) -> Iterator[str]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+    statement = crud.questions_by_exam_statement(exam_id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    questions = db.execute(statement).scalars()
+
+    if fmt == "jsonl":
+        for question in questions:
+            yield json.dumps(_export_record(question)) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for question in questions:
+        base = {
+            "question": question.id,
+            "question_text": question.question_text,
+            "is_multiple_choice": str(question.is_multiple_choice).lower(),
+            "image_path": question.image_path or "",
+        }
+        for choice in question.choices or [None]:
+            writer.writerow({
+                **base,
+                "choice_text": choice.choice_text if choice else "",
+                "is_correct": str(choice.is_correct).lower() if choice else "",
+            })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export the question bank of an exam.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("import", "export"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("--exam-id", type=int, required=True)
+        subparser.add_argument("--format", choices=FORMATS, default="jsonl")
+        subparser.add_argument("path", nargs="?", default="-", help="File to read or write, '-' for stdin/stdout")
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        if crud.read_exam(db, args.exam_id) is None:
+            parser.error(f"Exam {args.exam_id} not found")
+        if args.command == "import":
+            source = (contextlib.nullcontext(sys.stdin) if args.path == "-"
+                      else open(args.path, newline="", encoding="utf-8"))
+            with source as lines:
+                try:
+                    report = import_questions(db, args.exam_id, lines, args.format)
+                except UnicodeDecodeError:
+                    parser.error("The file is not valid UTF-8")
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+            return 1 if report["errors"] else 0
+        target = (contextlib.nullcontext(sys.stdout) if args.path == "-"
+                  else open(args.path, "w", newline="", encoding="utf-8"))
+        with target as output:
+            for chunk in export_questions(db, args.exam_id, args.format):
+                output.write(chunk)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
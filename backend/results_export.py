@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import sys
+import zlib
+from collections import defaultdict
+from datetime import timezone
+from typing import Iterator
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+FORMATS = ("csv", "jsonl", "parquet")
+MEDIA_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+EXPORT_BATCH_SIZE = 1000
+FIELDS = [
+    "attempt_id", "exam_id", "exam_title", "user_id", "username", "name", "surname",
+    "started_at", "submitted_at", "graded_at", "score", "answers",
+]
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def results_statement(exam_id: int | None = None, owner_id: int | None = None, after_id: int = 0):
+    # Ordered by attempt id so an interrupted export can resume after the
+    # last attempt it received.
+    statement = (
+        select(
+            models.Attempt.id.label("attempt_id"),
+            models.Attempt.exam_id,
+            models.Exam.title.label("exam_title"),
+            models.Attempt.user_id,
+            models.User.username,
+            models.User.name,
+            models.User.surname,
+            models.Attempt.started_at,
+            models.Attempt.submitted_at,
+            models.Attempt.graded_at,
+            models.Attempt.score,
+        )
+        .join(models.Exam, models.Exam.id == models.Attempt.exam_id)
+        .join(models.User, models.User.id == models.Attempt.user_id)
+        .where(models.Attempt.submitted_at.isnot(None), models.Attempt.id > after_id)
+        .order_by(models.Attempt.id)
+    )
+    if exam_id is not None:
+        statement = statement.where(models.Attempt.exam_id == exam_id)
+    if owner_id is not None:
+        statement = statement.where(models.Exam.owner_id == owner_id)
+    return statement
+
+
+def _result_batches(db: Session, statement, batch_size: int) -> Iterator[list]:
+    # Streams the attempts through a server-side cursor and fetches the
+    # answers of each batch with one query, so only one batch is in memory.
+    result = db.execute(statement.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        answers = defaultdict(lambda: defaultdict(list))
+        for attempt_id, question_id, choice_id in db.execute(
+            select(models.Answer.attempt_id, models.Answer.question_id, models.Answer.choice_id)
+            .where(models.Answer.attempt_id.in_([row.attempt_id for row in rows]))
+            .order_by(models.Answer.attempt_id, models.Answer.question_id, models.Answer.choice_id)
+        ):
+            answers[attempt_id][question_id].append(choice_id)
+        yield [{**row._asdict(), "answers": dict(answers[row.attempt_id])} for row in rows]
+
+
+def _text_record(record: dict) -> dict:
+    return {
+        **record,
+        "started_at": record["started_at"].isoformat(),
+        "submitted_at": record["submitted_at"].isoformat(),
+        "graded_at": record["graded_at"].isoformat() if record["graded_at"] else None,
+    }
+
+
+def _export_csv(batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for batch in batches:
+        for record in batch:
+            record = _text_record(record)
+            writer.writerow({
+                **record,
+                "graded_at": record["graded_at"] or "",
+                "score": "" if record["score"] is None else record["score"],
+                "answers": json.dumps(record["answers"], separators=(",", ":")),
+            })
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _export_jsonl(batches) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(json.dumps(_text_record(record)) + "\n" for record in batch).encode()
+
+
+class _ChunkSink:
+    # Write-only file for ParquetWriter that hands out what has been written
+    # so far instead of keeping the whole file.
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def _export_parquet(batches) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamp = pa.timestamp("us", tz="UTC")
+    schema = pa.schema([
+        ("attempt_id", pa.int64()), ("exam_id", pa.int64()), ("exam_title", pa.string()),
+        ("user_id", pa.int64()), ("username", pa.string()), ("name", pa.string()), ("surname", pa.string()),
+        ("started_at", timestamp), ("submitted_at", timestamp), ("graded_at", timestamp),
+        ("score", pa.float64()), ("answers", pa.string()),
+    ])
+
+    def utc(value):
+        # SQLite hands back naive datetimes; everything is stored in UTC.
+        return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for batch in batches:
+            # One row group per batch.
+            columns = {field: [record[field] for record in batch] for field in FIELDS}
+            for field in ("started_at", "submitted_at", "graded_at"):
+                columns[field] = [utc(value) for value in columns[field]]
+            columns["answers"] = [json.dumps(answers, separators=(",", ":")) for answers in columns["answers"]]
+            writer.write_table(pa.table(columns, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def export_results(
+    db: Session,
+    fmt: str,
+    exam_id: int | None = None,
+    owner_id: int | None = None,
+    after_id: int = 0,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """Streams the submitted attempts of an exam, or of every exam of an owner.
+
+    Rows are produced a batch at a time, so memory use does not grow with
+    the size of the export.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+    batches = _result_batches(db, results_statement(exam_id, owner_id, after_id), batch_size)
+    exporter = {"csv": _export_csv, "jsonl": _export_jsonl, "parquet": _export_parquet}[fmt]
+    for chunk in exporter(batches):
+        if chunk:
+            yield chunk
+
+
+def gzip_chunks(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_filename(fmt: str, compress: bool, exam_id: int | None = None, owner_id: int | None = None) -> str:
+    scope = f"exam-{exam_id}" if exam_id is not None else f"owner-{owner_id}"
+    return f"{scope}-results.{fmt}" + (".gz" if compress else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the submitted attempts of an exam or of an owner's exams.")
+    scope = parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--exam-id", type=int)
+    scope.add_argument("--owner-id", type=int)
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--after-id", type=int, default=0, help="Resume after this attempt id")
+    parser.add_argument("path", nargs="?", default="-", help="File to write, '-' for stdout")
+    args = parser.parse_args(argv)
+    if args.format == "parquet" and not parquet_available():
+        parser.error("Parquet export requires pyarrow")
+
+    with SessionLocal() as db:
+        chunks = export_results(db, args.format, exam_id=args.exam_id, owner_id=args.owner_id, after_id=args.after_id)
+        if args.gzip:
+            chunks = gzip_chunks(chunks)
+        target = contextlib.nullcontext(sys.stdout.buffer) if args.path == "-" else open(args.path, "wb")
+        with target as output:
+            for chunk in chunks:
+                output.write(chunk)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import argparse
+import contextlib
+import csv
+import json
+import secrets
+import sys
+from typing import Iterable, Iterator, List
+
+from pydantic import ValidationError
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+from database import SessionLocal
+from passwords import hasher
+from question_bank import RowError, parse_jsonl
+
+FORMATS = ("csv", "jsonl", "json")
+ROLES = ("student", "teacher", "admin")
+CSV_FIELDS = ["username", "email", "password", "name", "surname", "role"]
+MAX_ROSTER_ROWS = 10000
+INSERT_BATCH_SIZE = 500
+LOOKUP_CHUNK_SIZE = 500
+# Column sizes of the users table.
+MAX_LENGTHS = {"username": 50, "email": 100, "name": 50, "surname": 50}
+
+
+class RosterTooLarge(Exception):
+    pass
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[tuple]:
+    for row_number, row in enumerate(csv.DictReader(lines), start=2):
+        yield row_number, {field: (row.get(field) or "").strip() for field in CSV_FIELDS}
+
+
+def parse_json(lines: Iterable[str]) -> Iterator[tuple]:
+    try:
+        records = json.loads("".join(lines))
+    except json.JSONDecodeError as e:
+        yield 1, RowError(f"Invalid JSON: {e}")
+        return
+    if not isinstance(records, list):
+        yield 1, RowError("Expected a JSON array of users")
+        return
+    yield from enumerate(records, start=1)
+
+
+def parse_records(lines: Iterable[str], fmt: str) -> Iterator[tuple]:
+    if fmt == "csv":
+        return parse_csv(lines)
+    if fmt == "jsonl":
+        return parse_jsonl(lines)
+    if fmt == "json":
+        return parse_json(lines)
+    raise ValueError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+
+
+def validate_record(record, allowed_roles: Iterable[str]) -> tuple:
+    # Returns the user and whether its password was generated.
+    if isinstance(record, RowError):
+        raise record
+    if not isinstance(record, dict):
+        raise RowError("Expected an object")
+    record = {**record, "role": record.get("role") or "student"}
+    generated = not record.get("password")
+    if generated:
+        record["password"] = secrets.token_urlsafe(12)
+    try:
+        user = schemas.UserCreate.model_validate(record)
+    except ValidationError as e:
+        raise RowError("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+    for field, max_length in MAX_LENGTHS.items():
+        if not 1 <= len(getattr(user, field)) <= max_length:
+            raise RowError(f"{field} must be between 1 and {max_length} characters")
+    if user.role not in allowed_roles:
+        raise RowError(f"role must be one of {', '.join(allowed_roles)}")
+    return user, generated
+
+
+def _chunks(items: list, size: int = LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def existing_accounts(db: Session, usernames: List[str], emails: List[str]) -> tuple:
+    # Set-based conflict check: one indexed query per chunk of the roster
+    # instead of one lookup per user.
+    taken_usernames, taken_emails = set(), set()
+    for username_chunk, email_chunk in zip(_chunks(usernames), _chunks(emails)):
+        for username, email in db.execute(
+            select(models.User.username, models.User.email)
+            .where(or_(models.User.username.in_(username_chunk), models.User.email.in_(email_chunk)))
+        ):
+            taken_usernames.add(username)
+            taken_emails.add(email)
+    return taken_usernames, taken_emails
+
+
+def import_roster(
+    db: Session,
+    lines: Iterable[str],
+    fmt: str,
+    allowed_roles: Iterable[str] = ROLES,
+    dry_run: bool = False,
+) -> dict:
+    """Creates the users of a roster in a single transaction.
+
+    Rows that fail validation or clash with existing accounts, or with
+    earlier rows, are reported and skipped. Passwords are hashed on the
+    shared bcrypt pool and users are inserted with multi-row INSERTs.
+    """
+    allowed_roles = tuple(allowed_roles)
+    rows = []
+    users = []
+    seen_usernames, seen_emails = set(), set()
+    for row_number, record in parse_records(lines, fmt):
+        if len(rows) >= MAX_ROSTER_ROWS:
+            raise RosterTooLarge(f"A roster can have at most {MAX_ROSTER_ROWS} rows")
+        username = record.get("username") if isinstance(record, dict) else None
+        report = {"row": row_number, "username": username}
+        rows.append(report)
+        try:
+            user, generated = validate_record(record, allowed_roles)
+            if user.username in seen_usernames:
+                raise RowError(f"Duplicate username '{user.username}' in the roster")
+            if user.email in seen_emails:
+                raise RowError(f"Duplicate email '{user.email}' in the roster")
+        except RowError as e:
+            report.update(status="error", error=str(e))
+            continue
+        seen_usernames.add(user.username)
+        seen_emails.add(user.email)
+        users.append((report, user, generated))
+
+    taken_usernames, taken_emails = existing_accounts(
+        db, [user.username for _, user, _ in users], [user.email for _, user, _ in users]
+    )
+    accepted = []
+    for report, user, generated in users:
+        if user.username in taken_usernames:
+            report.update(status="error", error=f"Username '{user.username}' is already taken")
+        elif user.email in taken_emails:
+            report.update(status="error", error=f"Email '{user.email}' is already registered")
+        else:
+            accepted.append((report, user, generated))
+
+    if dry_run:
+        for report, _, _ in accepted:
+            report["status"] = "valid"
+        return {"created": 0, "rows": rows}
+
+    hashed_passwords = hasher.hash_many([user.password for _, user, _ in accepted])
+    for batch in _chunks(list(zip(accepted, hashed_passwords)), INSERT_BATCH_SIZE):
+        user_ids = db.execute(
+            insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+            [
+                {
+                    "username": user.username,
+                    "email": user.email,
+                    "hashed_password": hashed_password,
+                    "name": user.name,
+                    "surname": user.surname,
+                    "role": user.role,
+                }
+                for (_, user, _), hashed_password in batch
+            ],
+        ).scalars().all()
+        for ((report, user, generated), _), user_id in zip(batch, user_ids):
+            report.update(status="created", id=user_id)
+            if generated:
+                report["password"] = user.password
+    db.commit()
+    return {"created": len(accepted), "rows": rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the user accounts of a roster.")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--dry-run", action="store_true", help="Only validate and check for conflicts")
+    parser.add_argument("path", nargs="?", default="-", help="File to read, '-' for stdin")
+    args = parser.parse_args(argv)
+
+    source = contextlib.nullcontext(sys.stdin) if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    with SessionLocal() as db, source as lines:
+        try:
+            report = import_roster(db, lines, args.format, dry_run=args.dry_run)
+        except RosterTooLarge as e:
+            parser.error(str(e))
+        except UnicodeDecodeError:
+            parser.error("The file is not valid UTF-8")
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if any(row["status"] == "error" for row in report["rows"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+from datetime import datetime
 from typing import List, Optional
 
 class UserCreate(BaseModel):
@@ -23,12 +24,22 @@ class User(BaseModel):
 class ExamCreate(BaseModel):
     title: str
     description: str
+    questions_per_attempt: Optional[int] = Field(None, ge=1)
+    shuffle_questions: bool = False
+    shuffle_choices: bool = False
+    duration_minutes: Optional[int] = Field(None, ge=1)
+    closes_at: Optional[datetime] = None
 
 class Exam(BaseModel):
     id: int
     title: str
     description: str
     owner_id: int
+    questions_per_attempt: Optional[int] = None
+    shuffle_questions: bool = False
+    shuffle_choices: bool = False
+    duration_minutes: Optional[int] = None
+    closes_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -52,6 +63,21 @@ class QuestionCreate(BaseModel):
     choices: List[ChoiceCreate]
     image_path: Optional[str] = None
 
+class ChoiceUpdate(ChoiceCreate):
+    id: Optional[int] = None
+
+class QuestionUpdate(QuestionCreate):
+    choices: List[ChoiceUpdate]
+
+class QuestionPatch(QuestionUpdate):
+    id: int
+    etag: Optional[str] = None
+
+class QuestionSaveResult(BaseModel):
+    id: int
+    etag: str
+    changed: bool
+
 class Question(BaseModel):
     id: int
     question_text: str
@@ -62,3 +88,92 @@ class Question(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class QuestionSummary(BaseModel):
+    id: int
+    question_text: str
+    exam_id: int
+    is_multiple_choice: bool
+    image_path: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class NearDuplicate(BaseModel):
+    question_id: int
+    exam_id: int
+    similarity: float
+
+class QuestionCreated(Question):
+    near_duplicates: List[NearDuplicate] = []
+
+class QuestionDuplicates(BaseModel):
+    question_id: int
+    cluster_id: Optional[int] = None
+    near_duplicates: List[NearDuplicate]
+
+class QuestionSearchResult(QuestionSummary):
+    rank: float
+
+class StudentChoice(BaseModel):
+    id: int
+    choice_text: str
+    question_id: int
+
+    class Config:
+        from_attributes = True
+
+class StudentQuestion(QuestionSummary):
+    choices: List[StudentChoice]
+
+class ExamWithQuestions(Exam):
+    questions: List[QuestionSummary]
+
+class ExamBundle(Exam):
+    questions: List[Question]
+
+class StudentExamBundle(Exam):
+    questions: List[StudentQuestion]
+
+class AnswerSubmit(BaseModel):
+    question_id: int
+    choice_ids: List[int]
+
+class AttemptSubmit(BaseModel):
+    answers: List[AnswerSubmit]
+
+class Attempt(BaseModel):
+    id: int
+    exam_id: int
+    user_id: int
+    started_at: datetime
+    submitted_at: Optional[datetime] = None
+    graded_at: Optional[datetime] = None
+    score: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+class ChoiceAnalytics(BaseModel):
+    choice_id: int
+    is_correct: bool
+    selections: int
+    selection_rate: Optional[float] = None
+    mean_score: Optional[float] = None
+
+class QuestionAnalytics(BaseModel):
+    question_id: int
+    responses: int
+    p_value: Optional[float] = None
+    discrimination: Optional[float] = None
+    choices: List[ChoiceAnalytics]
+
+class ExamAnalytics(BaseModel):
+    exam_id: int
+    attempts: int
+    mean_score: Optional[float] = None
+    score_std: Optional[float] = None
+    cronbach_alpha: Optional[float] = None
+    refreshed_at: Optional[datetime] = None
+    questions: List[QuestionAnalytics]
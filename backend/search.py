@@ -0,0 +1,178 @@
+import argparse
+import re
+import sys
+from collections import Counter
+from typing import Iterable, List
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+SEARCH_CONFIG = "simple"  # No stemming or stop words, matching the fallback tokenizer.
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 10
+QUESTION_WEIGHT = 2
+CHOICE_WEIGHT = 1
+REINDEX_BATCH_SIZE = 1000
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str | None) -> List[str]:
+    return [token for token in _TOKEN.findall((text or "").lower()) if len(token) <= MAX_TERM_LENGTH]
+
+
+def uses_tsvector(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _reindex_tsvector(db: Session, question_ids: List[int]):
+    choices_text = (
+        select(func.coalesce(func.string_agg(models.Choice.choice_text, " "), ""))
+        .where(models.Choice.question_id == models.Question.id)
+        .scalar_subquery()
+    )
+    vector = func.setweight(func.to_tsvector(SEARCH_CONFIG, models.Question.question_text), "A").op("||")(
+        func.setweight(func.to_tsvector(SEARCH_CONFIG, choices_text), "B")
+    )
+    db.execute(insert(models.QuestionSearch).from_select(
+        ["question_id", "exam_id", "search_vector"],
+        select(models.Question.id, models.Question.exam_id, vector).where(models.Question.id.in_(question_ids)),
+    ))
+
+
+def _reindex_terms(db: Session, question_ids: List[int]):
+    weights = {}
+    for question_id, question_text in db.execute(
+        select(models.Question.id, models.Question.question_text).where(models.Question.id.in_(question_ids))
+    ):
+        weights[question_id] = Counter({term: QUESTION_WEIGHT * count
+                                        for term, count in Counter(tokenize(question_text)).items()})
+    for question_id, choice_text in db.execute(
+        select(models.Choice.question_id, models.Choice.choice_text).where(models.Choice.question_id.in_(question_ids))
+    ):
+        for term in tokenize(choice_text):
+            weights[question_id][term] += CHOICE_WEIGHT
+    rows = [
+        {"term": term, "question_id": question_id, "weight": weight}
+        for question_id, terms in weights.items()
+        for term, weight in terms.items()
+    ]
+    if rows:
+        db.execute(insert(models.QuestionTerm), rows)
+
+
+def reindex_questions(db: Session, question_ids: Iterable[int]):
+    """Brings the search index of the given questions up to date.
+
+    Runs inside the caller's transaction after its changes are flushed.
+    Questions that no longer exist simply drop out of the index.
+    """
+    question_ids = sorted(set(question_ids))
+    if not question_ids:
+        return
+    db.flush()
+    if uses_tsvector(db):
+        db.execute(delete(models.QuestionSearch).where(models.QuestionSearch.question_id.in_(question_ids)))
+        _reindex_tsvector(db, question_ids)
+    else:
+        db.execute(delete(models.QuestionTerm).where(models.QuestionTerm.question_id.in_(question_ids)))
+        _reindex_terms(db, question_ids)
+
+
+def _ranked_tsvector(terms: List[str]):
+    # Every term is a prefix match; only \w characters reach the query, so
+    # nothing in it can be read as a tsquery operator.
+    query = func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{term}:*" for term in terms))
+    return (
+        select(
+            models.QuestionSearch.question_id,
+            func.ts_rank(models.QuestionSearch.search_vector, query).label("rank"),
+        )
+        .where(models.QuestionSearch.search_vector.op("@@")(query))
+        .subquery()
+    )
+
+
+def _ranked_terms(terms: List[str]):
+    # One index range scan per query term; a question matches when every
+    # term matched at least one of its indexed terms.
+    matches = union_all(*[
+        select(models.QuestionTerm.question_id, literal(position).label("position"), models.QuestionTerm.weight)
+        .where(models.QuestionTerm.term >= term, models.QuestionTerm.term < term + "\U0010ffff")
+        for position, term in enumerate(terms)
+    ]).subquery()
+    return (
+        select(matches.c.question_id, func.sum(matches.c.weight).label("rank"))
+        .group_by(matches.c.question_id)
+        .having(func.count(func.distinct(matches.c.position)) == len(terms))
+        .subquery()
+    )
+
+
+def search_questions(
+    db: Session,
+    query: str,
+    owner_id: int | None = None,
+    exam_id: int | None = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[dict]:
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    ranked = _ranked_tsvector(terms) if uses_tsvector(db) else _ranked_terms(terms)
+    statement = (
+        select(
+            models.Question.id,
+            models.Question.question_text,
+            models.Question.exam_id,
+            models.Question.is_multiple_choice,
+            models.Question.image_path,
+            ranked.c.rank,
+        )
+        .join(ranked, ranked.c.question_id == models.Question.id)
+    )
+    if exam_id is not None:
+        statement = statement.where(models.Question.exam_id == exam_id)
+    if owner_id is not None:
+        statement = statement.join(models.Exam, models.Exam.id == models.Question.exam_id).where(
+            models.Exam.owner_id == owner_id
+        )
+    statement = statement.order_by(ranked.c.rank.desc(), models.Question.id).limit(limit).offset(offset)
+    return [{**row._asdict(), "rank": float(row.rank)} for row in db.execute(statement)]
+
+
+def reindex_all(db: Session, exam_id: int | None = None, batch_size: int = REINDEX_BATCH_SIZE) -> int:
+    indexed = 0
+    after_id = 0
+    while True:
+        statement = select(models.Question.id).where(models.Question.id > after_id)
+        if exam_id is not None:
+            statement = statement.where(models.Question.exam_id == exam_id)
+        question_ids = db.execute(statement.order_by(models.Question.id).limit(batch_size)).scalars().all()
+        if not question_ids:
+            break
+        reindex_questions(db, question_ids)
+        db.commit()
+        indexed += len(question_ids)
+        after_id = question_ids[-1]
+    return indexed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the question search index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reindex_parser = subparsers.add_parser("reindex", help="Rebuild the index, e.g. after the initial migration")
+    reindex_parser.add_argument("--exam-id", type=int)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        print(f"Indexed {reindex_all(db, args.exam_id)} questions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import http_cache
+import images
+
+IMAGE_SENDFILE_MODE = os.getenv("IMAGE_SENDFILE_MODE", "").lower()  # "", "x-accel" or "x-sendfile"
+IMAGE_ACCEL_PREFIX = os.getenv("IMAGE_ACCEL_PREFIX", "/protected-uploads/")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+CHUNK_BYTES = 64 * 1024
+
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})(\.w\d+)?(\.[a-z0-9]{1,10})?$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _validators(path: str, stat_result: os.stat_result) -> tuple:
+    # Content-addressed files never change, so their hash is a strong ETag
+    # and they can be cached forever. Anything else falls back to a weak
+    # validator built from size and mtime.
+    match = _CONTENT_ADDRESSED.match(os.path.basename(path))
+    if match:
+        return f'"{match.group(1)}{match.group(2) or ""}"', IMMUTABLE_CACHE_CONTROL
+    return f'W/"{int(stat_result.st_mtime)}-{stat_result.st_size}"', REVALIDATE_CACHE_CONTROL
+
+
+def _not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        return http_cache.etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(header: str, size: int) -> tuple | None:
+    # Only single ranges are supported; multi-range requests get the whole file.
+    match = _RANGE.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = size - min(int(last), size), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def _file_chunks(path: str, start: int, length: int):
+    f = await run_in_threadpool(open, path, "rb")
+    try:
+        await run_in_threadpool(f.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await run_in_threadpool(f.read, min(CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await run_in_threadpool(f.close)
+
+
+async def serve_file(request: Request, path: str, extra_headers: dict | None = None,
+                     cache_control: str | None = None) -> Response:
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag, default_cache_control = _validators(path, stat_result)
+    cache_control = cache_control or default_cache_control
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        **(extra_headers or {}),
+    }
+    if _not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if IMAGE_SENDFILE_MODE == "x-accel":
+        relative = os.path.relpath(path, images.UPLOAD_DIR).replace(os.sep, "/")
+        headers["X-Accel-Redirect"] = IMAGE_ACCEL_PREFIX.rstrip("/") + "/" + relative
+        return Response(media_type=media_type, headers=headers)
+    if IMAGE_SENDFILE_MODE == "x-sendfile":
+        headers["X-Sendfile"] = os.path.abspath(path)
+        return Response(media_type=media_type, headers=headers)
+
+    size = stat_result.st_size
+    if request.method == "HEAD":
+        # Answered from the stat result alone; the file is never opened.
+        headers["Content-Length"] = str(size)
+        return Response(media_type=media_type, headers=headers)
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(
+                _file_chunks(path, start, length), status_code=206, media_type=media_type, headers=headers
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Modules read their configuration when they are imported, so the test
+# database has to be in place first.
+_data_dir = tempfile.mkdtemp(prefix="exam-guru-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, 'test.db')}"
+os.environ["CACHE_SHARED_BACKEND"] = ""
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud  # noqa: E402
+import models  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    models.Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def make_user(db):
+    def make(username: str, role: str = "student") -> models.User:
+        db_user = models.User(username=username, email=f"{username}@example.com", hashed_password="x",
+                              name="Test", surname="User", role=role)
+        db.add(db_user)
+        db.commit()
+        return db_user
+    return make
+
+
+@pytest.fixture
+def make_exam(db, make_user):
+    # questions is a list of (is_multiple_choice, [is_correct of each choice]).
+    def make(questions, **settings) -> models.Exam:
+        owner = make_user(f"teacher{db.query(models.User).count()}", "teacher")
+        db_exam = models.Exam(title="Exam", description="", owner_id=owner.id, **settings)
+        for number, (is_multiple, flags) in enumerate(questions, 1):
+            db_exam.questions.append(models.Question(
+                question_text=f"Question {number}",
+                is_multiple_choice=is_multiple,
+                choices=[models.Choice(choice_text=f"Choice {index}", is_correct=flag)
+                         for index, flag in enumerate(flags)],
+            ))
+        db.add(db_exam)
+        db.commit()
+        return db_exam
+    return make
+
+
+@pytest.fixture
+def submit_attempt(db):
+    # Starts an attempt given question_ids (all questions by default) and
+    # submits the selected choices.
+    def submit(db_exam: models.Exam, user_id: int, choices, question_ids=None) -> models.Attempt:
+        drawn = question_ids if question_ids is not None else [question.id for question in db_exam.questions]
+        db_attempt = crud.create_attempt(db, db_exam.id, user_id, lambda _: drawn)
+        answers = [(choice.question_id, choice.id) for choice in choices]
+        return crud.submit_attempt(db, db_attempt, answers)
+    return submit
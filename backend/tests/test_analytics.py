@@ -0,0 +1,123 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+import analytics
+import grading
+import models
+
+
+@pytest.fixture
+def take_exam(db, make_user, submit_attempt):
+    # Students of random skill answer every question; returns the attempts.
+    rnd = random.Random(7)
+
+    def take(db_exam, students):
+        attempts = []
+        for _ in range(students):
+            student = make_user(f"student{db.query(models.User).count()}")
+            skill = rnd.random()
+            chosen = []
+            for question in db_exam.questions:
+                correct = [choice for choice in question.choices if choice.is_correct]
+                wrong = [choice for choice in question.choices if not choice.is_correct]
+                if rnd.random() < skill:
+                    chosen.extend(correct if question.is_multiple_choice and rnd.random() < 0.7 else correct[:1])
+                else:
+                    chosen.append(rnd.choice(wrong))
+            attempts.append(submit_attempt(db_exam, student.id, chosen))
+        grading.grade_attempts(db, db_exam.id)
+        return attempts
+    return take
+
+
+@pytest.fixture
+def db_exam(make_exam):
+    return make_exam([(False, [True, False, False])] * 3 + [(True, [True, True, False])])
+
+
+def item_scores(db, db_exam) -> np.ndarray:
+    key = grading.build_answer_key(db, db_exam.id)
+    attempt_ids = [attempt_id for (attempt_id,) in db.query(models.Attempt.id).order_by(models.Attempt.id)]
+    answer_rows = db.query(models.Answer.attempt_id, models.Answer.choice_id).all()
+    scores, _ = grading.score_selections(key, grading.selection_matrix(key, attempt_ids, answer_rows))
+    return scores.astype(np.float64)
+
+
+def test_report_matches_direct_computation(db, db_exam, take_exam):
+    take_exam(db_exam, 40)
+    report = analytics.exam_analytics(db, db_exam.id)
+
+    scores = item_scores(db, db_exam)
+    totals = scores.sum(axis=1)
+    percent = totals / scores.shape[1] * 100
+    assert report["attempts"] == 40
+    assert report["mean_score"] == pytest.approx(percent.mean())
+    assert report["score_std"] == pytest.approx(percent.std())
+    for column, question in enumerate(report["questions"]):
+        assert question["responses"] == 40
+        assert question["p_value"] == pytest.approx(scores[:, column].mean(), abs=1e-4)
+        rest = totals - scores[:, column]
+        assert question["discrimination"] == pytest.approx(np.corrcoef(scores[:, column], rest)[0, 1], abs=1e-4)
+        assert sum(choice["selections"] for choice in question["choices"]) >= 40
+    k = scores.shape[1]
+    alpha = k / (k - 1) * (1 - scores.var(axis=0).sum() / totals.var())
+    assert report["cronbach_alpha"] == pytest.approx(alpha, abs=1e-4)
+
+
+def test_incremental_refresh_matches_rebuild(db, db_exam, take_exam):
+    take_exam(db_exam, 15)
+    analytics.exam_analytics(db, db_exam.id)
+    take_exam(db_exam, 20)
+    incremental = analytics.exam_analytics(db, db_exam.id)
+
+    analytics.refresh_statistics(db, db_exam.id, rebuild=True)
+    rebuilt = analytics.exam_analytics(db, db_exam.id)
+    assert incremental["attempts"] == rebuilt["attempts"] == 35
+    for name in ("mean_score", "score_std", "cronbach_alpha"):
+        assert incremental[name] == pytest.approx(rebuilt[name])
+    assert incremental["questions"] == rebuilt["questions"]
+
+
+def test_answer_key_change_resets_statistics(db, db_exam, take_exam):
+    take_exam(db_exam, 10)
+    before = analytics.exam_analytics(db, db_exam.id)["questions"][0]["p_value"]
+    for choice in db_exam.questions[0].choices:
+        choice.is_correct = not choice.is_correct
+    db_exam.content_version += 1
+    db.commit()
+
+    after = analytics.exam_analytics(db, db_exam.id)
+    assert after["attempts"] == 10
+    assert after["questions"][0]["p_value"] == pytest.approx(1 - before, abs=1e-4)
+
+
+def test_first_refresh_reuses_a_row_created_concurrently(db, db_exam, take_exam):
+    take_exam(db_exam, 5)
+    # Left behind by a concurrent first refresh that claimed the row.
+    db.add(models.ExamStatistics(exam_id=db_exam.id, content_version=0, attempts=0, score_sum=0, score_sq_sum=0))
+    db.commit()
+
+    db_statistics = analytics.refresh_statistics(db, db_exam.id)
+    assert db_statistics.attempts == 5
+    assert db_statistics.content_version == db_exam.content_version
+    assert db.query(models.ExamStatistics).count() == 1
+
+
+def test_unknown_exam_has_no_statistics(db):
+    assert analytics.refresh_statistics(db, 12345) is None
+    assert analytics.exam_analytics(db, 12345) is None
+
+
+def test_cronbach_alpha_edge_cases():
+    assert analytics.cronbach_alpha(np.asarray([0.25]), 1.0) is None
+    assert analytics.cronbach_alpha(np.asarray([0.25, 0.25]), 0.0) is None
+    assert analytics.cronbach_alpha(np.asarray([0.25, 0.25]), 1.0) == pytest.approx(1.0)
+
+
+def test_rounding_drops_negative_zero_and_non_finite_values():
+    rounded = analytics._optional(np.asarray([-4.44e-16, 0.123456, np.nan, np.inf]))
+    assert rounded == [0.0, 0.1235, None, None]
+    assert math.copysign(1, rounded[0]) == 1
@@ -0,0 +1,142 @@
+import asyncio
+import os
+
+import pytest
+
+import cache
+import http_cache
+
+
+@pytest.fixture
+def tier(tmp_path):
+    return cache.FileTier(str(tmp_path), max_bytes=1 << 20)
+
+
+def test_file_tier_round_trip(tier):
+    assert tier.get("a") is None
+    assert tier.set("a", b"value")
+    assert tier.get("a") == b"value"
+    tier.delete("a")
+    assert tier.get("a") is None
+    assert tier.stats() == {"backend": "file", "hits": 1, "misses": 2, "evictions": 0, "errors": 0, "skipped": 0}
+
+
+def test_file_tier_only_if_absent(tier):
+    assert tier.set("version", b"1", only_if_absent=True)
+    assert not tier.set("version", b"2", only_if_absent=True)
+    assert tier.get("version") == b"1"
+    assert tier.set("version", b"3")
+    assert tier.get("version") == b"3"
+    assert not [name for name in os.listdir(tier.directory) if name.startswith(".")]
+
+
+def test_file_tier_expiry(tier, monkeypatch):
+    tier.set("a", b"old", ttl=10)
+    tier.set("b", b"kept", ttl=100)
+    now = cache.time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 50)
+    assert tier.get("a") is None
+    assert tier.get("b") == b"kept"
+    # An expired entry can be replaced by an only_if_absent write.
+    tier.set("b", b"older", ttl=10)
+    monkeypatch.setattr(cache.time, "time", lambda: now + 100)
+    assert tier.set("b", b"new", only_if_absent=True)
+    assert tier.get("b") == b"new"
+
+
+def test_file_tier_sweep_evicts_least_recently_used(tmp_path):
+    tier = cache.FileTier(str(tmp_path), max_bytes=16 * 1024)
+    for index in range(8):
+        tier.set(f"key{index}", bytes(1024))
+        os.utime(tier._path(f"key{index}"), (index, index))
+    tier.get("key0")  # A hit refreshes the entry.
+    tier.set("big", bytes(10 * 1024))
+    assert tier.stats()["evictions"] > 0
+    assert tier.get("key0") is not None
+    assert tier.get("key1") is None
+    assert sum(os.path.getsize(entry.path) for entry in os.scandir(tmp_path)) <= 16 * 1024
+
+
+def test_lru_tier_evicts_least_recently_used_bytes():
+    tier = cache.LRUTier(max_entries=10, max_bytes=3000)
+    for index in range(3):
+        tier.set(index, bytes(1000))
+    tier.get(0)  # A hit refreshes the entry.
+    tier.set(3, bytes(1000))
+    assert tier.get(1) is None
+    assert tier.get(0) is not None
+    tier.set(0, bytes(500))  # Replacing an entry releases its old size.
+    tier.set("too big", bytes(4000))
+    assert tier.get("too big") is None
+    assert tier.discard_where(lambda key: key == 3) == 1
+    assert tier.stats() == {"entries": 2, "bytes": 1500, "hits": 2, "misses": 2, "evictions": 1}
+
+
+class BrokenTier(cache.SharedTier):
+    name = "broken"
+
+    def __init__(self, retry_seconds):
+        super().__init__(retry_seconds)
+        self.calls = 0
+
+    def _get(self, key):
+        self.calls += 1
+        raise ConnectionError("unreachable")
+
+    _set = _delete = _get
+
+
+def test_failing_tier_is_skipped_until_the_retry_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    tier = BrokenTier(retry_seconds=5)
+    assert tier.get("a") is None
+    assert not tier.set("a", b"x")
+    tier.delete("a")
+    assert tier.get("b") is None  # Skipped reads count as misses.
+    assert tier.calls == 1
+    now[0] += 5
+    assert tier.get("a") is None
+    assert tier.calls == 2
+    assert tier.stats() == {"backend": "broken", "hits": 0, "misses": 1, "evictions": 0, "errors": 2, "skipped": 3}
+
+
+def test_response_caches_share_bodies_through_the_shared_tier(tier):
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return b"body"
+
+    async def scenario():
+        first = http_cache.ResponseCache(10, shared=tier)
+        second = http_cache.ResponseCache(10, shared=tier)
+        # Concurrent misses share one load.
+        bodies = await asyncio.gather(*(first.get_or_load((1, 1, "exam"), loader) for _ in range(3)))
+        assert bodies == [b"body"] * 3
+        assert first.coalesced == 2
+        # Another worker finds the body in the shared tier.
+        assert await second.get_or_load((1, 1, "exam"), loader) == b"body"
+        assert second.local.get((1, 1, "exam")) == b"body"
+
+    asyncio.run(scenario())
+    assert len(loads) == 1
+
+
+def test_version_publish_overrides_fill_and_purges_stale_bodies(tier):
+    versions = http_cache.ExamVersionCache(tier, ttl=30)
+    response_cache = http_cache.ResponseCache(10, shared=tier)
+    response_cache.set((7, 1, "exam"), b"v1")
+    response_cache.set((8, 1, "exam"), b"other")
+
+    versions.fill(7, 1)
+    versions.fill(7, 2)  # A reader never replaces a version already there.
+    assert versions.get(7) == 1
+    versions.publish({7: 2})
+    assert versions.get(7) == 2
+    assert response_cache.local.get((7, 1, "exam")) is None
+    assert response_cache.local.get((8, 1, "exam")) == b"other"
+    versions.publish({7: None})
+    assert versions.get(7) == 0  # Tombstone for a deleted exam.
+    assert asyncio.run(versions.get_async(7)) == 0
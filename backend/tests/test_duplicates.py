@@ -0,0 +1,62 @@
+import numpy as np
+
+import duplicates
+import models
+
+
+def add_question(db, db_exam, text, choices):
+    db_question = models.Question(
+        exam_id=db_exam.id, question_text=text, is_multiple_choice=False,
+        choices=[models.Choice(choice_text=choice, is_correct=index == 0) for index, choice in enumerate(choices)],
+    )
+    db.add(db_question)
+    db.commit()
+    return db_question
+
+
+def jaccard(first: str, second: str) -> float:
+    a, b = set(duplicates.shingles(first).tolist()), set(duplicates.shingles(second).tolist())
+    return len(a & b) / len(a | b)
+
+
+def test_normalized_document_ignores_case_punctuation_and_choice_order():
+    assert duplicates.normalized_document("What is 2 + 2?", ["Four", "five"]) == \
+        duplicates.normalized_document("what is 2+2", ["FIVE", "four."])
+
+
+def test_minhash_estimates_jaccard_similarity():
+    first = "which planet in the solar system is known as the red planet\nmars\nvenus\njupiter"
+    second = "which planet in the solar system is called the red planet\nmars\nvenus\nsaturn"
+    signature = duplicates.minhash(first)
+    assert signature.shape == (duplicates.NUM_PERMUTATIONS,)
+    assert np.array_equal(signature, duplicates.minhash(first))
+    estimate = (signature == duplicates.minhash(second)).mean()
+    assert abs(estimate - jaccard(first, second)) < 0.2
+
+
+def test_short_documents_still_get_a_signature():
+    assert duplicates.minhash("ab").shape == (duplicates.NUM_PERMUTATIONS,)
+
+
+def test_near_duplicates_are_found_across_exams(db, make_exam):
+    first_exam, second_exam = make_exam([]), make_exam([])
+    original = add_question(db, first_exam, "What is the capital city of France?", ["Paris", "London", "Berlin"])
+    copy = add_question(db, second_exam, "what is the capital city of france", ["Berlin", "Paris", "London"])
+    other = add_question(db, second_exam, "How many legs does a spider have?", ["Eight", "Six", "Ten"])
+    assert duplicates.reindex_all(db) == 3
+
+    matches = duplicates.find_near_duplicates(db, [original.id, other.id])
+    assert matches[original.id] == [{"question_id": copy.id, "exam_id": second_exam.id, "similarity": 1.0}]
+    assert matches[other.id] == []
+
+
+def test_cluster_bank_groups_near_duplicates(db, make_exam):
+    db_exam = make_exam([])
+    first = add_question(db, db_exam, "Which gas do plants absorb from the air?", ["Carbon dioxide", "Oxygen"])
+    second = add_question(db, db_exam, "Which gas do plants absorb from the air", ["oxygen", "carbon dioxide"])
+    lone = add_question(db, db_exam, "Who wrote the novel Moby Dick?", ["Herman Melville", "Mark Twain"])
+    duplicates.reindex_all(db)
+
+    assert duplicates.cluster_bank(db) == {"questions": 3, "clusters": 1, "clustered_questions": 2}
+    clusters = dict(db.query(models.QuestionSignature.question_id, models.QuestionSignature.cluster_id))
+    assert clusters == {first.id: first.id, second.id: first.id, lone.id: None}
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import grading
+
+SINGLE, MULTIPLE = 0, 1
+
+
+@pytest.fixture
+def key():
+    # A single choice question with choices 10 (correct) and 11, and a
+    # multiple choice question with choices 20, 21 (correct) and 22.
+    return grading.AnswerKey(
+        question_ids=[1, 2],
+        is_multiple=[False, True],
+        choice_ids=[10, 11, 20, 21, 22],
+        choice_questions=[0, 0, 1, 1, 1],
+        correct=[True, False, True, True, False],
+    )
+
+
+def selections(key, *chosen):
+    return np.asarray([np.isin(key.choice_ids, row) for row in chosen])
+
+
+def test_single_choice_needs_exactly_the_correct_choice(key):
+    item_scores, _ = grading.score_selections(key, selections(key, [10], [11], [10, 11], []))
+    assert item_scores[:, SINGLE].tolist() == [1, 0, 0, 0]
+
+
+def test_multiple_choice_gives_partial_credit_minus_wrong_choices(key):
+    item_scores, _ = grading.score_selections(key, selections(key, [20, 21], [20], [20, 22], [20, 21, 22], [22]))
+    assert item_scores[:, MULTIPLE].tolist() == [1, 0.5, 0, 0.5, 0]
+
+
+def test_totals_are_percent_of_all_questions(key):
+    _, totals = grading.score_selections(key, selections(key, [10, 20, 21], [10, 20], []))
+    assert totals.tolist() == pytest.approx([100, 75, 0])
+
+
+def test_totals_only_count_drawn_questions(key):
+    drawn = np.asarray([[True, False], [False, True], [False, False]])
+    _, totals = grading.score_selections(key, selections(key, [10, 22], [11, 20], [10]), drawn)
+    assert totals.tolist() == pytest.approx([100, 50, 0])
+
+
+def test_unknown_choices_are_ignored(key):
+    matrix = grading.selection_matrix(key, [5, 6], [(5, 10), (5, 999), (6, 21)])
+    assert matrix.tolist() == [[True, False, False, False, False], [False, False, False, True, False]]
+    assert key.question_of_choice(21) == 2
+    assert key.question_of_choice(999) is None
+
+
+def test_empty_exam_scores_zero():
+    key = grading.AnswerKey([], [], [], [], [])
+    item_scores, totals = grading.score_selections(key, np.zeros((2, 0), dtype=bool))
+    assert item_scores.shape == (2, 0)
+    assert totals.tolist() == [0, 0]
+
+
+def test_grade_attempts_stores_scores(db, make_exam, make_user, submit_attempt):
+    db_exam = make_exam([(False, [True, False]), (True, [True, True, False])])
+    single, multiple = db_exam.questions
+    student = make_user("student")
+    perfect = submit_attempt(db_exam, student.id, [single.choices[0], *multiple.choices[:2]])
+    half = submit_attempt(db_exam, student.id, [single.choices[1], multiple.choices[0]])
+    partial = submit_attempt(db_exam, student.id, [single.choices[0]], question_ids=[single.id])
+
+    assert grading.grade_attempts(db, db_exam.id) == 3
+    for db_attempt in (perfect, half, partial):
+        db.refresh(db_attempt)
+    assert [perfect.score, half.score, partial.score] == pytest.approx([100, 25, 100])
+    assert perfect.graded_at is not None
+    # Only submitted, ungraded attempts are picked up again.
+    assert grading.grade_attempts(db, db_exam.id) == 0
@@ -0,0 +1,95 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import crud
+import results_export
+
+
+@pytest.fixture
+def exams(db, make_exam, make_user, submit_attempt):
+    # Two exams of one owner with submitted attempts, one open attempt, and
+    # an exam of another owner.
+    first = make_exam([(False, [True, False]), (True, [True, True, False])])
+    second = make_exam([(False, [False, True])])
+    second.owner_id = first.owner_id
+    other = make_exam([(False, [True, False])])
+    db.commit()
+    student = make_user("student")
+    for index in range(5):
+        question = first.questions[index % 2]
+        submit_attempt(first, student.id, question.choices[:1 + index % 2])
+    submit_attempt(second, student.id, second.questions[0].choices[1:])
+    crud.create_attempt(db, first.id, student.id, lambda _: [])  # Not submitted.
+    submit_attempt(other, student.id, [])
+    return first, second, other
+
+
+def export(db, fmt, **scope) -> bytes:
+    return b"".join(results_export.export_results(db, fmt, batch_size=2, **scope))
+
+
+def jsonl_records(data: bytes) -> list:
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+def test_jsonl_export_of_an_exam(db, exams):
+    first, _, _ = exams
+    records = jsonl_records(export(db, "jsonl", exam_id=first.id))
+    assert len(records) == 5
+    assert [record["attempt_id"] for record in records] == sorted(record["attempt_id"] for record in records)
+    assert set(records[0]) == set(results_export.FIELDS)
+    assert records[0]["username"] == "student"
+    assert records[0]["answers"] == {str(first.questions[0].id): [first.questions[0].choices[0].id]}
+    assert records[1]["answers"] == {str(first.questions[1].id): [choice.id for choice in first.questions[1].choices[:2]]}
+
+
+def test_csv_export_matches_jsonl(db, exams):
+    first, _, _ = exams
+    rows = list(csv.DictReader(io.StringIO(export(db, "csv", exam_id=first.id).decode())))
+    records = jsonl_records(export(db, "jsonl", exam_id=first.id))
+    assert [int(row["attempt_id"]) for row in rows] == [record["attempt_id"] for record in records]
+    assert [json.loads(row["answers"]) for row in rows] == [record["answers"] for record in records]
+    assert rows[0]["graded_at"] == ""
+
+
+def test_export_resumes_after_the_last_attempt_received(db, exams):
+    first, _, _ = exams
+    records = jsonl_records(export(db, "jsonl", exam_id=first.id))
+    resumed = jsonl_records(export(db, "jsonl", exam_id=first.id, after_id=records[2]["attempt_id"]))
+    assert resumed == records[3:]
+    assert export(db, "jsonl", exam_id=first.id, after_id=records[-1]["attempt_id"]) == b""
+
+
+def test_owner_export_covers_every_exam_of_the_owner(db, exams):
+    first, second, other = exams
+    records = jsonl_records(export(db, "jsonl", owner_id=first.owner_id))
+    assert {record["exam_id"] for record in records} == {first.id, second.id}
+    assert len(records) == 6
+
+
+def test_gzip_chunks_round_trip(db, exams):
+    first, _, _ = exams
+    data = export(db, "csv", exam_id=first.id)
+    compressed = b"".join(results_export.gzip_chunks(results_export.export_results(db, "csv", exam_id=first.id)))
+    assert gzip.decompress(compressed) == data
+
+
+def test_parquet_export(db, exams):
+    pq = pytest.importorskip("pyarrow.parquet")
+    first, _, _ = exams
+    table = pq.read_table(io.BytesIO(export(db, "parquet", exam_id=first.id)))
+    assert table.column_names == results_export.FIELDS
+    assert table.num_rows == 5
+    records = jsonl_records(export(db, "jsonl", exam_id=first.id))
+    assert table.column("attempt_id").to_pylist() == [record["attempt_id"] for record in records]
+    assert [json.loads(answers) for answers in table.column("answers").to_pylist()] == \
+        [record["answers"] for record in records]
+
+
+def test_unknown_format_is_rejected(db):
+    with pytest.raises(ValueError):
+        list(results_export.export_results(db, "xlsx", exam_id=1))
@@ -0,0 +1,112 @@
+import io
+
+import pytest
+
+import models
+import roster
+from passwords import pwd_context
+
+HEADER = "username,email,password,name,surname,role\n"
+
+
+def import_csv(db, text: str, **options) -> dict:
+    return roster.import_roster(db, io.StringIO(text), "csv", **options)
+
+
+def statuses(report: dict) -> list:
+    return [(row["row"], row["username"], row["status"]) for row in report["rows"]]
+
+
+def test_roster_report(db, make_user):
+    make_user("taken")
+    report = import_csv(db, HEADER + "\n".join([
+        "ann,ann@example.com,secret1,Ann,Lee,",
+        "bob,bob@example.com,,Bob,Ray,teacher",
+        "taken,new@example.com,pw,T,T,",
+        "ann,other@example.com,pw,A,A,",
+        "eve,not-an-email,pw,E,E,",
+        "max,taken@example.com,pw,M,M,",
+        "zed,zed@example.com,pw,Z,Z,wizard",
+    ]) + "\n")
+
+    assert report["created"] == 2
+    assert statuses(report) == [
+        (2, "ann", "created"), (3, "bob", "created"), (4, "taken", "error"), (5, "ann", "error"),
+        (6, "eve", "error"), (7, "max", "error"), (8, "zed", "error"),
+    ]
+    errors = [row.get("error") for row in report["rows"]]
+    assert errors[2] == "Username 'taken' is already taken"
+    assert errors[3] == "Duplicate username 'ann' in the roster"
+    assert errors[4].startswith("email:")
+    assert errors[5] == "Email 'taken@example.com' is already registered"
+    assert errors[6] == "role must be one of student, teacher, admin"
+
+    ann, bob = report["rows"][:2]
+    assert "password" not in ann
+    users = {user.username: user for user in db.query(models.User)}
+    assert users["ann"].id == ann["id"] and users["ann"].role == "student"
+    assert pwd_context.verify("secret1", users["ann"].hashed_password)
+    # Generated passwords are handed back once, in the report.
+    assert pwd_context.verify(bob["password"], users["bob"].hashed_password)
+    assert users["bob"].role == "teacher"
+
+
+def test_teachers_can_only_enroll_students(db):
+    report = import_csv(db, HEADER + "t1,t1@example.com,pw,T,T,teacher\ns1,s1@example.com,pw,S,S,\n",
+                        allowed_roles=("student",))
+    assert statuses(report) == [(2, "t1", "error"), (3, "s1", "created")]
+    assert report["rows"][0]["error"] == "role must be one of student"
+
+
+def test_dry_run_creates_nothing(db):
+    report = import_csv(db, HEADER + "ann,ann@example.com,pw,Ann,Lee,\nbad,bad,pw,B,B,\n", dry_run=True)
+    assert report["created"] == 0
+    assert statuses(report) == [(2, "ann", "valid"), (3, "bad", "error")]
+    assert db.query(models.User).count() == 0
+
+
+def test_jsonl_and_json_rosters(db):
+    report = roster.import_roster(db, io.StringIO(
+        '{"username": "ann", "email": "ann@example.com", "password": "pw", "name": "Ann", "surname": "Lee"}\n'
+        "not json\n"
+        "[1]\n"
+    ), "jsonl")
+    assert statuses(report) == [(1, "ann", "created"), (2, None, "error"), (3, None, "error")]
+    assert report["rows"][1]["error"].startswith("Invalid JSON")
+    assert report["rows"][2]["error"] == "Expected an object"
+
+    report = roster.import_roster(db, io.StringIO('{"username": "bob"}'), "json")
+    assert report["rows"] == [{"row": 1, "username": None, "status": "error", "error": "Expected a JSON array of users"}]
+
+
+def test_roster_size_is_limited(db, monkeypatch):
+    monkeypatch.setattr(roster, "MAX_ROSTER_ROWS", 2)
+    rows = "".join(f"u{index},u{index}@example.com,pw,U,U,\n" for index in range(3))
+    with pytest.raises(roster.RosterTooLarge):
+        import_csv(db, HEADER + rows)
+    assert db.query(models.User).count() == 0
+
+
+def test_import_route_rejects_invalid_utf8(db):
+    from fastapi.testclient import TestClient
+
+    import main
+    from principals import Principal
+
+    main.app.dependency_overrides[main.get_current_user] = lambda: Principal(id=1, username="admin", role="admin")
+    try:
+        response = TestClient(main.app).post("/users/import", files={"file": ("roster.csv", b"\xff\xfe")})
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.status_code == 400
+    assert response.json() == {"detail": "The file is not valid UTF-8"}
+
+
+def test_hash_many_keeps_the_order_of_passwords():
+    from passwords import PasswordHasher
+
+    hasher = PasswordHasher(workers=2, queue_size=0)
+    passwords = [f"password{index}" for index in range(5)]
+    hashed = hasher.hash_many(passwords)
+    assert [pwd_context.verify(password, hash_) for password, hash_ in zip(passwords, hashed)] == [True] * 5
+    assert hasher.stats() == {"workers": 2, "submitted": 5, "rejected": 0}
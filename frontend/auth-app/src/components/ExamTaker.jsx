@@ -1,147 +1,193 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect, useContext, useRef, useCallback } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { UserContext } from '../context/UserContext';
 import { useNotification } from '../context/NotificationContext';
 
+const formatRemaining = (seconds) => {
+  const minutes = Math.floor(seconds / 60);
+  return `${minutes}:${String(seconds % 60).padStart(2, '0')}`;
+};
+
 const ExamTaker = () => {
   const [token] = useContext(UserContext);
   const { addNotification } = useNotification();
+  const [attemptId, setAttemptId] = useState(null);
   const [questions, setQuestions] = useState([]);
-  const [choices, setChoices] = useState({});
   const [answers, setAnswers] = useState({});
-  const [feedback, setFeedback] = useState([]);
+  const [remaining, setRemaining] = useState(null);
   const [totalScore, setTotalScore] = useState(null);
   const [examTitle, setExamTitle] = useState('');
   const [isSubmitted, setIsSubmitted] = useState(false);
+  const [isConnected, setIsConnected] = useState(false);
+  const socketRef = useRef(null);
+  const seqRef = useRef(0);
+  const closedRef = useRef(false);
   const { examId } = useParams();
   const navigate = useNavigate();
+  const storageKey = `exam-${examId}-attempt`;
 
+  // An open attempt is resumed after a reload instead of starting a new one.
   useEffect(() => {
-    const fetchExamDetails = async () => {
+    const headers = {
+      'Content-Type': 'application/json',
+      Authorization: `Bearer ${token}`,
+    };
+    const loadLayout = async (id) => {
+      const response = await fetch(`http://localhost:8000/attempts/${id}/exam`, { method: 'GET', headers });
+      if (!response.ok) {
+        return false;
+      }
+      const data = await response.json();
+      setExamTitle(data.title);
+      setQuestions(data.questions);
+      setAttemptId(id);
+      return true;
+    };
+    const startAttempt = async () => {
       try {
-        const response = await fetch(`http://localhost:8000/exam/${examId}`, {
-          method: 'GET',
-          headers: {
-            'Content-Type': 'application/json',
-            Authorization: `Bearer ${token}`,
-          },
-        });
-
-        if (response.ok) {
-          const data = await response.json();
-          setExamTitle(data.title);
-          fetchQuestions();
-        } else {
+        const storedId = sessionStorage.getItem(storageKey);
+        if (storedId && await loadLayout(storedId)) {
+          return;
+        }
+        const response = await fetch(`http://localhost:8000/exam/${examId}/attempts`, { method: 'POST', headers });
+        if (!response.ok) {
+          addNotification(response.status === 403 ? 'The exam is closed' : 'Failed to start the attempt', 'error');
+          return;
+        }
+        const attempt = await response.json();
+        sessionStorage.setItem(storageKey, attempt.id);
+        if (!await loadLayout(attempt.id)) {
           addNotification('Failed to load exam details', 'error');
         }
       } catch (error) {
         addNotification('An error occurred while fetching exam details', 'error');
       }
     };
-
-    const fetchQuestions = async () => {
-      try {
-        const response = await fetch(`http://localhost:8000/exams/${examId}/questions`, {
-          method: 'GET',
-          headers: {
-            'Content-Type': 'application/json',
-            Authorization: `Bearer ${token}`,
-          },
-        });
-
-        if (response.ok) {
-          const data = await response.json();
-          setQuestions(data);
-          data.forEach(question => fetchChoices(question.id));
-        } else {
-          addNotification('Failed to load exam questions', 'error');
+    startAttempt();
+  }, [examId, token, storageKey, addNotification]);
+
+  // Answers are autosaved over the session socket; the server also pushes the
+  // countdown and closes the attempt when time is up.
+  const connect = useCallback(() => {
+    const socket = new WebSocket(`ws://localhost:8000/attempts/${attemptId}/session?token=${encodeURIComponent(token)}`);
+    socketRef.current = socket;
+    socket.onopen = () => setIsConnected(true);
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'state') {
+        setAnswers(message.answers);
+        setRemaining(message.remaining_seconds);
+      } else if (message.type === 'tick') {
+        setRemaining(message.remaining_seconds);
+      } else if (message.type === 'closed') {
+        closedRef.current = true;
+        sessionStorage.removeItem(storageKey);
+        setIsSubmitted(true);
+        setRemaining(null);
+        setTotalScore(message.score);
+        addNotification(
+          message.reason === 'time_up'
+            ? `Time is up! Your score: ${message.score.toFixed(2)}%`
+            : `Exam submitted! Your score: ${message.score.toFixed(2)}%`,
+          'success'
+        );
+      } else if (message.type === 'error') {
+        if (message.detail === 'Attempt has already been submitted') {
+          closedRef.current = true;
+          sessionStorage.removeItem(storageKey);
+          setIsSubmitted(true);
         }
-      } catch (error) {
-        addNotification('An error occurred while fetching questions', 'error');
+        addNotification(message.detail, 'error');
       }
     };
+    socket.onclose = () => {
+      setIsConnected(false);
+      if (!closedRef.current && socketRef.current === socket) {
+        setTimeout(() => {
+          if (socketRef.current === socket) {
+            connect();
+          }
+        }, 2000);
+      }
+    };
+  }, [attemptId, token, storageKey, addNotification]);
 
-    const fetchChoices = async (questionId) => {
-      try {
-        const response = await fetch(`http://localhost:8000/exam/${examId}/question/${questionId}/choices`, {
-          method: 'GET',
-          headers: {
-            'Content-Type': 'application/json',
-            Authorization: `Bearer ${token}`,
-          },
-        });
-
-        if (response.ok) {
-          const data = await response.json();
-          setChoices(prevChoices => ({ ...prevChoices, [questionId]: data }));
-        } else {
-          addNotification(`Failed to load choices for question ID: ${questionId}`, 'error');
-        }
-      } catch (error) {
-        addNotification(`An error occurred while fetching choices for question ID: ${questionId}`, 'error');
+  useEffect(() => {
+    if (attemptId === null) {
+      return undefined;
+    }
+    closedRef.current = false;
+    connect();
+    return () => {
+      const socket = socketRef.current;
+      socketRef.current = null;
+      if (socket) {
+        socket.close();
       }
     };
-    fetchExamDetails()
-  }, [examId, token, addNotification]);
+  }, [attemptId, connect]);
 
-  const handleAnswerChange = (questionId, choiceIndex) => {
-    if (!isSubmitted) {
-      setAnswers(prevAnswers => {
-        const currentAnswers = prevAnswers[questionId] || [];
-        if (currentAnswers.includes(choiceIndex)) {
-          return { ...prevAnswers, [questionId]: currentAnswers.filter(index => index !== choiceIndex) };
-        } else {
-          return { ...prevAnswers, [questionId]: [...currentAnswers, choiceIndex] };
-        }
-      });
+  // Counts down locally between the server's ticks.
+  useEffect(() => {
+    if (remaining === null || remaining <= 0) {
+      return undefined;
+    }
+    const timer = setTimeout(() => setRemaining(value => (value === null ? null : Math.max(0, value - 1))), 1000);
+    return () => clearTimeout(timer);
+  }, [remaining]);
+
+  const send = (message) => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify(message));
+      return true;
     }
+    return false;
   };
 
-  const handleSubmit = () => {
-    const newFeedback = questions.map(question => {
-      const userAnswerIndexes = answers[question.id] || [];
-      const correctIndexes = choices[question.id]
-        ?.map((choice, index) => (choice.is_correct ? index : -1))
-        .filter(index => index !== -1);
-
-      const correctCount = userAnswerIndexes.filter(index => correctIndexes.includes(index)).length;
-      const totalCorrectChoices = correctIndexes.length;
-      const questionScore = totalCorrectChoices > 0 ? correctCount / totalCorrectChoices : 0;
-
-      const isCorrect = question.is_multiple_choice
-        ? questionScore === 1
-        : userAnswerIndexes[0] === correctIndexes[0];
-
-      const isPartiallyCorrect = question.is_multiple_choice && questionScore > 0 && questionScore < 1;
-
-      return {
-        questionId: question.id,
-        isCorrect: isCorrect,
-        isPartiallyCorrect: isPartiallyCorrect,
-        chosen: userAnswerIndexes,
-        correct: correctIndexes,
-        questionScore: questionScore,
-      };
-    });
-
-    const totalScore = (newFeedback.reduce((sum, feedbackItem) => sum + feedbackItem.questionScore, 0) / questions.length) * 100;
+  const handleAnswerChange = (question, choiceId) => {
+    if (isSubmitted) {
+      return;
+    }
+    const current = answers[question.id] || [];
+    let selection;
+    if (!question.is_multiple_choice) {
+      selection = [choiceId];
+    } else if (current.includes(choiceId)) {
+      selection = current.filter(id => id !== choiceId);
+    } else {
+      selection = [...current, choiceId];
+    }
+    setAnswers(prevAnswers => ({ ...prevAnswers, [question.id]: selection }));
+    seqRef.current += 1;
+    if (!send({ type: 'answer', question_id: question.id, choice_ids: selection, seq: seqRef.current })) {
+      addNotification('Connection lost, reconnecting...', 'error');
+    }
+  };
 
-    setFeedback(newFeedback);
-    setTotalScore(totalScore);
-    setIsSubmitted(true);
-    addNotification(`Exam submitted! Your score: ${totalScore.toFixed(2)}%`, 'success');
+  const handleSubmit = () => {
+    if (!send({ type: 'submit' })) {
+      addNotification('Connection lost, try again in a moment', 'error');
+    }
   };
 
   const handleGoBack = () => {
-    const confirmLeave = window.confirm('Are you sure you want to leave the exam? Your answers will not be saved.');
+    const confirmLeave = isSubmitted || window.confirm(
+      'Are you sure you want to leave the exam? Your answers are saved and the timer keeps running.'
+    );
     if (confirmLeave) {
       navigate(-1);
     }
   };
 
+  const choiceText = (question, choiceId) => question.choices.find(choice => choice.id === choiceId)?.choice_text;
+
   return (
     <div className="container">
       <h2 className="title">{examTitle || 'Loading...'}</h2>
+      {remaining !== null && (
+        <p className="subtitle">Time remaining: {formatRemaining(remaining)}</p>
+      )}
       {questions.length === 0 ? (
         <p>Loading questions...</p>
       ) : (
@@ -150,38 +196,25 @@ const ExamTaker = () => {
             <h3>{index + 1}. {question.question_text}</h3>
             {question.image_path && (
               <img
-                src={question.image_path}
+                src={`${question.image_path}?w=1024`}
                 alt={`Image for question ${index + 1}`}
                 style={{ maxWidth: '100%', height: 'auto', marginBottom: '10px' }}
               />
             )}
-            {choices[question.id] ? choices[question.id].map((choice, choiceIndex) => {
-              let choiceClass = '';
-
-              if (feedback.length > 0) {
-                const feedbackItem = feedback.find(f => f.questionId === question.id);
-                if (feedbackItem) {
-                  const isChosen = Array.isArray(answers[question.id]) && answers[question.id].includes(choiceIndex);
-                  const isCorrectChoice = feedbackItem.correct.includes(choiceIndex);
-                  choiceClass = isCorrectChoice ? 'correct' : isChosen ? 'incorrect' : '';
-                }
-              }
-
-              return (
-                <div key={choice.id} className={`choice ${choiceClass}`} style={{ marginBottom: '10px' }}>
-                  <label className="checkbox">
-                    <input
-                      type={question.is_multiple_choice ? 'checkbox' : 'radio'}
-                      name={question.id}
-                      checked={Array.isArray(answers[question.id]) ? answers[question.id].includes(choiceIndex) : answers[question.id] === choiceIndex}
-                      onChange={() => handleAnswerChange(question.id, choiceIndex)}
-                      disabled={isSubmitted}
-                    />
-                    {choice.choice_text}
-                  </label>
-                </div>
-              );
-            }) : <p>Loading choices...</p>}
+            {question.choices.map(choice => (
+              <div key={choice.id} className="choice" style={{ marginBottom: '10px' }}>
+                <label className="checkbox">
+                  <input
+                    type={question.is_multiple_choice ? 'checkbox' : 'radio'}
+                    name={question.id}
+                    checked={(answers[question.id] || []).includes(choice.id)}
+                    onChange={() => handleAnswerChange(question, choice.id)}
+                    disabled={isSubmitted || !isConnected}
+                  />
+                  {choice.choice_text}
+                </label>
+              </div>
+            ))}
           </div>
         ))
       )}
@@ -189,21 +222,21 @@ const ExamTaker = () => {
         <button className="button is-danger" onClick={handleGoBack}>
           Go Back
         </button>
-        <button className="button is-success" onClick={handleSubmit}>
-          Check Answers
+        <button className="button is-success" onClick={handleSubmit} disabled={isSubmitted || !isConnected}>
+          Submit
         </button>
       </div>
 
       {totalScore !== null && (
         <div className="result">
           <h3>Your Score: {totalScore.toFixed(2)}%</h3>
-          <h4>Feedback:</h4>
+          <h4>Your answers:</h4>
           <ul>
-            {feedback.map((f, index) => (
-              <li key={index}>
-                Question {index + 1}: {f.isCorrect ? 'Correct' : f.isPartiallyCorrect ? 'Partially Correct' : 'Incorrect'}
-                (Your answer: {f.chosen.length > 0 ? f.chosen.map(idx => choices[questions[index].id][idx]?.choice_text).join(', ') : 'None'},
-                Correct answer: {f.correct.length > 0 ? f.correct.map(idx => choices[questions[index].id][idx]?.choice_text).join(', ') : 'None'} )
+            {questions.map((question, index) => (
+              <li key={question.id}>
+                Question {index + 1}: {(answers[question.id] || []).length > 0
+                  ? answers[question.id].map(id => choiceText(question, id)).join(', ')
+                  : 'None'}
               </li>
             ))}
           </ul>
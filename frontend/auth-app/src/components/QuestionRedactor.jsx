@@ -205,6 +205,7 @@ const QuestionRedactor = () => {
     if (!validateQuestions()) return;
 
     try {
+        const updatedQuestions = [];
         for (const question of questions) {
             let imageUrl = null;
 
@@ -231,28 +232,46 @@ const QuestionRedactor = () => {
                 imageUrl = question.image;
             }
 
-            const requestOptions = {
-                method: question.id ? "PUT" : "POST",
+            const payload = {
+                question_text: question.questionText,
+                choices: question.choices,
+                is_multiple_choice: question.is_multiple_choice,
+                image_path: imageUrl,
+            };
+
+            // Existing questions are saved together in one batch below.
+            if (question.id) {
+                updatedQuestions.push({ id: question.id, ...payload });
+                continue;
+            }
+
+            const response = await fetch(`http://localhost:8000/exam/${examId}/question/`, {
+                method: "POST",
                 headers: {
                     "Content-Type": "application/json",
                     Authorization: `Bearer ${token}`,
                 },
-                body: JSON.stringify({
-                    question_text: question.questionText,
-                    choices: question.choices,
-                    is_multiple_choice: question.is_multiple_choice,
-                    image_path: imageUrl,
-                }),
-            };
-
-            const url = question.id
-                ? `http://localhost:8000/exam/${examId}/question/${question.id}`
-                : `http://localhost:8000/exam/${examId}/question`;
+                body: JSON.stringify(payload),
+            });
+            if (!response.ok) {
+                const errorData = await response.json();
+                addNotification(`Error: ${errorData.detail || "Failed to create question"}`, "error");
+                return;
+            }
+        }
 
-            const response = await fetch(url, requestOptions);
+        if (updatedQuestions.length > 0) {
+            const response = await fetch(`http://localhost:8000/exam/${examId}/questions`, {
+                method: "PATCH",
+                headers: {
+                    "Content-Type": "application/json",
+                    Authorization: `Bearer ${token}`,
+                },
+                body: JSON.stringify(updatedQuestions),
+            });
             if (!response.ok) {
                 const errorData = await response.json();
-                addNotification(`Error: ${errorData.detail || "Failed to create or update question"}`, "error");
+                addNotification(`Error: ${errorData.detail || "Failed to update questions"}`, "error");
                 return;
             }
         }